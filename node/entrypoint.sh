@@ -17,4 +17,13 @@ if [ ! -f /etc/xray/config.json ]; then
 EOF
 fi
 
+# Файлы, с которыми supervisord запускает xray / xray_b; агент обновляет их вместе с config.json
+# (в режиме graceful — с SO_REUSEPORT)
+for slot_config in "${XRAY_RUN_CONFIG_A:-/etc/xray/config.a.json}" "${XRAY_RUN_CONFIG_B:-/etc/xray/config.b.json}"; do
+  if [ ! -f "$slot_config" ]; then
+    cp /etc/xray/config.json "$slot_config"
+    chown xrayapi:xrayapi "$slot_config"
+  fi
+done
+
 exec "$@"
@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# Модуль агента читает пути и ключ из окружения при импорте — всё во временный каталог
+_dir = tempfile.mkdtemp()
+os.environ.setdefault("XRAY_NODE_KEY", "test-key")
+os.environ.setdefault("XRAY_CONFIG_PATH", os.path.join(_dir, "config.json"))
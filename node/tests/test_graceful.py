@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+import pytest
+
+from xray_agent import app as agent
+
+
+def _config(port: int):
+    return {
+        "log": {"loglevel": "warning"},
+        "api": {"tag": "api", "services": ["HandlerService", "StatsService"]},
+        "inbounds": [
+            {"tag": "api", "listen": "127.0.0.1", "port": 10085, "protocol": "dokodemo-door"},
+            {"tag": "main", "port": port, "protocol": "vless", "settings": {"clients": []}},
+        ],
+        "outbounds": [{"protocol": "freedom"}],
+    }
+
+
+@pytest.fixture
+def supervisor(monkeypatch):
+    """supervisorctl и xray -test заглушены; states — состояние программ так, как его видел бы supervisord."""
+    states = {"xray": "RUNNING", "xray_b": "STOPPED"}
+    calls = []
+
+    async def supervisorctl(action, program):
+        calls.append((action, program))
+        states[program] = "STOPPED" if action == "stop" else "RUNNING"
+
+    async def test_config(path):
+        return None
+
+    monkeypatch.setattr(agent, "XRAY_RESTART_MODE", "graceful")
+    monkeypatch.setattr(agent, "XRAY_GRACE_SECONDS", 0)
+    monkeypatch.setattr(agent, "XRAY_ROLLBACK_CHECK_SECONDS", 0)
+    monkeypatch.setattr(agent, "_supervisorctl", supervisorctl)
+    monkeypatch.setattr(agent, "_test_config", test_config)
+    monkeypatch.setattr(agent, "process_info", lambda url, program: {"state": states[program]})
+    monkeypatch.setitem(agent._state, "program", "xray")
+    return states, calls
+
+
+def test_graceful_restart_alternates_slots(supervisor):
+    states, calls = supervisor
+    current = _config(443)
+    # Как после entrypoint: оба слота — копия config.json без SO_REUSEPORT
+    for path in (agent.XRAY_CONFIG_PATH, agent.XRAY_RUN_CONFIG_A, agent.XRAY_RUN_CONFIG_B):
+        with open(path, "w") as f:
+            json.dump(current, f)
+
+    async def run():
+        nonlocal current
+        programs = []
+        for port in (444, 445, 446):
+            config = _config(port)
+            result = await agent._apply(config, None, current)
+            await asyncio.sleep(0.05)  # остановка старого слота после grace-периода
+            programs.append(result["program"])
+            current = config
+        return programs
+
+    programs = asyncio.run(run())
+
+    # Первое применение один раз перезапускает xray уже с SO_REUSEPORT, дальше слоты чередуются
+    assert programs == ["xray", "xray_b", "xray"]
+    assert calls == [
+        ("restart", "xray"),
+        ("start", "xray_b"),
+        ("stop", "xray"),
+        ("start", "xray"),
+        ("stop", "xray_b"),
+    ]
+    assert states == {"xray": "RUNNING", "xray_b": "STOPPED"}
+
+    with open(agent.XRAY_CONFIG_PATH) as f:
+        assert json.load(f) == _config(446)
+    assert agent._has_reuseport(agent.XRAY_RUN_CONFIG_A)
+    with open(agent.XRAY_RUN_CONFIG_A) as f:
+        assert json.load(f)["inbounds"][1]["port"] == 446
+
+
+def test_api_inbound_is_not_shared_between_slots(supervisor):
+    config = _config(443)
+    for program, api_port in (("xray", 10085), ("xray_b", 10086)):
+        api, main = agent._with_reuseport(config, program)["inbounds"]
+        # gRPC API слушает только свой процесс: hot-apply и статистика не уходят в дослуживающий слот
+        assert "streamSettings" not in api
+        assert api["port"] == api_port
+        assert agent._REUSEPORT_SOCKOPT in main["streamSettings"]["sockopt"]["customSockopt"]
+        agent._state["program"] = program
+        assert agent._api_address(config) == f"127.0.0.1:{api_port}"
+
+
+def test_graceful_requires_separate_slot_files(supervisor, monkeypatch):
+    monkeypatch.setitem(agent._SLOTS, "xray", agent.XRAY_CONFIG_PATH)
+    # Слот на config.json: blue/green невозможен, агент перезапускает Xray обычным способом
+    assert not agent._graceful()
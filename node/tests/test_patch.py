@@ -0,0 +1,17 @@
+from xray_agent import app as agent
+
+
+def _config(*emails):
+    clients = [{"id": f"uuid-{email}", "email": email, "level": 0} for email in emails]
+    return {"inbounds": [{"tag": "inbound-1", "port": 443, "protocol": "vless", "settings": {"clients": clients}}]}
+
+
+def test_delta_keeps_panel_client_order():
+    current = _config("1.a", "3.c", "u2.x")
+    added = _config("2.b", "u1.y")["inbounds"][0]["settings"]["clients"]
+    delta = {"clients": {"inbound-1": {"added": added, "removed": [], "changed": []}}}
+
+    patched = agent._patch_config(current, delta)
+    # Тот же конфиг, что панель прислала бы целиком: хэш совпадает, и повтор снапшота — noop
+    assert patched == _config("1.a", "2.b", "3.c", "u1.y", "u2.x")
+    assert agent._config_hash(patched) == agent._config_hash(_config("1.a", "2.b", "3.c", "u1.y", "u2.x"))
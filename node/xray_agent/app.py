@@ -1,19 +1,65 @@
 import os
 import json
+import asyncio
+import hashlib
+import logging
 import tempfile
-import subprocess
-from typing import Optional, Set
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from fastapi import FastAPI, Header, HTTPException, Request
 
+from . import metrics
+from .history import ConfigHistory
+from .pull import ConfigPuller
+from .system import established_connections, process_info, process_usage, system_usage
+from .xray_api import XrayApi
+
 
 XRAY_BIN = os.environ.get("XRAY_BIN", "/usr/local/bin/xray")
 XRAY_CONFIG_PATH = os.environ.get("XRAY_CONFIG_PATH", "/etc/xray/config.json")
 SUPERVISOR_SERVER_URL = os.environ.get("SUPERVISOR_SERVER_URL", "unix:///tmp/supervisor.sock")
+# Таймауты проверки конфига (xray -test) и перезапуска через supervisorctl
+XRAY_TEST_TIMEOUT = float(os.environ.get("XRAY_TEST_TIMEOUT", "30"))
+XRAY_RESTART_TIMEOUT = float(os.environ.get("XRAY_RESTART_TIMEOUT", "60"))
+# restart — supervisorctl restart; graceful — blue/green: новый процесс Xray поднимается рядом со старым
+# на тех же портах (SO_REUSEPORT), старый останавливается после XRAY_GRACE_SECONDS
+XRAY_RESTART_MODE = os.environ.get("XRAY_RESTART_MODE", "restart")
+XRAY_GRACE_SECONDS = float(os.environ.get("XRAY_GRACE_SECONDS", "30"))
+XRAY_STARTUP_TIMEOUT = float(os.environ.get("XRAY_STARTUP_TIMEOUT", "15"))
+# Программы supervisord и их конфиги для двух слотов (см. supervisord.conf). Слоты — отдельные файлы:
+# XRAY_CONFIG_PATH хранит конфиг панели как есть (по нему считаются хэш и дельты), слоты — с SO_REUSEPORT
+XRAY_RUN_CONFIG_A = os.environ.get("XRAY_RUN_CONFIG_A", os.path.join(os.path.dirname(XRAY_CONFIG_PATH) or ".", "config.a.json"))
+XRAY_RUN_CONFIG_B = os.environ.get("XRAY_RUN_CONFIG_B", os.path.join(os.path.dirname(XRAY_CONFIG_PATH) or ".", "config.b.json"))
+# Адрес gRPC API Xray; если пуст — берётся из секции "api" применённого конфига
+XRAY_API_ADDR = os.environ.get("XRAY_API_ADDR", "")
+XRAY_API_TAG = os.environ.get("XRAY_API_TAG", "api")
+# Inbound API не получает SO_REUSEPORT: иначе в grace-период AlterInbound и запросы StatsService
+# могли бы попасть в дослуживающий процесс. Поэтому у слота xray_b API на своём порту; 0 — порт API + 1
+XRAY_API_PORT_B = int(os.environ.get("XRAY_API_PORT_B", "0"))
+XRAY_AGENT_STATE_PATH = os.environ.get(
+    "XRAY_AGENT_STATE_PATH", os.path.join(os.path.dirname(XRAY_CONFIG_PATH) or ".", "agent-state.json")
+)
+
+# Последние XRAY_HISTORY_SIZE применённых конфигов для быстрого отката на ноде
+XRAY_HISTORY_DIR = os.environ.get(
+    "XRAY_HISTORY_DIR", os.path.join(os.path.dirname(XRAY_CONFIG_PATH) or ".", "history")
+)
+XRAY_HISTORY_SIZE = int(os.environ.get("XRAY_HISTORY_SIZE", "10"))
+# Сколько секунд Xray должен продержаться в RUNNING после рестарта, иначе — откат на прежний конфиг
+XRAY_ROLLBACK_CHECK_SECONDS = float(os.environ.get("XRAY_ROLLBACK_CHECK_SECONDS", "3"))
 
 NODE_KEY = os.environ.get("XRAY_NODE_KEY", "")
 ALLOW_IPS_RAW = os.environ.get("XRAY_PANEL_ALLOW_IPS", "")
 
+# Pull-режим: при заданных XRAY_PANEL_URL и XRAY_NODE_ID агент сам забирает конфиг long-poll запросом
+XRAY_PANEL_URL = os.environ.get("XRAY_PANEL_URL", "")
+XRAY_NODE_ID = os.environ.get("XRAY_NODE_ID", "")
+XRAY_PULL_WAIT_SECONDS = float(os.environ.get("XRAY_PULL_WAIT_SECONDS", "50"))
+XRAY_PULL_RETRY_SECONDS = float(os.environ.get("XRAY_PULL_RETRY_SECONDS", "5"))
+XRAY_PULL_MAX_RETRY_SECONDS = float(os.environ.get("XRAY_PULL_MAX_RETRY_SECONDS", "60"))
+
 
 def _parse_allow_ips(raw: str) -> Set[str]:
     ips: Set[str] = set()
@@ -27,6 +73,30 @@ def _parse_allow_ips(raw: str) -> Set[str]:
 ALLOW_IPS = _parse_allow_ips(ALLOW_IPS_RAW)
 
 app = FastAPI(title="Xray Node Agent")
+log = logging.getLogger("xray_agent")
+
+
+def _load_state() -> Dict[str, Any]:
+    try:
+        with open(XRAY_AGENT_STATE_PATH, "r") as f:
+            obj = json.load(f)
+        if isinstance(obj, dict):
+            return obj
+    except Exception:
+        pass
+    return {"revision": 0}
+
+
+def _save_state():
+    target_dir = os.path.dirname(XRAY_AGENT_STATE_PATH) or "."
+    os.makedirs(target_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", delete=False, dir=target_dir, prefix="agent-state.", suffix=".json") as tmp:
+        json.dump(_state, tmp)
+    os.replace(tmp.name, XRAY_AGENT_STATE_PATH)
+
+
+# Ревизия конфига, применённого последним (назначается панелью)
+_state = _load_state()
 
 
 def _require_node_key(x_node_key: Optional[str]):
@@ -44,13 +114,643 @@ def _require_allow_ip(request: Request):
         raise HTTPException(status_code=403, detail="IP is not allowed")
 
 
-def _restart_xray():
-    subprocess.run(["supervisorctl", "-s", SUPERVISOR_SERVER_URL, "restart", "xray"], check=True)
+metrics.install(app, _require_allow_ip)
+
+
+class CommandError(Exception):
+    pass
+
+
+async def _run_command(args: List[str], timeout: float) -> str:
+    """Запускает команду, не блокируя event loop; при таймауте процесс убивается."""
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    try:
+        out, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise CommandError(f"{os.path.basename(args[0])} timed out after {timeout:g}s")
+    output = out.decode("utf-8", "replace").strip()
+    if proc.returncode != 0:
+        raise CommandError(f"{os.path.basename(args[0])} exited with {proc.returncode}: {output[-2000:]}")
+    return output
+
+
+async def _test_config(path: str):
+    await _run_command([XRAY_BIN, "-test", "-config", path], XRAY_TEST_TIMEOUT)
+
+
+async def _supervisorctl(action: str, program: str):
+    await _run_command(["supervisorctl", "-s", SUPERVISOR_SERVER_URL, action, program], XRAY_RESTART_TIMEOUT)
+
+
+async def _restart_xray():
+    await _supervisorctl("restart", "xray")
+
+
+_SLOTS = {"xray": XRAY_RUN_CONFIG_A, "xray_b": XRAY_RUN_CONFIG_B}
+# Остановка старого слота после grace-периода: (task, program, config); новое применение обрывает ожидание
+_retiring: Optional[Tuple[asyncio.Task, str, Dict[str, Any]]] = None
+
+# SOL_SOCKET / SO_REUSEPORT в Linux: оба процесса Xray могут слушать один порт одновременно
+_REUSEPORT_SOCKOPT = {"system": "linux", "level": "1", "opt": "15", "value": "1", "type": "int"}
+
+
+def _graceful() -> bool:
+    return XRAY_RESTART_MODE == "graceful" and XRAY_CONFIG_PATH not in _SLOTS.values()
+
+
+def _active_program() -> str:
+    program = _state.get("program")
+    return program if _graceful() and program in _SLOTS else "xray"
+
+
+def _api_tags(config: Dict[str, Any]) -> Set[str]:
+    return {XRAY_API_TAG, (config.get("api") or {}).get("tag") or XRAY_API_TAG}
+
+
+def _slot_api_port(port: int, program: str) -> int:
+    if program != "xray_b" or not _graceful():
+        return port
+    return XRAY_API_PORT_B or port + 1
+
+
+def _with_reuseport(config: Dict[str, Any], program: str = "xray") -> Dict[str, Any]:
+    out = json.loads(json.dumps(config))
+    api_tags = _api_tags(out)
+    for inbound in out.get("inbounds") or []:
+        if inbound.get("tag") in api_tags:
+            if isinstance(inbound.get("port"), int):
+                inbound["port"] = _slot_api_port(inbound["port"], program)
+            continue
+        sockopt = inbound.setdefault("streamSettings", {}).setdefault("sockopt", {})
+        custom = sockopt.setdefault("customSockopt", [])
+        if _REUSEPORT_SOCKOPT not in custom:
+            custom.append(dict(_REUSEPORT_SOCKOPT))
+    return out
+
+
+def _write_slot_config(program: str, config_obj: Dict[str, Any]):
+    """Файл, с которым запущена программа supervisord; в режиме restart — копия XRAY_CONFIG_PATH."""
+    path = _SLOTS[program]
+    if path != XRAY_CONFIG_PATH:
+        body = _with_reuseport(config_obj, program) if _graceful() else config_obj
+        os.replace(_write_temp_config(body, path), path)
+
+
+def _read_bytes(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+async def _stays_running(program: str, seconds: float) -> bool:
+    deadline = time.monotonic() + seconds
+    while True:
+        info = await asyncio.to_thread(process_info, SUPERVISOR_SERVER_URL, program)
+        if info["state"] != "RUNNING":
+            return False
+        if time.monotonic() >= deadline:
+            return True
+        await asyncio.sleep(0.5)
+
+
+def _has_reuseport(path: str) -> bool:
+    try:
+        with open(path, "r") as f:
+            config = json.load(f)
+    except Exception:
+        return False
+    api_tags = _api_tags(config)
+    inbounds = [i for i in config.get("inbounds") or [] if i.get("tag") not in api_tags]
+    return all(
+        _REUSEPORT_SOCKOPT in (((i.get("streamSettings") or {}).get("sockopt") or {}).get("customSockopt") or [])
+        for i in inbounds
+    )
+
+
+async def _wait_running(program: str, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while True:
+        info = await asyncio.to_thread(process_info, SUPERVISOR_SERVER_URL, program)
+        if info["state"] == "RUNNING":
+            return True
+        if info["state"] in ("FATAL", "EXITED", "BACKOFF", "STOPPED") or time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(0.5)
+
+
+async def _stop_slot(program: str, config_obj: Dict[str, Any]):
+    try:
+        await _supervisorctl("stop", program)
+    except CommandError as e:
+        log.warning("Failed to stop %s: %s", program, e)
+    # Оба слота держат актуальный конфиг — после рестарта контейнера поднимется любой из них
+    try:
+        _write_slot_config(program, config_obj)
+    except Exception as e:
+        log.warning("Failed to sync %s config: %s", program, e)
+
+
+async def _retire(program: str, delay: float, config_obj: Dict[str, Any]):
+    await asyncio.sleep(delay)
+    await _stop_slot(program, config_obj)
+
+
+async def _graceful_restart(config_obj: Dict[str, Any]):
+    """Blue/green: тест и запуск нового слота, при неудаче старый процесс продолжает работать."""
+    global _retiring
+    if _retiring is not None:
+        task, retiring_program, retiring_config = _retiring
+        _retiring = None
+        if not task.done():
+            # Старый слот ещё дослуживает grace-период — останавливаем его сразу, слот нужен под новый процесс
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await _stop_slot(retiring_program, retiring_config)
+
+    old = _active_program()
+    new = "xray_b" if old == "xray" else "xray"
+    if not _has_reuseport(_SLOTS[old]):
+        # Текущий процесс слушает порты без SO_REUSEPORT — рядом с ним второй не поднять,
+        # поэтому один раз перезапускаем его обычным способом уже с нужной опцией
+        new = old
+    path = _SLOTS[new]
+    previous = _read_bytes(path)
+    tmp_path = _write_temp_config(_with_reuseport(config_obj, new), path)
+    try:
+        await _test_config(tmp_path)
+        os.replace(tmp_path, path)
+        tmp_path = ""
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    try:
+        await _supervisorctl("restart" if new == old else "start", new)
+        started = await _wait_running(new, XRAY_STARTUP_TIMEOUT) and await _stays_running(
+            new, XRAY_ROLLBACK_CHECK_SECONDS
+        )
+    except CommandError as e:
+        log.warning("Failed to start %s: %s", new, e)
+        started = False
+    if not started:
+        if new == old:
+            # Откат: возвращаем прежний файл слота и поднимаем процесс с ним
+            if previous is not None:
+                with open(path, "wb") as f:
+                    f.write(previous)
+            try:
+                await _supervisorctl("restart", old)
+            except CommandError as e:
+                log.warning("Rollback restart of %s failed: %s", old, e)
+            raise CommandError(f"{new} did not reach RUNNING with the new config, rolled back")
+        # Откат: новый слот гасим, старый процесс со старым конфигом не трогали
+        try:
+            await _supervisorctl("stop", new)
+        except CommandError:
+            pass
+        raise CommandError(f"{new} did not reach RUNNING, {old} keeps serving the previous config")
+
+    _state["program"] = new
+    if new == old:
+        return new
+    task = asyncio.get_running_loop().create_task(_retire(old, XRAY_GRACE_SECONDS, config_obj))
+    _retiring = (task, old, config_obj)
+    return new
+
+
+def _config_hash(config: Dict[str, Any]) -> str:
+    # Канонический вид: порядок ключей и пробелы не влияют на хэш
+    canonical = json.dumps(config, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+_history = ConfigHistory(XRAY_HISTORY_DIR, XRAY_HISTORY_SIZE)
+
+
+def _remember(config_obj: Dict[str, Any], config_hash: str, mode: str):
+    try:
+        _history.record(config_obj, config_hash, _state["revision"], mode)
+    except Exception as e:
+        log.warning("Failed to record config history: %s", e)
+
+
+# Все применения конфига идут строго по очереди: параллельные push не пишут XRAY_CONFIG_PATH одновременно
+_apply_lock = asyncio.Lock()
+
+
+def _load_applied_config() -> Optional[Dict[str, Any]]:
+    try:
+        with open(XRAY_CONFIG_PATH, "r") as f:
+            obj = json.load(f)
+    except Exception:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def _without_clients(config: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(config)
+    inbounds = []
+    for inbound in config.get("inbounds") or []:
+        if isinstance(inbound, dict) and isinstance(inbound.get("settings"), dict):
+            inbound = dict(inbound)
+            inbound["settings"] = {k: v for k, v in inbound["settings"].items() if k != "clients"}
+        inbounds.append(inbound)
+    out["inbounds"] = inbounds
+    return out
+
+
+def _clients_by_email(inbound: Dict[str, Any]) -> Optional[Dict[str, Dict[str, Any]]]:
+    settings = inbound.get("settings") or {}
+    result: Dict[str, Dict[str, Any]] = {}
+    for c in settings.get("clients") or []:
+        email = c.get("email") if isinstance(c, dict) else None
+        if not email or email in result:
+            return None
+        result[email] = c
+    return result
+
+
+def _client_changes(old: Dict[str, Any], new: Dict[str, Any]) -> Optional[List[Tuple[str, List[Dict[str, Any]], List[str]]]]:
+    """Возвращает изменения клиентов по тегам inbound'ов или None, если изменилась структура конфига."""
+    if _without_clients(old) != _without_clients(new):
+        return None
+
+    changes = []
+    for old_inbound, new_inbound in zip(old.get("inbounds") or [], new.get("inbounds") or []):
+        old_clients = _clients_by_email(old_inbound)
+        new_clients = _clients_by_email(new_inbound)
+        if old_clients is not None and old_clients == new_clients:
+            continue
+        tag = new_inbound.get("tag")
+        if not tag or old_clients is None or new_clients is None or new_inbound.get("protocol") != "vless":
+            return None
+        removed = [email for email, c in old_clients.items() if new_clients.get(email) != c]
+        added = [c for email, c in new_clients.items() if old_clients.get(email) != c]
+        changes.append((tag, added, removed))
+    return changes
+
+
+def _api_address(config: Dict[str, Any], service: str = "HandlerService") -> str:
+    if XRAY_API_ADDR:
+        return XRAY_API_ADDR
+    api = config.get("api") or {}
+    if service not in (api.get("services") or []):
+        return ""
+    if api.get("listen"):
+        return api["listen"]
+    tag = api.get("tag")
+    for inbound in config.get("inbounds") or []:
+        if tag and inbound.get("tag") == tag and inbound.get("port"):
+            # API активного слота: дослуживающий процесс слушает свой порт и вызовов не получает
+            port = inbound["port"]
+            if isinstance(port, int):
+                port = _slot_api_port(port, _active_program())
+            return f"{inbound.get('listen') or '127.0.0.1'}:{port}"
+    return ""
+
+
+def _client_order(client: Dict[str, Any]) -> Tuple[int, int]:
+    # Порядок панели (build_node_config): клиенты "{id}.{name}" по id, затем пользователи "u{id}.{name}" по id —
+    # иначе хэш конфига после дельты не совпал бы с хэшем того же конфига, присланного целиком
+    head = str(client.get("email") or "").partition(".")[0]
+    if head.isdigit():
+        return 0, int(head)
+    if head[:1] == "u" and head[1:].isdigit():
+        return 1, int(head[1:])
+    return 2, 0
+
+
+def _patch_config(config: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(config)
+    for key in delta.get("unset") or []:
+        out.pop(key, None)
+    out.update(delta.get("set") or {})
+
+    inbounds = {i.get("tag"): i for i in config.get("inbounds") or []}
+    section = delta.get("inbounds")
+    if section is not None:
+        for tag in section.get("removed") or []:
+            inbounds.pop(tag, None)
+        for inbound in (section.get("changed") or []) + (section.get("added") or []):
+            inbounds[inbound.get("tag")] = inbound
+        order = section.get("order") or []
+        missing = [tag for tag in order if tag not in inbounds]
+        if missing:
+            raise ValueError(f"Unknown inbound tags in delta: {missing}")
+    else:
+        order = list(inbounds)
+
+    for tag, change in (delta.get("clients") or {}).items():
+        inbound = inbounds.get(tag)
+        if inbound is None:
+            raise ValueError(f"Unknown inbound tag in delta: {tag}")
+        settings = dict(inbound.get("settings") or {})
+        clients = {c.get("email"): c for c in settings.get("clients") or []}
+        for email in change.get("removed") or []:
+            clients.pop(email, None)
+        for c in (change.get("changed") or []) + (change.get("added") or []):
+            clients[c.get("email")] = c
+        settings["clients"] = sorted(clients.values(), key=_client_order)
+        inbounds[tag] = {**inbound, "settings": settings}
+
+    out["inbounds"] = [inbounds[tag] for tag in order]
+    return out
+
+
+async def _hot_apply(address: str, changes: List[Tuple[str, List[Dict[str, Any]], List[str]]]):
+    async with XrayApi(address) as api:
+        for tag, added, removed in changes:
+            for email in removed:
+                await api.remove_user(tag, email)
+            for client in added:
+                await api.add_user(tag, client)
+
+
+def _write_temp_config(config_obj: Dict[str, Any], target: str = XRAY_CONFIG_PATH) -> str:
+    target_dir = os.path.dirname(target) or "."
+    os.makedirs(target_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", delete=False, dir=target_dir, prefix="config.", suffix=".json") as tmp:
+        try:
+            json.dump(config_obj, tmp, separators=(",", ":"))
+        except Exception:
+            os.remove(tmp.name)
+            raise
+        return tmp.name
+
+
+def _set_revision(revision: Optional[int], config_hash: str, stream_hash: Optional[str] = None):
+    # Конфиг без ревизии (ручной запрос) делает ревизию неизвестной — следующая дельта получит 409
+    _state["revision"] = int(revision) if revision is not None else 0
+    _state["config_hash"] = config_hash
+    # sha256 тела /apply-config-stream: повтор того же тела распознаётся без разбора JSON
+    _state["stream_hash"] = stream_hash
+    # ETag конфига панели известен только pull-циклу — любое другое применение его сбрасывает
+    _state["pull_etag"] = None
+    try:
+        _save_state()
+    except Exception as e:
+        log.warning("Failed to persist agent state: %s", e)
+
+
+def _applied_hash(current: Optional[Dict[str, Any]]) -> Optional[str]:
+    if current is None:
+        return None
+    if not _state.get("config_hash"):
+        # Состояние от старой версии агента — считаем хэш по файлу один раз
+        _state["config_hash"] = _config_hash(current)
+    return _state["config_hash"]
+
+
+def _applied(mode: str, timings: Dict[str, float], **extra) -> Dict[str, Any]:
+    metrics.observe_apply(mode, timings)
+    result: Dict[str, Any] = {"status": "applied", "mode": mode}
+    result.update(extra)
+    result["revision"] = _state["revision"]
+    # Длительность фаз (секунды) — панель раскладывает по ним время push
+    result["timings"] = {phase: round(seconds, 4) for phase, seconds in timings.items()}
+    return result
+
+
+async def _apply(
+    config_obj: Dict[str, Any],
+    revision: Optional[int],
+    current: Optional[Dict[str, Any]],
+    written: Optional[str] = None,
+    stream_hash: Optional[str] = None,
+):
+    """Применяет конфиг; вызывается только под _apply_lock.
+
+    written — временный файл, в котором config_obj уже лежит (потоковый приём): он становится
+    XRAY_CONFIG_PATH без повторной сериализации.
+    """
+    timings: Dict[str, float] = {}
+    new_hash = _config_hash(config_obj)
+    if new_hash == _applied_hash(current):
+        # Конфиг не изменился — ни xray -test, ни рестарта, только фиксируем ревизию
+        _set_revision(revision, new_hash, stream_hash)
+        return _applied("noop", timings)
+
+    # Если поменялись только клиенты существующих inbound'ов — применяем через API Xray без рестарта
+    changes = _client_changes(current, config_obj) if current is not None else None
+    address = _api_address(current) if current is not None else ""
+    if changes is not None and address:
+        started = time.monotonic()
+        try:
+            await _hot_apply(address, changes)
+        except Exception as e:
+            log.warning("Hot apply via Xray API failed, falling back to restart: %s", e)
+        else:
+            timings["hot"] = time.monotonic() - started
+            try:
+                os.replace(written or _write_temp_config(config_obj), XRAY_CONFIG_PATH)
+                _write_slot_config(_active_program(), config_obj)
+            except Exception as e:
+                metrics.apply_failed()
+                raise HTTPException(status_code=500, detail=str(e))
+            _set_revision(revision, new_hash, stream_hash)
+            _remember(config_obj, new_hash, "hot")
+            return _applied("hot", timings, changed_inbounds=len(changes))
+
+    tmp_path = ""
+    try:
+        if _graceful():
+            started = time.monotonic()
+            program = await _graceful_restart(config_obj)
+            timings["graceful"] = time.monotonic() - started
+            os.replace(written or _write_temp_config(config_obj), XRAY_CONFIG_PATH)
+            _set_revision(revision, new_hash, stream_hash)
+            _remember(config_obj, new_hash, "graceful")
+            return _applied("graceful", timings, program=program)
+
+        tmp_path = written or _write_temp_config(config_obj)
+
+        started = time.monotonic()
+        await _test_config(tmp_path)
+        timings["test"] = time.monotonic() - started
+        os.replace(tmp_path, XRAY_CONFIG_PATH)
+        tmp_path = ""
+        _write_slot_config("xray", config_obj)
+
+        started = time.monotonic()
+        await _restart_xray()
+        timings["restart"] = time.monotonic() - started
+        started = time.monotonic()
+        stayed = await _stays_running("xray", XRAY_ROLLBACK_CHECK_SECONDS)
+        timings["verify"] = time.monotonic() - started
+        if not stayed:
+            if current is None:
+                raise CommandError("Xray did not stay up after restart")
+            # Конфиг прошёл xray -test, но процесс падает — возвращаем прежний и перезапускаем
+            os.replace(_write_temp_config(current), XRAY_CONFIG_PATH)
+            _write_slot_config("xray", current)
+            await _restart_xray()
+            raise CommandError("Xray did not stay up after restart, rolled back to the previous config")
+        _set_revision(revision, new_hash, stream_hash)
+        _remember(config_obj, new_hash, "restart")
+        return _applied("restart", timings)
+
+    except CommandError as e:
+        metrics.apply_failed()
+        raise HTTPException(status_code=400, detail=f"Config test/restart failed: {e}")
+    except Exception as e:
+        metrics.apply_failed()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except Exception:
+                pass
+
+
+_STARTED_AT = time.monotonic()
+
+
+@app.on_event("startup")
+async def _reconcile_slots():
+    # После рестарта агента/контейнера выясняем, какой слот Xray реально работает
+    if XRAY_RESTART_MODE == "graceful" and not _graceful():
+        log.warning("Graceful restart needs slot configs separate from XRAY_CONFIG_PATH, using plain restart")
+    if not _graceful():
+        return
+    states = {
+        program: (await asyncio.to_thread(process_info, SUPERVISOR_SERVER_URL, program))["state"] for program in _SLOTS
+    }
+    active = _active_program()
+    if states.get(active) != "RUNNING":
+        running = [p for p, state in states.items() if state == "RUNNING"]
+        if not running:
+            return
+        active = running[0]
+        _state["program"] = active
+        try:
+            _save_state()
+        except Exception as e:
+            log.warning("Failed to persist agent state: %s", e)
+    for program, state in states.items():
+        if program != active and state == "RUNNING":
+            try:
+                await _supervisorctl("stop", program)
+            except CommandError as e:
+                log.warning("Failed to stop stale %s: %s", program, e)
+
+
+async def _pull_apply(config_obj: Dict[str, Any], revision: Optional[int], etag: Optional[str]):
+    if not isinstance(config_obj, dict):
+        raise ValueError("Config must be a JSON object")
+    async with _apply_lock:
+        await _apply(config_obj, revision, _load_applied_config())
+        _state["pull_etag"] = etag
+        _save_state()
+
+
+_puller: Optional[ConfigPuller] = None
+
+
+@app.on_event("startup")
+async def _start_pull():
+    global _puller
+    if not (XRAY_PANEL_URL and XRAY_NODE_ID):
+        return
+    _puller = ConfigPuller(
+        XRAY_PANEL_URL,
+        int(XRAY_NODE_ID),
+        NODE_KEY,
+        wait=XRAY_PULL_WAIT_SECONDS,
+        retry=XRAY_PULL_RETRY_SECONDS,
+        max_retry=XRAY_PULL_MAX_RETRY_SECONDS,
+        apply=_pull_apply,
+        etag=lambda: _state.get("pull_etag"),
+    )
+    _puller.start()
+
+
+@app.on_event("shutdown")
+async def _stop_pull():
+    if _puller is not None:
+        await _puller.stop()
+
+
+def _client_ports(config: Optional[Dict[str, Any]]) -> List[int]:
+    ports = []
+    for inbound in (config or {}).get("inbounds") or []:
+        if inbound.get("protocol") != "dokodemo-door" and isinstance(inbound.get("port"), int):
+            ports.append(inbound["port"])
+    return ports
 
 
 @app.get("/health")
-def health():
-    return {"status": "ok"}
+def health(x_node_key: Optional[str] = Header(default=None, alias="X-Node-Key")):
+    """Без ключа — только статус; с X-Node-Key — состояние Xray, ревизия и нагрузка ноды."""
+    xray = process_info(SUPERVISOR_SERVER_URL, _active_program())
+    xray["program"] = _active_program()
+    status = "ok" if xray["state"] == "RUNNING" else "degraded"
+    if not NODE_KEY or x_node_key != NODE_KEY:
+        return {"status": status}
+
+    current = _load_applied_config()
+    xray.update(process_usage(xray["pid"]))
+    return {
+        "status": status,
+        "revision": _state["revision"],
+        "agent_uptime_seconds": int(time.monotonic() - _STARTED_AT),
+        "xray": xray,
+        "system": system_usage(),
+        "connections": established_connections(_client_ports(current)),
+    }
+
+
+@app.get("/revision")
+def get_revision(
+    request: Request,
+    x_node_key: Optional[str] = Header(default=None, alias="X-Node-Key"),
+):
+    _require_allow_ip(request)
+    _require_node_key(x_node_key)
+    return {"revision": _state["revision"]}
+
+
+@app.post("/stats")
+async def user_stats(
+    request: Request,
+    x_node_key: Optional[str] = Header(default=None, alias="X-Node-Key"),
+):
+    """Трафик по пользователям: {"users": {email: [uplink, downlink]}}; по умолчанию счётчики сбрасываются."""
+    _require_allow_ip(request)
+    _require_node_key(x_node_key)
+
+    try:
+        payload = await request.json()
+    except Exception:
+        payload = {}
+    reset = bool(payload.get("reset", True)) if isinstance(payload, dict) else True
+
+    current = _load_applied_config()
+    address = _api_address(current, "StatsService") if current is not None else ""
+    if not address:
+        raise HTTPException(status_code=409, detail="StatsService is not enabled in the applied config")
+
+    try:
+        async with XrayApi(address) as api:
+            stats = await api.query_stats("user>>>", reset=reset)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Xray StatsService query failed: {e}")
+
+    users: Dict[str, List[int]] = {}
+    for name, value in stats:
+        # user>>>{email}>>>traffic>>>uplink|downlink
+        parts = name.split(">>>")
+        if len(parts) != 4 or parts[0] != "user" or not value:
+            continue
+        counters = users.setdefault(parts[1], [0, 0])
+        counters[0 if parts[3] == "uplink" else 1] += value
+    return {"users": users, "reset": reset, "revision": _state["revision"]}
 
 
 @app.post("/apply-config")
@@ -71,29 +771,162 @@ async def apply_config(
     if not isinstance(config_obj, dict):
         raise HTTPException(status_code=400, detail="Config must be a JSON object")
 
-    os.makedirs(os.path.dirname(XRAY_CONFIG_PATH) or ".", exist_ok=True)
+    revision = payload.get("revision") if isinstance(payload, dict) and "config" in payload else None
+    async with _apply_lock:
+        return await _apply(config_obj, revision, _load_applied_config())
+
+
+class _Identity:
+    def decompress(self, data: bytes) -> bytes:
+        return data
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def _decoder(content_encoding: Optional[str]):
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return _Identity()
+    if encoding == "gzip":
+        return zlib.decompressobj(31)
+    if encoding == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise HTTPException(status_code=415, detail="zstd is not supported: zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise HTTPException(status_code=415, detail=f"Unsupported Content-Encoding: {encoding}")
+
+
+async def _receive_config(request: Request, content_encoding: Optional[str]) -> Tuple[str, str]:
+    """Пишет тело запроса (распаковывая на лету) во временный файл рядом с конфигом; возвращает путь и sha256."""
+    decoder = _decoder(content_encoding)
     target_dir = os.path.dirname(XRAY_CONFIG_PATH) or "."
+    os.makedirs(target_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile("wb", delete=False, dir=target_dir, prefix="config.", suffix=".json") as tmp:
+        try:
+            async for chunk in request.stream():
+                data = decoder.decompress(chunk)
+                digest.update(data)
+                tmp.write(data)
+            data = decoder.flush()
+            digest.update(data)
+            tmp.write(data)
+        except Exception as e:
+            tmp.close()
+            os.remove(tmp.name)
+            raise HTTPException(status_code=400, detail=f"Invalid config stream: {e}")
+    return tmp.name, digest.hexdigest()
 
-    tmp_path = ""
-    try:
-        with tempfile.NamedTemporaryFile("w", delete=False, dir=target_dir, prefix="config.", suffix=".json") as tmp:
-            tmp_path = tmp.name
-            json.dump(config_obj, tmp, indent=2)
 
-        subprocess.run([XRAY_BIN, "-test", "-config", tmp_path], check=True)
-        os.replace(tmp_path, XRAY_CONFIG_PATH)
-        tmp_path = ""
+def _read_config_file(path: str) -> Dict[str, Any]:
+    with open(path, "r") as f:
+        return json.load(f)
 
-        _restart_xray()
-        return {"status": "applied"}
 
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(status_code=400, detail=f"Config test/restart failed: {e}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@app.post("/apply-config-stream")
+async def apply_config_stream(
+    request: Request,
+    x_node_key: Optional[str] = Header(default=None, alias="X-Node-Key"),
+    content_encoding: Optional[str] = Header(default=None, alias="Content-Encoding"),
+    x_config_revision: Optional[int] = Header(default=None, alias="X-Config-Revision"),
+    x_config_sha256: Optional[str] = Header(default=None, alias="X-Config-Sha256"),
+):
+    """Полный конфиг телом запроса (JSON, gzip или zstd) для больших нод: тело не буферизуется в памяти."""
+    _require_allow_ip(request)
+    _require_node_key(x_node_key)
+
+    started = time.monotonic()
+    tmp_path, digest = await _receive_config(request, content_encoding)
+    metrics.observe_phase("receive", time.monotonic() - started)
+    try:
+        if x_config_sha256 and x_config_sha256.lower() != digest:
+            raise HTTPException(status_code=400, detail="Config checksum mismatch")
+        async with _apply_lock:
+            current = _load_applied_config()
+            if current is not None and digest == _state.get("stream_hash"):
+                _set_revision(x_config_revision, _state["config_hash"], digest)
+                return _applied("noop", {})
+            try:
+                config_obj = await asyncio.to_thread(_read_config_file, tmp_path)
+            except Exception:
+                raise HTTPException(status_code=400, detail="Invalid JSON")
+            if not isinstance(config_obj, dict):
+                raise HTTPException(status_code=400, detail="Config must be a JSON object")
+            return await _apply(config_obj, x_config_revision, current, written=tmp_path, stream_hash=digest)
     finally:
-        if tmp_path and os.path.exists(tmp_path):
+        if os.path.exists(tmp_path):
             try:
                 os.remove(tmp_path)
             except Exception:
                 pass
+
+
+@app.post("/apply-delta")
+async def apply_delta(
+    request: Request,
+    x_node_key: Optional[str] = Header(default=None, alias="X-Node-Key"),
+):
+    _require_allow_ip(request)
+    _require_node_key(x_node_key)
+
+    try:
+        payload = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(payload, dict) or not isinstance(payload.get("delta"), dict):
+        raise HTTPException(status_code=400, detail="Delta must be a JSON object")
+
+    # Проверка ревизии и применение — под одной блокировкой, чтобы база дельты не сменилась между ними
+    async with _apply_lock:
+        current_revision = _state["revision"]
+        revision = payload.get("revision")
+        if revision is not None and revision == current_revision:
+            return {"status": "applied", "mode": "noop", "revision": current_revision}
+
+        # Дельта применима только к той ревизии, от которой её посчитала панель; иначе просим полный снапшот
+        current = _load_applied_config()
+        if current is None or payload.get("base_revision") != current_revision:
+            raise HTTPException(status_code=409, detail={"status": "snapshot_required", "revision": current_revision})
+        try:
+            config_obj = _patch_config(current, payload["delta"])
+        except Exception as e:
+            raise HTTPException(
+                status_code=409, detail={"status": "snapshot_required", "revision": current_revision, "error": str(e)}
+            )
+        return await _apply(config_obj, revision, current)
+
+
+@app.get("/history")
+def list_history(
+    request: Request,
+    x_node_key: Optional[str] = Header(default=None, alias="X-Node-Key"),
+):
+    _require_allow_ip(request)
+    _require_node_key(x_node_key)
+    current_hash = _state.get("config_hash")
+    return [dict(entry, current=entry.get("hash") == current_hash) for entry in _history.entries()]
+
+
+@app.post("/history/{config_hash}/rollback")
+async def rollback_config(
+    config_hash: str,
+    request: Request,
+    x_node_key: Optional[str] = Header(default=None, alias="X-Node-Key"),
+):
+    """Применяет конфиг из локальной истории тем же путём, что и push; ревизия — та, с которой он был применён.
+
+    Ревизия ниже подтверждённой панелью видна ей в /health — панель ставит push ноды на паузу до resume.
+    """
+    _require_allow_ip(request)
+    _require_node_key(x_node_key)
+
+    entry = _history.get(config_hash)
+    config_obj = _history.load(config_hash) if entry is not None else None
+    if config_obj is None:
+        raise HTTPException(status_code=404, detail="Config is not in history")
+    async with _apply_lock:
+        result = await _apply(config_obj, entry.get("revision"), _load_applied_config())
+    return dict(result, rolled_back_to=config_hash)
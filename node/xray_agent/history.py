@@ -0,0 +1,71 @@
+import gzip
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+
+# История применённых конфигов: <hash>.json.gz (один файл на содержимое) + index.json с метаданными
+
+
+class ConfigHistory:
+    def __init__(self, directory: str, size: int):
+        self.directory = directory
+        self.size = max(1, size)
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    def _blob_path(self, config_hash: str) -> str:
+        return os.path.join(self.directory, f"{config_hash}.json.gz")
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Записи от новой к старой: hash, revision, mode, applied_at, size."""
+        try:
+            with open(self._index_path(), "r") as f:
+                entries = json.load(f)
+        except Exception:
+            return []
+        return entries if isinstance(entries, list) else []
+
+    def get(self, config_hash: str) -> Optional[Dict[str, Any]]:
+        for entry in self.entries():
+            if entry.get("hash") == config_hash:
+                return entry
+        return None
+
+    def load(self, config_hash: str) -> Optional[Dict[str, Any]]:
+        if not all(c in "0123456789abcdef" for c in config_hash):
+            return None
+        try:
+            with gzip.open(self._blob_path(config_hash), "rb") as f:
+                obj = json.loads(f.read().decode("utf-8"))
+        except Exception:
+            return None
+        return obj if isinstance(obj, dict) else None
+
+    def _write_atomic(self, path: str, data: bytes):
+        with tempfile.NamedTemporaryFile("wb", delete=False, dir=self.directory, prefix=".tmp.") as tmp:
+            tmp.write(data)
+        os.replace(tmp.name, path)
+
+    def record(self, config: Dict[str, Any], config_hash: str, revision: int, mode: str):
+        os.makedirs(self.directory, exist_ok=True)
+        body = json.dumps(config, separators=(",", ":")).encode("utf-8")
+        blob = self._blob_path(config_hash)
+        if not os.path.exists(blob):
+            self._write_atomic(blob, gzip.compress(body, compresslevel=6))
+
+        entries = [e for e in self.entries() if e.get("hash") != config_hash]
+        entries.insert(
+            0,
+            {"hash": config_hash, "revision": revision, "mode": mode, "applied_at": int(time.time()), "size": len(body)},
+        )
+        kept, dropped = entries[: self.size], entries[self.size :]
+        self._write_atomic(self._index_path(), json.dumps(kept).encode("utf-8"))
+        for entry in dropped:
+            try:
+                os.remove(self._blob_path(entry["hash"]))
+            except OSError:
+                pass
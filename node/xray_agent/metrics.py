@@ -0,0 +1,85 @@
+import os
+import time
+from typing import Dict
+
+from fastapi import Request, Response
+
+
+# Метрики Prometheus на /metrics; METRICS_ENABLED=0 — без middleware, prometheus_client не импортируется
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+
+_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+if METRICS_ENABLED:
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+    REQUEST_DURATION = Histogram(
+        "xray_agent_request_duration_seconds",
+        "HTTP request latency by route",
+        ["method", "route", "status"],
+        buckets=_LATENCY_BUCKETS,
+    )
+    APPLY_PHASE_SECONDS = Histogram(
+        "xray_agent_apply_phase_seconds",
+        "Config apply duration by phase: receive, hot, test, restart, verify, graceful",
+        ["phase"],
+        buckets=_LATENCY_BUCKETS,
+    )
+    APPLIES = Counter("xray_agent_applies_total", "Applied configs by mode", ["mode"])
+    APPLY_FAILURES = Counter("xray_agent_apply_failures_total", "Failed config applies")
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: латентность запросов по шаблону маршрута."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUEST_DURATION.labels(scope["method"], route, str(status["code"])).observe(
+                time.perf_counter() - started
+            )
+
+
+def install(app, check_access):
+    """Подключает middleware и GET /metrics; check_access(request) — та же проверка IP, что у остальных эндпоинтов."""
+    if not METRICS_ENABLED:
+        return
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics(request: Request):
+        check_access(request)
+        return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def observe_phase(phase: str, seconds: float):
+    if METRICS_ENABLED:
+        APPLY_PHASE_SECONDS.labels(phase).observe(seconds)
+
+
+def observe_apply(mode: str, timings: Dict[str, float]):
+    if METRICS_ENABLED:
+        APPLIES.labels(mode).inc()
+        for phase, seconds in timings.items():
+            APPLY_PHASE_SECONDS.labels(phase).observe(seconds)
+
+
+def apply_failed():
+    if METRICS_ENABLED:
+        APPLY_FAILURES.inc()
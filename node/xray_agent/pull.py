@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import random
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+log = logging.getLogger("xray_agent.pull")
+
+
+class ConfigPuller:
+    """Pull-режим: агент сам держит long-poll запрос к панели и применяет конфиг, когда тот меняется.
+
+    Панель отвечает сразу, если ETag её конфига отличается от присланного в If-None-Match,
+    иначе держит запрос до изменения или wait секунд (304). apply(config, revision, etag) —
+    применение под общей блокировкой агента; ошибка применения откладывает следующий запрос.
+    """
+
+    def __init__(
+        self,
+        panel_url: str,
+        node_id: int,
+        node_key: str,
+        wait: float,
+        retry: float,
+        max_retry: float,
+        apply: Callable[[Dict[str, Any], Optional[int], Optional[str]], Awaitable[Any]],
+        etag: Callable[[], Optional[str]],
+    ):
+        self.url = f"{panel_url.rstrip('/')}/nodes/{node_id}/config/poll"
+        self.node_key = node_key
+        self.wait = wait
+        self.retry = retry
+        self.max_retry = max_retry
+        self._apply = apply
+        self._etag = etag
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _delay(self, failures: int) -> float:
+        delay = min(self.max_retry, self.retry * 2 ** (failures - 1))
+        return random.uniform(delay / 2, delay)
+
+    async def _loop(self):
+        # httpx нужен только в pull-режиме
+        import httpx
+
+        failures = 0
+        timeout = httpx.Timeout(self.wait + 15, connect=10)
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            while True:
+                headers = {"X-Node-Key": self.node_key}
+                etag = self._etag()
+                if etag:
+                    headers["If-None-Match"] = etag
+                try:
+                    r = await client.get(self.url, params={"wait": self.wait}, headers=headers)
+                    if r.status_code == 200:
+                        revision = r.headers.get("X-Config-Revision")
+                        await self._apply(r.json(), int(revision) if revision else None, r.headers.get("ETag"))
+                    elif r.status_code != 304:
+                        raise RuntimeError(f"Panel error: {r.status_code} {r.text[:200]}")
+                    failures = 0
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    failures += 1
+                    detail = getattr(e, "detail", None) or str(e) or e.__class__.__name__
+                    log.warning("Config pull failed: %s", detail)
+                    await asyncio.sleep(self._delay(failures))
@@ -0,0 +1,125 @@
+import http.client
+import os
+import socket
+import time
+import xmlrpc.client
+from typing import Any, Dict, Iterable, Optional, Set
+
+
+# Доступ к supervisord по XML-RPC (unix-сокет или http) и чтение метрик из /proc
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self._path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self._path)
+        self.sock = sock
+
+
+class _UnixTransport(xmlrpc.client.Transport):
+    def __init__(self, path: str, timeout: float):
+        super().__init__()
+        self._path = path
+        self._timeout = timeout
+
+    def make_connection(self, host):
+        return _UnixHTTPConnection(self._path, self._timeout)
+
+
+def supervisor_proxy(server_url: str, timeout: float = 3.0) -> xmlrpc.client.ServerProxy:
+    if server_url.startswith("unix://"):
+        return xmlrpc.client.ServerProxy("http://localhost/RPC2", transport=_UnixTransport(server_url[7:], timeout))
+    return xmlrpc.client.ServerProxy(server_url.rstrip("/") + "/RPC2")
+
+
+def process_info(server_url: str, name: str) -> Dict[str, Any]:
+    """Состояние программы supervisord: state, pid, uptime_seconds; при ошибке — state UNKNOWN."""
+    try:
+        info = supervisor_proxy(server_url).supervisor.getProcessInfo(name)
+    except Exception as e:
+        return {"state": "UNKNOWN", "pid": None, "uptime_seconds": None, "error": str(e) or e.__class__.__name__}
+    running = info.get("statename") == "RUNNING"
+    return {
+        "state": info.get("statename"),
+        "pid": info.get("pid") or None,
+        "uptime_seconds": max(0, info.get("now", 0) - info.get("start", 0)) if running else None,
+    }
+
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+# pid -> (monotonic, cpu_seconds) для расчёта загрузки CPU между вызовами
+_cpu_samples: Dict[int, tuple] = {}
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def process_usage(pid: Optional[int]) -> Dict[str, Any]:
+    if not pid:
+        return {"cpu_percent": None, "rss_bytes": None}
+    stat = _read(f"/proc/{pid}/stat")
+    status = _read(f"/proc/{pid}/status")
+    cpu_percent = None
+    if stat:
+        # Имя процесса в скобках может содержать пробелы — поля считаем после ')'
+        fields = stat.rsplit(")", 1)[-1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / _CLK_TCK
+        now = time.monotonic()
+        prev = _cpu_samples.get(pid)
+        _cpu_samples.clear()
+        _cpu_samples[pid] = (now, cpu_seconds)
+        if prev is not None and now > prev[0]:
+            cpu_percent = round(100.0 * (cpu_seconds - prev[1]) / (now - prev[0]), 1)
+    rss = None
+    for line in (status or "").splitlines():
+        if line.startswith("VmRSS:"):
+            rss = int(line.split()[1]) * 1024
+            break
+    return {"cpu_percent": cpu_percent, "rss_bytes": rss}
+
+
+def system_usage() -> Dict[str, Any]:
+    meminfo: Dict[str, int] = {}
+    for line in (_read("/proc/meminfo") or "").splitlines():
+        key, _, rest = line.partition(":")
+        parts = rest.split()
+        if parts:
+            meminfo[key] = int(parts[0]) * 1024
+    try:
+        load = list(os.getloadavg())
+    except OSError:
+        load = None
+    return {
+        "load_average": load,
+        "cpu_count": os.cpu_count(),
+        "memory_total_bytes": meminfo.get("MemTotal"),
+        "memory_available_bytes": meminfo.get("MemAvailable"),
+    }
+
+
+def established_connections(ports: Iterable[int]) -> int:
+    """Число ESTABLISHED TCP-соединений на локальных портах ports (по /proc/net/tcp и tcp6)."""
+    wanted: Set[int] = set(ports)
+    if not wanted:
+        return 0
+    count = 0
+    for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        lines = (_read(path) or "").splitlines()[1:]
+        for line in lines:
+            parts = line.split()
+            if len(parts) < 4 or parts[3] != "01":
+                continue
+            port = int(parts[1].rsplit(":", 1)[-1], 16)
+            if port in wanted:
+                count += 1
+    return count
@@ -0,0 +1,141 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import grpc
+
+
+# Минимальный protobuf-кодек для нужных нам сообщений Xray API, чтобы не тащить
+# сгенерированные стабы всего xray-core.
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    value &= (1 << 64) - 1
+    while True:
+        b = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _field_bytes(num: int, data: bytes) -> bytes:
+    return _varint((num << 3) | 2) + _varint(len(data)) + data
+
+
+def _field_str(num: int, value: str) -> bytes:
+    if not value:
+        return b""
+    return _field_bytes(num, value.encode("utf-8"))
+
+
+def _field_uint(num: int, value: int) -> bytes:
+    if not value:
+        return b""
+    return _varint(num << 3) + _varint(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(data: bytes) -> Iterator[Tuple[int, Any]]:
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        num, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire == 2:
+            size, pos = _read_varint(data, pos)
+            value = data[pos : pos + size]
+            pos += size
+        elif wire == 1:
+            value = data[pos : pos + 8]
+            pos += 8
+        elif wire == 5:
+            value = data[pos : pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire}")
+        yield num, value
+
+
+def _typed_message(type_name: str, value: bytes) -> bytes:
+    return _field_str(1, type_name) + _field_bytes(2, value)
+
+
+def _vless_account(client: Dict[str, Any]) -> bytes:
+    return _field_str(1, str(client.get("id") or "")) + _field_str(2, str(client.get("flow") or ""))
+
+
+def _user(client: Dict[str, Any]) -> bytes:
+    return (
+        _field_uint(1, int(client.get("level") or 0))
+        + _field_str(2, str(client.get("email") or ""))
+        + _field_bytes(3, _typed_message("xray.proxy.vless.Account", _vless_account(client)))
+    )
+
+
+def _alter_inbound(tag: str, op_type: str, op_value: bytes) -> bytes:
+    return _field_str(1, tag) + _field_bytes(2, _typed_message(op_type, op_value))
+
+
+_ALTER_INBOUND = "/xray.app.proxyman.command.HandlerService/AlterInbound"
+_QUERY_STATS = "/xray.app.stats.command.StatsService/QueryStats"
+
+
+class XrayApi:
+    def __init__(self, address: str, timeout: float = 5.0):
+        self.address = address
+        self.timeout = timeout
+        self._channel: Optional[grpc.aio.Channel] = None
+
+    async def __aenter__(self) -> "XrayApi":
+        self._channel = grpc.aio.insecure_channel(self.address)
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._channel is not None:
+            await self._channel.close()
+            self._channel = None
+
+    async def _call(self, method: str, request: bytes) -> bytes:
+        if self._channel is None:
+            raise RuntimeError("XrayApi channel is not open")
+        rpc = self._channel.unary_unary(method)
+        return await rpc(request, timeout=self.timeout)
+
+    async def add_user(self, tag: str, client: Dict[str, Any]):
+        op = _field_bytes(1, _user(client))
+        await self._call(_ALTER_INBOUND, _alter_inbound(tag, "xray.app.proxyman.command.AddUserOperation", op))
+
+    async def remove_user(self, tag: str, email: str):
+        op = _field_str(1, email)
+        await self._call(_ALTER_INBOUND, _alter_inbound(tag, "xray.app.proxyman.command.RemoveUserOperation", op))
+
+    async def query_stats(self, pattern: str, reset: bool = False) -> List[Tuple[str, int]]:
+        """Счётчики StatsService, имя которых содержит pattern; reset обнуляет их атомарно с чтением."""
+        request = _field_str(1, pattern) + _field_uint(2, 1 if reset else 0)
+        response = await self._call(_QUERY_STATS, request)
+        stats = []
+        for num, raw in _iter_fields(response):
+            if num != 1:
+                continue
+            name, value = "", 0
+            for field_num, field_value in _iter_fields(raw):
+                if field_num == 1:
+                    name = field_value.decode("utf-8")
+                elif field_num == 2:
+                    # int64 в varint: отрицательные значения приходят как дополнение до 2^64
+                    value = field_value - (1 << 64) if field_value >= 1 << 63 else field_value
+            stats.append((name, value))
+        return stats
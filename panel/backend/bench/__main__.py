@@ -0,0 +1,312 @@
+"""Бенчмарки панели на синтетическом парке нод.
+
+Запуск из panel/backend:
+
+    python -m bench --nodes 50 --inbounds 10 --clients 100000 --output bench.json
+
+Без DATABASE_URL используется временный SQLite; для PostgreSQL передай DATABASE_URL
+пустой тестовой базы — таблицы панели в ней будут очищены.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+_tmpdir = None
+if not os.environ.get("DATABASE_URL"):
+    _tmpdir = tempfile.mkdtemp(prefix="xray-panel-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{_tmpdir}/bench.db"
+# Фоновые циклы панели искажают замеры — в бенчмарке работает только очередь push
+for _name in ("STATS_POLL_INTERVAL", "HEALTH_PROBE_INTERVAL", "ENFORCE_INTERVAL_SECONDS"):
+    os.environ.setdefault(_name, "0")
+
+import httpx
+from sqlalchemy.orm import joinedload
+
+from xray_panel.cache import cache, compile_node_config
+from xray_panel.config_gen import build_node_config
+from xray_panel.db import SessionLocal, engine
+from xray_panel.main import app
+from xray_panel.models import Node, Inbound
+
+from .seed import seed_fleet
+from .stub_agent import StubAgent, serve, shutdown
+
+
+def _percentiles(samples: List[float]) -> Dict[str, Any]:
+    values = sorted(samples)
+    if not values:
+        return {"count": 0}
+
+    def pct(q: float) -> float:
+        return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 3)
+
+    return {
+        "count": len(values),
+        "min_ms": round(values[0] * 1000, 3),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(values[-1] * 1000, 3),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3),
+    }
+
+
+def _timed(fn: Callable[[], Any]):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def _load_node(db, node_id: int) -> Node:
+    return (
+        db.query(Node)
+        .options(joinedload(Node.inbounds).joinedload(Inbound.clients))
+        .filter(Node.id == node_id)
+        .first()
+    )
+
+
+def bench_config_build(node_ids: List[int]) -> Dict[str, Any]:
+    """Загрузка ноды из БД, build_node_config и сериализация — по отдельности, плюс пик памяти."""
+    load, build, compile_ = [], [], []
+    sizes = []
+    db = SessionLocal()
+    try:
+        for node_id in node_ids:
+            node, elapsed = _timed(lambda: _load_node(db, node_id))
+            load.append(elapsed)
+            _, elapsed = _timed(lambda: build_node_config(node))
+            build.append(elapsed)
+            compiled, elapsed = _timed(lambda: compile_node_config(node))
+            compile_.append(elapsed)
+            sizes.append(len(compiled.body))
+            db.expunge_all()
+
+        gc.collect()
+        tracemalloc.start()
+        node = _load_node(db, node_ids[0])
+        load_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        compile_node_config(node)
+        build_peak = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+    finally:
+        db.close()
+    return {
+        "nodes": len(node_ids),
+        "load": _percentiles(load),
+        "build_node_config": _percentiles(build),
+        "compile_node_config": _percentiles(compile_),
+        "config_bytes": {"min": min(sizes), "max": max(sizes)},
+        "peak_memory_bytes": {"load": load_peak, "compile": build_peak},
+    }
+
+
+async def _get(client: httpx.AsyncClient, url: str, samples: List[float], **kwargs) -> httpx.Response:
+    started = time.perf_counter()
+    r = await client.get(url, **kwargs)
+    samples.append(time.perf_counter() - started)
+    if r.status_code >= 400:
+        r.raise_for_status()
+    return r
+
+
+async def bench_list_clients(client: httpx.AsyncClient, page_size: int, max_pages: int) -> Dict[str, Any]:
+    """Проход по /clients keyset-страницами и фильтр по ноде."""
+    pages: List[float] = []
+    rows = 0
+    after_id = None
+    for _ in range(max_pages):
+        params: Dict[str, Any] = {"limit": page_size}
+        if after_id is not None:
+            params["after_id"] = after_id
+        r = await _get(client, "/clients", pages, params=params)
+        rows += len(r.json())
+        after_id = r.headers.get("X-Next-Cursor")
+        if not after_id:
+            break
+
+    by_node: List[float] = []
+    for node_id in range(1, 11):
+        await _get(client, "/clients", by_node, params={"node_id": node_id, "limit": page_size})
+    with_total: List[float] = []
+    for _ in range(5):
+        await _get(client, "/clients", with_total, params={"limit": page_size, "with_total": "true"})
+    return {
+        "page_size": page_size,
+        "rows": rows,
+        "pages": _percentiles(pages),
+        "by_node": _percentiles(by_node),
+        "with_total": _percentiles(with_total),
+    }
+
+
+async def bench_node_config(client: httpx.AsyncClient, node_ids: List[int], repeats: int) -> Dict[str, Any]:
+    """GET /nodes/{id}/config: первый запрос собирает конфиг, повторные идут из кэша, If-None-Match — 304."""
+    cache.invalidate(configs=node_ids)
+    cold: List[float] = []
+    warm: List[float] = []
+    not_modified: List[float] = []
+    for node_id in node_ids:
+        r = await _get(client, f"/nodes/{node_id}/config", cold)
+        etag = r.headers.get("ETag")
+        for _ in range(repeats):
+            await _get(client, f"/nodes/{node_id}/config", warm)
+            await _get(client, f"/nodes/{node_id}/config", not_modified, headers={"If-None-Match": etag})
+    return {"cold": _percentiles(cold), "warm": _percentiles(warm), "not_modified": _percentiles(not_modified)}
+
+
+def _out_of_sync() -> int:
+    db = SessionLocal()
+    try:
+        return db.query(Node.id).filter(Node.applied_revision < Node.config_revision).count()
+    finally:
+        db.close()
+
+
+async def _wait_synced(timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if await asyncio.to_thread(_out_of_sync) == 0:
+            return True
+        await asyncio.sleep(0.2)
+    return False
+
+
+async def bench_create_clients(
+    client: httpx.AsyncClient, stub: StubAgent, inbound_ids: List[int], count: int, concurrency: int
+) -> Dict[str, Any]:
+    """Создание клиентов через API с push на stub-агент: пропускная способность и время до синхронизации."""
+    samples: List[float] = []
+    errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(count):
+        queue.put_nowait(i)
+    applies_before = dict(stub.applies)
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            payload = {"inbound_id": inbound_ids[i % len(inbound_ids)], "username": f"bench-new-{i}"}
+            started = time.perf_counter()
+            r = await client.post("/clients", json=payload)
+            samples.append(time.perf_counter() - started)
+            if r.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    elapsed = time.perf_counter() - started
+    synced = await _wait_synced(timeout=120)
+    synced_after = time.perf_counter() - started
+    return {
+        "count": count,
+        "concurrency": concurrency,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "per_second": round(count / elapsed, 1) if elapsed > 0 else None,
+        "latency": _percentiles(samples),
+        "synced": synced,
+        "synced_after_seconds": round(synced_after, 3),
+        "agent_applies": {k: stub.applies[k] - applies_before[k] for k in stub.applies},
+    }
+
+
+def _git_revision() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5, check=True
+        )
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+async def _run_http(args, stub: StubAgent, seeded: Dict[str, int]) -> Dict[str, Any]:
+    panel = serve(app, args.host, args.panel_port)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://{args.host}:{args.panel_port}", timeout=120) as client:
+            node_ids = list(range(1, min(seeded["nodes"], args.sample_nodes) + 1))
+            inbound_ids = list(range(1, seeded["inbounds"] + 1))
+            return {
+                "list_clients": await bench_list_clients(client, args.page_size, args.max_pages),
+                "node_config": await bench_node_config(client, node_ids, args.repeats),
+                "create_clients": await bench_create_clients(
+                    client, stub, inbound_ids, args.create, args.concurrency
+                ),
+            }
+    finally:
+        shutdown(panel)
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Xray panel benchmarks")
+    parser.add_argument("--nodes", type=int, default=50)
+    parser.add_argument("--inbounds", type=int, default=10, help="inbounds per node")
+    parser.add_argument("--clients", type=int, default=100_000, help="clients in total")
+    parser.add_argument("--sample-nodes", type=int, default=10, help="nodes to build/fetch configs for")
+    parser.add_argument("--repeats", type=int, default=5, help="warm /nodes/{id}/config requests per node")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--max-pages", type=int, default=200)
+    parser.add_argument("--create", type=int, default=1000, help="clients to create through the API")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--agent-delay", type=float, default=0.0, help="stub agent apply latency, seconds")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--panel-port", type=int, default=18000)
+    parser.add_argument("--agent-port", type=int, default=18585)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    stub = StubAgent(apply_delay=args.agent_delay)
+    agent = serve(stub.app, args.host, args.agent_port)
+    try:
+        seeded, seed_seconds = _timed(
+            lambda: seed_fleet(engine, args.nodes, args.inbounds, args.clients, f"http://{args.host}:{args.agent_port}")
+        )
+        results: Dict[str, Any] = {"seed": dict(seeded, seconds=round(seed_seconds, 3))}
+        results["config_build"] = bench_config_build(list(range(1, min(args.nodes, args.sample_nodes) + 1)))
+        results.update(asyncio.run(_run_http(args, stub, seeded)))
+    finally:
+        shutdown(agent)
+        engine.dispose()
+        if _tmpdir is not None:
+            shutil.rmtree(_tmpdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "database": engine.dialect.name,
+            "params": vars(args),
+        },
+        "results": results,
+    }
+    body = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(body + "\n")
+    else:
+        sys.stdout.write(body + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
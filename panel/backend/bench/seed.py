@@ -0,0 +1,97 @@
+import uuid as py_uuid
+from typing import Dict, List
+
+from sqlalchemy import delete, insert
+from sqlalchemy.engine import Engine
+
+from xray_panel.migrate import run_migrations
+from xray_panel.models import Node, Inbound, Client, ClientTraffic, NodeHealth, Subscription
+
+
+# Размер пачки INSERT при заполнении — одна транзакция на пачку
+SEED_BATCH_SIZE = 5000
+
+
+def reset(engine: Engine):
+    run_migrations(engine)
+    with engine.begin() as conn:
+        for model in (ClientTraffic, NodeHealth, Client, Inbound, Subscription, Node):
+            conn.execute(delete(model))
+
+
+def seed_fleet(engine: Engine, nodes: int, inbounds_per_node: int, clients: int, agent_url: str) -> Dict[str, int]:
+    """Синтетический парк: nodes × inbounds_per_node inbounds, clients клиентов поровну между ними.
+
+    Все ноды указывают на один stub-агент; ключи Reality фиктивные — агент их не проверяет.
+    """
+    reset(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            insert(Node),
+            [
+                {
+                    "id": n,
+                    "name": f"bench-node-{n}",
+                    "url": agent_url,
+                    "node_key": "bench",
+                    "group": "default",
+                    "weight": 1,
+                    "config_revision": 0,
+                    "applied_revision": 0,
+                }
+                for n in range(1, nodes + 1)
+            ],
+        )
+
+    inbound_ids: List[int] = []
+    rows = []
+    for n in range(1, nodes + 1):
+        for i in range(inbounds_per_node):
+            inbound_id = len(inbound_ids) + 1
+            inbound_ids.append(inbound_id)
+            rows.append(
+                {
+                    "id": inbound_id,
+                    "node_id": n,
+                    "name": f"in-{i}",
+                    "listen": "0.0.0.0",
+                    "port": 443 + i,
+                    "protocol": "vless",
+                    "network": "tcp",
+                    "security": "reality",
+                    "sni": "example.com",
+                    "reality_private_key": "bench-private-key",
+                    "reality_public_key": "bench-public-key",
+                    "reality_short_id": f"{inbound_id:08x}",
+                    "reality_dest": "example.com:443",
+                    "reality_fingerprint": "chrome",
+                    "client_count": 0,
+                }
+            )
+    counts = {inbound_id: 0 for inbound_id in inbound_ids}
+    for c in range(clients):
+        counts[inbound_ids[c % len(inbound_ids)]] += 1
+    for row in rows:
+        row["client_count"] = counts[row["id"]]
+    with engine.begin() as conn:
+        for i in range(0, len(rows), SEED_BATCH_SIZE):
+            conn.execute(insert(Inbound), rows[i : i + SEED_BATCH_SIZE])
+
+    for start in range(0, clients, SEED_BATCH_SIZE):
+        batch = [
+            {
+                "id": c + 1,
+                "inbound_id": inbound_ids[c % len(inbound_ids)],
+                "username": f"user{c + 1}",
+                "uuid": str(py_uuid.uuid4()),
+                "level": 0,
+                "traffic_up": 0,
+                "traffic_down": 0,
+                "enabled": True,
+            }
+            for c in range(start, min(clients, start + SEED_BATCH_SIZE))
+        ]
+        with engine.begin() as conn:
+            conn.execute(insert(Client), batch)
+
+    return {"nodes": nodes, "inbounds": len(inbound_ids), "clients": clients}
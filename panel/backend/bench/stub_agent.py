@@ -0,0 +1,55 @@
+import asyncio
+import threading
+import time
+from typing import Dict
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+
+class StubAgent:
+    """Локальная замена node-agent: подтверждает любой конфиг/дельту и считает применения."""
+
+    def __init__(self, apply_delay: float = 0.0):
+        self.apply_delay = apply_delay
+        self.applies: Dict[str, int] = {"config": 0, "delta": 0}
+        self.bytes_received = 0
+        self.app = FastAPI()
+        self.app.post("/apply-config")(self._apply_config)
+        self.app.post("/apply-delta")(self._apply_delta)
+        self.app.get("/health")(self._health)
+
+    async def _receive(self, request: Request, kind: str):
+        body = await request.body()
+        self.bytes_received += len(body)
+        self.applies[kind] += 1
+        if self.apply_delay > 0:
+            await asyncio.sleep(self.apply_delay)
+
+    async def _apply_config(self, request: Request):
+        await self._receive(request, "config")
+        return {"status": "applied", "mode": "restart"}
+
+    async def _apply_delta(self, request: Request):
+        await self._receive(request, "delta")
+        return {"status": "applied", "mode": "hot"}
+
+    async def _health(self):
+        return {"status": "ok"}
+
+
+def serve(app, host: str, port: int) -> uvicorn.Server:
+    """Поднимает ASGI-приложение в фоновом потоке и ждёт готовности."""
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError(f"Failed to start server on {host}:{port}")
+        time.sleep(0.05)
+    return server
+
+
+def shutdown(server: uvicorn.Server):
+    server.should_exit = True
@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# xray_panel.db требует DATABASE_URL при импорте; тесты создают свои базы сами
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/panel.db")
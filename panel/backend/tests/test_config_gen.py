@@ -0,0 +1,32 @@
+import copy
+
+from xray_panel.config_gen import build_node_config
+from xray_panel.models import Client, Inbound, Node
+
+
+def _node(*clients: Client) -> Node:
+    inbound = Inbound(id=1, node_id=1, name="main", listen="0.0.0.0", port=443, protocol="vless",
+                      network="tcp", security="none", sni="")
+    inbound.clients = list(clients)
+    node = Node(id=1, name="n1", url="http://n1:8585", node_key="k")
+    node.inbounds = [inbound]
+    return node
+
+
+def _without_clients(config):
+    config = copy.deepcopy(config)
+    for inbound in config["inbounds"]:
+        inbound.get("settings", {}).pop("clients", None)
+    return config
+
+
+def test_policy_does_not_depend_on_clients():
+    # Агент применяет без рестарта только изменения списков клиентов — всё остальное должно совпадать
+    empty = build_node_config(_node())
+    bob = Client(id=1, inbound_id=1, username="bob", uuid="6f1c1f8e-4c55-4a56-9a0e-3c8a0f3b2d11", level=5, enabled=True)
+    with_client = build_node_config(_node(bob))
+    bob.level, bob.enabled = 7, False
+    disabled = build_node_config(_node(bob))
+
+    assert _without_clients(empty) == _without_clients(with_client) == _without_clients(disabled)
+    assert "5" in empty["policy"]["levels"] and "7" in empty["policy"]["levels"]
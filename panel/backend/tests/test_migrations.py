@@ -0,0 +1,103 @@
+from alembic import command
+from sqlalchemy import Column, ForeignKey, Integer, MetaData, String, Table, UniqueConstraint, create_engine, inspect, text
+from sqlalchemy.orm import Session
+
+from xray_panel.migrate import alembic_config, run_migrations
+from xray_panel.placement import recount_clients
+
+
+def _baseline_metadata() -> MetaData:
+    # Схема models.py из baseline — то, что create_all создавал до появления миграций
+    metadata = MetaData()
+    Table(
+        "nodes",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("name", String, nullable=False, unique=True),
+        Column("url", String, nullable=False),
+        Column("node_key", String, nullable=False),
+    )
+    Table(
+        "inbounds",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("node_id", Integer, ForeignKey("nodes.id"), nullable=False),
+        Column("name", String, nullable=False),
+        Column("listen", String),
+        Column("port", Integer),
+        Column("protocol", String),
+        Column("network", String),
+        Column("security", String),
+        Column("sni", String),
+        Column("reality_private_key", String),
+        Column("reality_public_key", String),
+        Column("reality_short_id", String),
+        Column("reality_dest", String),
+        Column("reality_fingerprint", String),
+        UniqueConstraint("node_id", "name", name="uq_inbounds_node_name"),
+    )
+    Table(
+        "clients",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("inbound_id", Integer, ForeignKey("inbounds.id"), nullable=False),
+        Column("username", String, nullable=False),
+        Column("uuid", String, nullable=False, unique=True),
+        Column("level", Integer),
+        UniqueConstraint("inbound_id", "username", name="uq_clients_inbound_username"),
+    )
+    Table(
+        "subscriptions",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("username", String, nullable=False, unique=True),
+        Column("token", String, nullable=False, unique=True),
+    )
+    return metadata
+
+
+def test_upgrade_baseline_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/baseline.db")
+    _baseline_metadata().create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO nodes (id, name, url, node_key) VALUES (1, 'n1', 'http://n1:8585', 'k')"))
+        conn.execute(text("INSERT INTO inbounds (id, node_id, name) VALUES (1, 1, 'main')"))
+        conn.execute(
+            text("INSERT INTO clients (id, inbound_id, username, uuid, level) VALUES (1, 1, 'bob', :uuid, 0)"),
+            {"uuid": "6f1c1f8e-4c55-4a56-9a0e-3c8a0f3b2d11"},
+        )
+
+    run_migrations(engine)
+
+    tables = set(inspect(engine).get_table_names())
+    assert {"client_traffic", "node_health", "users", "push_outbox"} <= tables
+    with engine.connect() as conn:
+        node = conn.execute(text('SELECT "group", weight, mode, config_revision, applied_revision FROM nodes')).one()
+        assert tuple(node) == ("default", 1, "push", 0, 0)
+        client = conn.execute(text("SELECT traffic_up, traffic_down, enabled FROM clients")).one()
+        assert tuple(client) == (0, 0, 1)
+
+    # Здесь падал старт панели: no such column: client_count
+    with Session(engine) as db:
+        recount_clients(db)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT client_count FROM inbounds")).scalar() == 1
+
+    config = alembic_config()
+    with engine.connect() as conn:
+        config.attributes["connection"] = conn
+        command.check(config)
+
+
+def test_upgrade_is_idempotent_for_create_all_schema(tmp_path):
+    # База из create_all более поздней версии панели уже содержит часть колонок 0001a
+    engine = create_engine(f"sqlite:///{tmp_path}/partial.db")
+    _baseline_metadata().create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE nodes ADD COLUMN config_revision INTEGER NOT NULL DEFAULT 0"))
+        conn.execute(text("ALTER TABLE nodes ADD COLUMN applied_revision INTEGER NOT NULL DEFAULT 0"))
+
+    run_migrations(engine)
+
+    columns = {c["name"] for c in inspect(engine).get_columns("nodes")}
+    assert {"group", "weight", "mode", "config_revision", "applied_revision"} <= columns
@@ -0,0 +1,16 @@
+from fastapi.testclient import TestClient
+
+from xray_panel.db import SessionLocal, engine
+from xray_panel.main import app
+from xray_panel.models import Base, Node
+
+
+def test_poll_rejects_non_ascii_node_key():
+    Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        db.add(Node(id=401, name="pull-key", url="p", node_key="secret", mode="pull"))
+        db.commit()
+
+    # Без запуска startup-событий: до фоновых задач запрос не доходит
+    r = TestClient(app).get("/nodes/401/config/poll?wait=0", headers={"X-Node-Key": "ключ".encode()})
+    assert r.status_code == 401
@@ -0,0 +1,167 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException
+
+from xray_panel.db import SessionLocal, engine
+from xray_panel.models import Base, Node, PushOutbox
+from xray_panel.outbox import due
+from xray_panel.push_queue import PushScheduler
+
+
+def _scheduler(push):
+    # push — замена PushScheduler._push; как и настоящий, сбрасывает state.pending в начале
+    scheduler = PushScheduler(debounce=0.01, max_delay=0.05, outbox_interval=0)
+    scheduler._loop = asyncio.get_running_loop()
+    scheduler._push = push
+    return scheduler
+
+
+def test_push_now_is_not_concurrent_with_background_push():
+    active, peak, pushes = 0, 0, 0
+
+    async def run():
+        async def push(state):
+            nonlocal active, peak, pushes
+            state.pending = False
+            active += 1
+            peak = max(peak, active)
+            pushes += 1
+            await asyncio.sleep(0.05)
+            active -= 1
+            return {"status": "pushed"}
+
+        scheduler = _scheduler(push)
+        scheduler._mark_pending(1)
+        await asyncio.sleep(0.02)  # фоновый push уже идёт
+        manual = asyncio.create_task(scheduler.push_now(1))
+        await asyncio.sleep(0.08)  # push_now идёт; изменение во время него не должно запустить второй push
+        scheduler._mark_pending(1)
+        await manual
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert peak == 1
+    assert pushes == 3
+
+
+def test_push_many_retries_only_transient_failures():
+    calls = {}
+
+    async def run():
+        async def push(state):
+            state.pending = False
+            calls[state.node_id] = calls.get(state.node_id, 0) + 1
+            if state.node_id == 1:
+                raise HTTPException(status_code=400, detail="Node error: 400 xray -test failed")
+            if state.node_id == 2 and calls[2] == 1:
+                raise HTTPException(status_code=502, detail="Node error: 503")
+            return {"status": "pushed", "node_response": None}
+
+        scheduler = _scheduler(push)
+        return await scheduler.push_many([1, 2], retries=2)
+
+    rejected, flaky = asyncio.run(run())
+    assert (rejected["status"], rejected["attempts"]) == ("failed", 1)
+    assert (flaky["status"], flaky["attempts"]) == ("pushed", 2)
+
+
+def test_push_many_backoff_does_not_hold_a_slot(monkeypatch):
+    monkeypatch.setattr("xray_panel.push_queue.PUSH_RETRY_BACKOFF_SECONDS", 0.5)
+    pushed_at = {}
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        async def push(state):
+            state.pending = False
+            if state.node_id == 1:
+                raise HTTPException(status_code=502, detail="Node error: 503")
+            pushed_at[state.node_id] = loop.time() - started
+            return {"status": "pushed", "node_response": None}
+
+        return await _scheduler(push).push_many([1, 2], concurrency=1, retries=1)
+
+    failing, healthy = asyncio.run(run())
+    assert failing["attempts"] == 2 and healthy["status"] == "pushed"
+    # Здоровая нода получает единственный слот, пока первая ждёт повтора
+    assert pushed_at[2] < 0.3
+
+
+def test_rolled_back_node_is_not_pushed_until_resumed():
+    Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        db.add_all([
+            Node(id=101, name="rolled-back", url="a", node_key="k", config_revision=7, applied_revision=7),
+            Node(id=102, name="pull", url="b", node_key="k", mode="pull", config_revision=7, applied_revision=7),
+        ])
+        db.commit()
+    pushed = []
+
+    async def run():
+        async def push(state):
+            state.pending = False
+            state.applied_at = datetime.now(timezone.utc)
+            pushed.append(state.node_id)
+            return {"status": "pushed"}
+
+        scheduler = _scheduler(push)
+        # Проба, начатая до последнего успешного push, видела ещё старую ревизию
+        scheduler._get_state(101).applied_at = datetime.now(timezone.utc)
+        await scheduler.check_revision(101, 5, datetime.now(timezone.utc) - timedelta(seconds=1))
+        assert scheduler.state(101).rolled_back_revision is None
+
+        # Агент откатился из истории на ревизию 5: ни изменение, ни outbox, ни push_now его не трогают
+        for node_id in (101, 102):
+            await scheduler.check_revision(node_id, 5, datetime.now(timezone.utc))
+        scheduler._mark_pending(101)
+        await asyncio.sleep(0.05)
+        assert pushed == []
+        with SessionLocal() as db:
+            assert due(db, 10) == []
+        try:
+            await scheduler.push_now(101)
+        except HTTPException as e:
+            assert e.status_code == 409
+        else:
+            raise AssertionError("push_now must refuse a rolled back node")
+
+        assert await scheduler.resume_rollback(101)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert pushed == [101]
+    with SessionLocal() as db:
+        assert db.get(Node, 101).rolled_back_revision is None
+        assert db.get(Node, 102).rolled_back_revision is None
+        assert [row.node_id for row in db.query(PushOutbox)] == [101]
+
+
+def test_rejected_config_is_parked_until_revision_changes():
+    from xray_panel.outbox import enqueue, reconcile, record_failure
+
+    Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        db.add(Node(id=201, name="rejected", url="a", node_key="k", config_revision=3, applied_revision=2))
+        db.commit()
+        enqueue(db, [201])
+        db.commit()
+        assert 201 in due(db, 100)
+
+        # Агент отверг конфиг (xray -test) — ни повтор из outbox, ни сверка при старте его не отправляют
+        assert record_failure(db, 201, "Node error: 400 xray -test failed", rejected=True)[1] is None
+        reconcile(db)
+        enqueue(db, [201])
+        db.commit()
+        assert 201 not in due(db, 100)
+        assert db.get(PushOutbox, 201).last_error == "Node error: 400 xray -test failed"
+
+        db.get(Node, 201).config_revision = 4
+        db.flush()
+        enqueue(db, [201])
+        db.commit()
+        assert 201 in due(db, 100)
+
+        # Сбой сети — обычный backoff
+        assert record_failure(db, 201, "Node error: 503")[1] is not None
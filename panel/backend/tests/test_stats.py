@@ -0,0 +1,57 @@
+import asyncio
+
+import httpx
+
+from xray_panel import stats
+from xray_panel.db import SessionLocal, engine
+from xray_panel.models import Base, Client, Inbound, Node, User
+
+
+class _Agent:
+    """Агент, отдающий счётчики с reset: каждый ответ — только новые байты."""
+
+    def __init__(self, *payloads):
+        self.payloads = list(payloads)
+
+    async def post(self, url, json, headers):
+        return httpx.Response(200, json={"users": self.payloads.pop(0)})
+
+
+def test_traffic_is_kept_until_stored(monkeypatch):
+    Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        db.add(Node(id=301, name="stats", url="s", node_key="k"))
+        db.add(Inbound(id=301, node_id=301, name="main", listen="0.0.0.0", port=443, protocol="vless",
+                       network="tcp", security="none", sni=""))
+        db.add(Client(id=301, inbound_id=301, username="alice", uuid="00000000-0000-0000-0000-000000000301"))
+        db.add(User(id=301, username="bob", uuid="00000000-0000-0000-0000-000000000302"))
+        db.commit()
+
+    collector = stats.StatsCollector(interval=0)
+    collector._client = _Agent(
+        {"301.alice": [10, 20], "u301.bob": [1, 2]},
+        {"301.alice": [5, 5], "u301.bob": [3, 4]},
+    )
+    ingest = stats.ingest_counters
+    calls = []
+
+    def flaky_ingest(db, *args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+        return ingest(db, *args)
+
+    monkeypatch.setattr(stats, "ingest_counters", flaky_ingest)
+    monkeypatch.setattr(stats, "_list_nodes", lambda db: [(301, "s", "k")])
+    monkeypatch.setattr(stats.enforcer, "check_quotas", lambda ids: asyncio.sleep(0))
+
+    asyncio.run(collector.poll_once())
+    assert 301 in collector.last_errors
+    asyncio.run(collector.poll_once())
+    assert collector.last_errors == {}
+
+    with SessionLocal() as db:
+        client, user = db.get(Client, 301), db.get(User, 301)
+        # Первый опрос не сохранился, но его байты не потеряны
+        assert (client.traffic_up, client.traffic_down) == (15, 25)
+        assert (user.traffic_up, user.traffic_down) == (4, 6)
@@ -0,0 +1,278 @@
+import gzip
+import json
+import os
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Set
+
+from sqlalchemy import DateTime, Table, case, delete, select, text, update
+from sqlalchemy.orm import Session
+
+from .cache import bump_revision, cache
+from .models import Node, Inbound, Client, User, UserInbound, UserGroup, Subscription
+from .placement import recount_clients
+from .users import user_node_ids
+
+
+# Снапшот панели — NDJSON: строка meta, затем по каждой таблице строка-заголовок {"table", "columns"}
+# и строки-массивы значений в порядке колонок. Порядок таблиц — порядок внешних ключей.
+FORMAT = "xray-panel-ndjson"
+FORMAT_VERSION = 1
+# Строк на пачку: при экспорте — размер порции серверного курсора, при импорте — одного INSERT
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "5000"))
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "5000"))
+
+# История трафика, здоровье нод и outbox в снапшот не входят: первое велико, остальное — состояние процесса
+TABLES: List[Table] = [
+    m.__table__ for m in (Node, Inbound, Client, User, UserInbound, UserGroup, Subscription)  # type: ignore[attr-defined]
+]
+_BY_NAME = {t.name: t for t in TABLES}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, separators=(",", ":"), default=_json_default)
+
+
+def _schema_revision(db: Session) -> str | None:
+    try:
+        return db.execute(text("SELECT version_num FROM alembic_version")).scalar()
+    except Exception:
+        return None
+
+
+def iter_export(db: Session, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """Снапшот по частям: строки читаются серверным курсором пачками и сразу сериализуются."""
+    if db.get_bind().dialect.name == "postgresql":
+        # Все таблицы — из одного снимка БД, даже если панель меняет данные во время выгрузки
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ", "postgresql_readonly": True})
+    meta = {
+        "format": FORMAT,
+        "version": FORMAT_VERSION,
+        "schema": _schema_revision(db),
+        "exported_at": datetime.now(timezone.utc),
+    }
+    yield (_dumps(meta) + "\n").encode("utf-8")
+    for table in TABLES:
+        columns = list(table.columns)
+        yield (_dumps({"table": table.name, "columns": [c.name for c in columns]}) + "\n").encode("utf-8")
+        rows = db.execute(
+            select(*columns).order_by(*table.primary_key.columns).execution_options(yield_per=batch_size)
+        )
+        for partition in rows.partitions():
+            yield "".join(_dumps(list(row)) + "\n" for row in partition).encode("utf-8")
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def open_snapshot(f: BinaryIO) -> BinaryIO:
+    """Файл снапшота как есть или распакованный, если это gzip."""
+    magic = f.read(2)
+    f.seek(0)
+    return gzip.GzipFile(fileobj=f, mode="rb") if magic == b"\x1f\x8b" else f  # type: ignore[return-value]
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+@dataclass
+class ImportResult:
+    rows: Dict[str, int] = field(default_factory=dict)
+    node_ids: Set[int] = field(default_factory=set)
+    removed_node_ids: Set[int] = field(default_factory=set)
+
+
+def _insert(db: Session, table: Table):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError(f"Snapshot import is not supported for {dialect}")
+    stmt = insert(table)
+    keys = [c.name for c in table.primary_key.columns]
+    updates = {c.name: stmt.excluded[c.name] for c in table.columns if c.name not in keys}
+    if table is Node.__table__:
+        # Ревизия не откатывается: агент с той же ревизией принял бы новый конфиг за уже применённый
+        current, incoming = table.c.config_revision, stmt.excluded.config_revision
+        updates["config_revision"] = case((current > incoming, current), else_=incoming)
+    if not updates:
+        return stmt.on_conflict_do_nothing(index_elements=keys)
+    return stmt.on_conflict_do_update(index_elements=keys, set_=updates)
+
+
+def _converter(table: Table, name: str):
+    column = table.columns.get(name)
+    if column is None:
+        raise SnapshotError(f"Unknown column {table.name}.{name}")
+    if isinstance(column.type, DateTime):
+        return lambda v: datetime.fromisoformat(v) if isinstance(v, str) else v
+    return None
+
+
+def _fix_sequences(db: Session):
+    # Явные id не двигают SERIAL-последовательности PostgreSQL — иначе следующий INSERT упрётся в дубль
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    for table in TABLES:
+        if list(table.primary_key.columns.keys()) == ["id"]:
+            db.execute(
+                text(f"SELECT setval(pg_get_serial_sequence(:name, 'id'), COALESCE((SELECT MAX(id) FROM {table.name}), 1))"),
+                {"name": table.name},
+            )
+
+
+class _Importer:
+    def __init__(self, db: Session, batch_size: int):
+        self.db = db
+        self.batch_size = batch_size
+        self.result = ImportResult()
+        self.table: Table | None = None
+        self.columns: List[str] = []
+        self.converters: List[Any] = []
+        self.batch: List[Dict[str, Any]] = []
+        # Ссылки из импортированных строк — по ним находятся ноды, которым нужен push
+        self.inbound_ids: Set[int] = set()
+        self.groups: Set[str] = set()
+        self.user_ids: Set[int] = set()
+
+    def header(self, obj: Dict[str, Any]):
+        self.flush()
+        table = _BY_NAME.get(obj.get("table"))
+        if table is None:
+            raise SnapshotError(f"Unknown table: {obj.get('table')}")
+        self.table = table
+        self.columns = list(obj.get("columns") or [])
+        self.converters = [_converter(table, name) for name in self.columns]
+        self.result.rows.setdefault(table.name, 0)
+
+    def row(self, values: List[Any]):
+        if self.table is None or len(values) != len(self.columns):
+            raise SnapshotError("Row does not match the table header")
+        row = {
+            name: (convert(value) if convert is not None and value is not None else value)
+            for name, convert, value in zip(self.columns, self.converters, values)
+        }
+        self._track(self.table.name, row)
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def _track(self, name: str, row: Dict[str, Any]):
+        # Без нужной колонки строка всё равно не пройдёт INSERT — здесь её просто пропускаем
+        refs = {
+            "nodes": (self.result.node_ids, "id"),
+            "inbounds": (self.result.node_ids, "node_id"),
+            "clients": (self.inbound_ids, "inbound_id"),
+            "user_inbounds": (self.inbound_ids, "inbound_id"),
+            "user_groups": (self.groups, "group"),
+        }
+        if name in refs:
+            target, key = refs[name]
+            if row.get(key) is not None:
+                target.add(row[key])
+        if name in ("users", "user_inbounds", "user_groups"):
+            user_id = row.get("id" if name == "users" else "user_id")
+            if user_id is not None:
+                self.user_ids.add(user_id)
+
+    def flush(self):
+        if self.table is not None and self.batch:
+            self.db.execute(_insert(self.db, self.table), self.batch)
+            self.result.rows[self.table.name] += len(self.batch)
+            self.batch = []
+
+    def affected_nodes(self) -> Set[int]:
+        node_ids = set(self.result.node_ids)
+        ids = sorted(self.inbound_ids)
+        for i in range(0, len(ids), 1000):
+            node_ids.update(
+                self.db.execute(select(Inbound.node_id).where(Inbound.id.in_(ids[i : i + 1000]))).scalars()
+            )
+        if self.groups:
+            node_ids.update(self.db.execute(select(Node.id).where(Node.group.in_(sorted(self.groups)))).scalars())
+        user_ids = sorted(self.user_ids)
+        for i in range(0, len(user_ids), 1000):
+            node_ids |= user_node_ids(self.db, user_ids[i : i + 1000])
+        existing = set(self.db.execute(select(Node.id)).scalars()) if node_ids else set()
+        return node_ids & existing
+
+
+def import_snapshot(
+    db: Session, f: BinaryIO, replace: bool = False, batch_size: int = IMPORT_BATCH_SIZE
+) -> ImportResult:
+    """Загружает снапшот пачками upsert'ов по первичному ключу в одной транзакции.
+
+    replace — сначала удалить всё, что входит в снапшот (ноды — каскадом с inbounds и клиентами).
+    В конце ревизия затронутых нод увеличивается и они попадают в push_outbox — по одному push на ноду.
+    """
+    importer = _Importer(db, max(1, batch_size))
+    previous: Set[int] = set()
+    try:
+        lines = iter(open_snapshot(f))
+        first = next(lines, b"").strip()
+        meta = json.loads(first) if first else {}
+        if not isinstance(meta, dict) or meta.get("format") != FORMAT:
+            raise SnapshotError("Not a panel snapshot")
+        if meta.get("version") != FORMAT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot version: {meta.get('version')}")
+
+        revisions: Dict[int, int] = {}
+        if replace:
+            revisions = dict(db.execute(select(Node.id, Node.config_revision)).all())
+            previous = set(revisions)
+            for table in reversed(TABLES):
+                db.execute(delete(table))
+
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            obj = json.loads(line)
+            if isinstance(obj, dict):
+                importer.header(obj)
+            elif isinstance(obj, list):
+                importer.row(obj)
+            else:
+                raise SnapshotError("Unexpected snapshot line")
+        importer.flush()
+
+        result = importer.result
+        result.node_ids = importer.affected_nodes()
+        result.removed_node_ids = previous - set(db.execute(select(Node.id)).scalars())
+        if revisions:
+            # То же для нод, пересозданных при replace
+            behind = db.execute(
+                select(Node.id, Node.config_revision).where(Node.id.in_(sorted(previous - result.removed_node_ids)))
+            ).all()
+            rows = [{"id": i, "config_revision": revisions[i]} for i, rev in behind if rev < revisions[i]]
+            if rows:
+                db.execute(update(Node), rows)
+        _fix_sequences(db)
+        bump_revision(db, result.node_ids)
+        # Пересчёт inbounds.client_count завершает транзакцию коммитом
+        recount_clients(db)
+    except (OSError, EOFError, zlib.error, ValueError) as e:
+        # Битый gzip, не JSON или строка не по заголовку — ошибка снапшота, а не сервера
+        db.rollback()
+        raise e if isinstance(e, SnapshotError) else SnapshotError(f"Broken snapshot: {e}") from e
+    except Exception:
+        db.rollback()
+        raise
+    cache.clear(result.node_ids | result.removed_node_ids)
+    return result
@@ -0,0 +1,272 @@
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, joinedload
+
+from . import metrics
+from .config_gen import build_node_config
+from .models import Node, Inbound, Client, Subscription, User
+from .outbox import enqueue
+from .users import members_by_inbound
+
+
+@dataclass
+class CompiledConfig:
+    revision: int
+    config: Dict[str, Any]
+    body: bytes
+    etag: str
+
+
+def compile_node_config(node: Node, members: Optional[Dict[int, list]] = None) -> CompiledConfig:
+    started = time.perf_counter()
+    config = build_node_config(node, members)
+    body = json.dumps(config, separators=(",", ":")).encode("utf-8")
+    metrics.observe_config("compiled", time.perf_counter() - started, len(body))
+    return CompiledConfig(
+        revision=node.config_revision or 0,
+        config=config,
+        body=body,
+        etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+    )
+
+
+class PanelCache:
+    """Кэш собранных конфигов нод, VLESS URI клиентов и тел подписок.
+
+    Инвалидация — по коммиту сессии (см. события ниже). Поколения (на ноду для конфигов и общее
+    для URI) защищают от гонки, когда запрос прочитал данные до чужого коммита, а положить их
+    в кэш пытается после.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._configs: Dict[int, CompiledConfig] = {}
+        self._uris: Dict[int, Tuple[int, str]] = {}
+        self._uris_by_inbound: Dict[int, Set[int]] = {}
+        self._inbound_nodes: Dict[int, int] = {}
+        self._generations: Dict[int, int] = {}
+        self._epoch = 0
+        # token -> (username, node_ids, inbound_ids, body, etag)
+        self._subs: Dict[str, Tuple[str, Set[int], Set[int], bytes, str]] = {}
+        self._subs_by_username: Dict[str, Set[str]] = {}
+
+    def generation(self, node_id: int) -> int:
+        with self._lock:
+            return self._generations.get(node_id, 0)
+
+    def epoch(self) -> int:
+        with self._lock:
+            return self._epoch
+
+    def get_config(self, node_id: int) -> Optional[CompiledConfig]:
+        with self._lock:
+            return self._configs.get(node_id)
+
+    def put_config(self, node_id: int, compiled: CompiledConfig, inbound_ids: Iterable[int], generation: int):
+        with self._lock:
+            if self._generations.get(node_id, 0) != generation:
+                return
+            self._configs[node_id] = compiled
+            for inbound_id in inbound_ids:
+                self._inbound_nodes[inbound_id] = node_id
+
+    def get_uri(self, client_id: int) -> Optional[str]:
+        with self._lock:
+            entry = self._uris.get(client_id)
+            return entry[1] if entry else None
+
+    def put_uri(self, client_id: int, inbound_id: int, node_id: int, uri: str, epoch: int):
+        with self._lock:
+            if self._epoch != epoch:
+                return
+            self._uris[client_id] = (inbound_id, uri)
+            self._uris_by_inbound.setdefault(inbound_id, set()).add(client_id)
+            self._inbound_nodes[inbound_id] = node_id
+
+    def get_subscription(self, token: str) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._subs.get(token)
+            return (entry[3], entry[4]) if entry else None
+
+    def put_subscription(
+        self,
+        token: str,
+        username: str,
+        node_ids: Set[int],
+        inbound_ids: Set[int],
+        body: bytes,
+        etag: str,
+        epoch: int,
+    ):
+        with self._lock:
+            if self._epoch != epoch:
+                return
+            self._subs[token] = (username, node_ids, inbound_ids, body, etag)
+            self._subs_by_username.setdefault(username, set()).add(token)
+
+    def _drop_subscription(self, token: str):
+        entry = self._subs.pop(token, None)
+        if entry is not None:
+            tokens = self._subs_by_username.get(entry[0])
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    self._subs_by_username.pop(entry[0], None)
+
+    def invalidate(
+        self,
+        nodes: Iterable[int] = (),
+        inbounds: Iterable[int] = (),
+        clients: Iterable[int] = (),
+        client_inbounds: Iterable[int] = (),
+        configs: Iterable[int] = (),
+        usernames: Iterable[str] = (),
+    ):
+        """nodes/inbounds сбрасывают всё, что от них зависит; клиенты и configs — только URI клиентов и конфиг ноды."""
+        with self._lock:
+            node_ids = set(nodes)
+            inbound_ids = set(inbounds)
+            touched = set(client_inbounds)
+            config_ids = set(configs)
+            for client_id in clients:
+                entry = self._uris.pop(client_id, None)
+                if entry is not None:
+                    touched.add(entry[0])
+                    self._uris_by_inbound.get(entry[0], set()).discard(client_id)
+            for inbound_id in inbound_ids:
+                node_id = self._inbound_nodes.get(inbound_id)
+                if node_id is not None:
+                    node_ids.add(node_id)
+            for inbound_id in touched:
+                node_id = self._inbound_nodes.get(inbound_id)
+                if node_id is not None:
+                    config_ids.add(node_id)
+            for inbound_id, node_id in list(self._inbound_nodes.items()):
+                if node_id in node_ids:
+                    inbound_ids.add(inbound_id)
+            for inbound_id in inbound_ids:
+                for client_id in self._uris_by_inbound.pop(inbound_id, ()):
+                    self._uris.pop(client_id, None)
+                self._inbound_nodes.pop(inbound_id, None)
+            for username in usernames:
+                for token in list(self._subs_by_username.get(username, ())):
+                    self._drop_subscription(token)
+            if node_ids or inbound_ids:
+                for token, entry in list(self._subs.items()):
+                    if entry[1] & node_ids or entry[2] & inbound_ids:
+                        self._drop_subscription(token)
+            self._epoch += 1
+            for node_id in node_ids | config_ids:
+                self._configs.pop(node_id, None)
+                self._generations[node_id] = self._generations.get(node_id, 0) + 1
+
+    def clear(self, nodes: Iterable[int] = ()):
+        """Сброс всего кэша — после массовых изменений в обход ORM (импорт снапшота)."""
+        with self._lock:
+            for node_id in set(self._configs) | set(self._generations) | set(nodes):
+                self._generations[node_id] = self._generations.get(node_id, 0) + 1
+            self._configs.clear()
+            self._uris.clear()
+            self._uris_by_inbound.clear()
+            self._inbound_nodes.clear()
+            self._subs.clear()
+            self._subs_by_username.clear()
+            self._epoch += 1
+
+
+cache = PanelCache()
+
+
+def load_compiled_config(db: Session, node_id: int) -> Optional[CompiledConfig]:
+    compiled = cache.get_config(node_id)
+    if compiled is not None:
+        return compiled
+    generation = cache.generation(node_id)
+    node = (
+        db.query(Node)
+        .options(joinedload(Node.inbounds).joinedload(Inbound.clients))
+        .filter(Node.id == node_id)
+        .first()
+    )
+    if not node:
+        return None
+    compiled = compile_node_config(node, members_by_inbound(db, node_id))
+    cache.put_config(node_id, compiled, [i.id for i in node.inbounds], generation)
+    return compiled
+
+
+def _pending(session: Session) -> Dict[str, Set[int]]:
+    return session.info.setdefault(
+        "cache_invalidate",
+        {
+            "nodes": set(),
+            "inbounds": set(),
+            "clients": set(),
+            "client_inbounds": set(),
+            "configs": set(),
+            "usernames": set(),
+        },
+    )
+
+
+def mark_dirty(
+    session: Session,
+    configs: Iterable[int] = (),
+    clients: Iterable[int] = (),
+    usernames: Iterable[str] = (),
+):
+    """Для bulk-запросов мимо unit of work: инвалидация произойдёт после коммита сессии."""
+    pending = _pending(session)
+    pending["configs"].update(configs)
+    pending["clients"].update(clients)
+    pending["usernames"].update(usernames)
+
+
+def bump_revision(session: Session, node_ids: Iterable[int]):
+    """Увеличивает config_revision нод и ставит их в outbox; конфиги сбросятся из кэша после коммита."""
+    ids = sorted(set(node_ids))
+    if ids:
+        session.query(Node).filter(Node.id.in_(ids)).update(
+            {Node.config_revision: Node.config_revision + 1}, synchronize_session=False
+        )
+        enqueue(session, ids)
+        mark_dirty(session, configs=ids)
+
+
+def _usernames(obj) -> Set[str]:
+    # Текущее и прежнее имя — переименование меняет состав обеих подписок
+    history = inspect(obj).attrs.username.history
+    names = {obj.username, *(history.deleted or ())}
+    return {n for n in names if n}
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_dirty(session: Session, flush_context):
+    pending = _pending(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Node):
+            pending["nodes"].add(obj.id)
+        elif isinstance(obj, Inbound):
+            pending["inbounds"].add(obj.id)
+            if obj.node_id is not None:
+                pending["nodes"].add(obj.node_id)
+        elif isinstance(obj, Client):
+            pending["clients"].add(obj.id)
+            pending["usernames"].update(_usernames(obj))
+            if obj.inbound_id is not None:
+                pending["client_inbounds"].add(obj.inbound_id)
+        elif isinstance(obj, (Subscription, User)):
+            pending["usernames"].update(_usernames(obj))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_invalidation(session: Session):
+    pending = session.info.pop("cache_invalidate", None)
+    if pending:
+        cache.invalidate(**pending)
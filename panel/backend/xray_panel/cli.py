@@ -0,0 +1,68 @@
+"""Выгрузка и загрузка состояния панели без запущенного API.
+
+Запуск из panel/backend (DATABASE_URL — та же база, что у панели):
+
+    python -m xray_panel.cli export -o panel.ndjson.gz --gzip
+    python -m xray_panel.cli import panel.ndjson.gz --replace
+
+Push на ноды после импорта делает панель: затронутые ноды остаются в push_outbox до её старта.
+"""
+import argparse
+import json
+import sys
+from typing import List
+
+from .backup import SnapshotError, gzip_chunks, import_snapshot, iter_export
+from .db import SessionLocal, engine
+from .migrate import run_migrations
+
+
+def _export(args) -> int:
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        with SessionLocal() as db:
+            chunks = iter_export(db)
+            for chunk in gzip_chunks(chunks) if args.gzip else chunks:
+                out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+    return 0
+
+
+def _import(args) -> int:
+    with open(args.file, "rb") as f, SessionLocal() as db:
+        try:
+            result = import_snapshot(db, f, replace=args.replace)
+        except SnapshotError as e:
+            sys.stderr.write(f"{e}\n")
+            return 1
+    report = {
+        "rows": result.rows,
+        "nodes": sorted(result.node_ids),
+        "removed_nodes": sorted(result.removed_node_ids),
+    }
+    sys.stdout.write(json.dumps(report) + "\n")
+    return 0
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m xray_panel.cli", description="Xray panel snapshots")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write nodes, inbounds, clients and users as NDJSON")
+    export.add_argument("-o", "--output", help="write here instead of stdout")
+    export.add_argument("--gzip", action="store_true")
+    load = commands.add_parser("import", help="upsert a snapshot (plain or gzip)")
+    load.add_argument("file")
+    load.add_argument("--replace", action="store_true", help="delete current state first")
+    args = parser.parse_args(argv)
+
+    run_migrations(engine)
+    try:
+        return _export(args) if args.command == "export" else _import(args)
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
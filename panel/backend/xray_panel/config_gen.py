@@ -1,51 +1,248 @@
-from typing import Dict, Any
+import json
+import os
+from typing import Dict, Any, Iterator, List, Optional
 
-from .models import Node
+from sqlalchemy import select
+from sqlalchemy.orm import Session
 
+from .models import Node, Inbound, Client
+from .users import member_rows
 
-def build_node_config(node: Node) -> Dict[str, Any]:
-    config: Dict[str, Any] = {
+
+# Локальный gRPC API Xray, через который агент добавляет/удаляет клиентов без рестарта
+XRAY_API_TAG = "api"
+XRAY_API_PORT = int(os.environ.get("XRAY_API_PORT", "10085"))
+# Уровни политики 0..XRAY_MAX_LEVEL есть в конфиге всегда: секция policy не зависит от клиентов,
+# и создание/отключение клиента остаётся изменением только списков клиентов (hot apply без рестарта)
+XRAY_MAX_LEVEL = int(os.environ.get("XRAY_MAX_LEVEL", "9"))
+# Размер пачки клиентов при потоковой сериализации конфига из курсора БД
+CONFIG_STREAM_BATCH_SIZE = int(os.environ.get("CONFIG_STREAM_BATCH_SIZE", "5000"))
+
+
+def inbound_tag(inbound: Inbound) -> str:
+    return f"inbound-{inbound.id}"
+
+
+def client_email(client: Client) -> str:
+    # email — ключ пользователя в Xray (API и счётчики трафика), поэтому должен быть уникален на ноде
+    return f"{client.id}.{client.username}"
+
+
+def user_email(user) -> str:
+    # Префикс "u" не пересекается с email'ами клиентов, начинающимися с id
+    return f"u{user.id}.{user.username}"
+
+
+def client_id_from_email(email: str) -> Optional[int]:
+    head, _, _ = email.partition(".")
+    return int(head) if head.isdigit() else None
+
+
+def user_id_from_email(email: str) -> Optional[int]:
+    head, _, _ = email.partition(".")
+    return int(head[1:]) if head[:1] == "u" and head[1:].isdigit() else None
+
+
+def _base_config() -> Dict[str, Any]:
+    return {
         "log": {"loglevel": "warning"},
-        "inbounds": [],
+        "api": {"tag": XRAY_API_TAG, "services": ["HandlerService", "StatsService"]},
+        "stats": {},
+        "inbounds": [
+            {
+                "tag": XRAY_API_TAG,
+                "listen": "127.0.0.1",
+                "port": XRAY_API_PORT,
+                "protocol": "dokodemo-door",
+                "settings": {"address": "127.0.0.1"},
+            }
+        ],
         "outbounds": [{"protocol": "freedom"}],
+        "routing": {
+            "rules": [{"type": "field", "inboundTag": [XRAY_API_TAG], "outboundTag": XRAY_API_TAG}],
+        },
     }
 
-    for inbound in node.inbounds:
-        clients = [
-            {"id": c.uuid, "email": c.username, "level": c.level}
-            for c in inbound.clients
-        ]
-
-        inbound_dict: Dict[str, Any] = {
-            "listen": inbound.listen,
-            "port": inbound.port,
-            "protocol": inbound.protocol,
-            "settings": {"clients": clients, "decryption": "none"},
-            "streamSettings": {"network": inbound.network},
-            "sniffing": {"enabled": True, "destOverride": ["http", "tls"]},
+
+def _client_config(client) -> Dict[str, Any]:
+    return {"id": client.uuid, "email": client_email(client), "level": client.level}
+
+
+def _user_config(user) -> Dict[str, Any]:
+    return {"id": user.uuid, "email": user_email(user), "level": user.level}
+
+
+def _short_ids(inbound: Inbound) -> List[str]:
+    # Срок прежнего short ID снимает Enforcer (expire_short_ids) — конфиг от текущего времени не зависит
+    previous = inbound.reality_previous_short_id
+    if previous and previous != inbound.reality_short_id:
+        return [inbound.reality_short_id, previous]
+    return [inbound.reality_short_id]
+
+
+def _inbound_config(inbound: Inbound, clients: Any) -> Dict[str, Any]:
+    inbound_dict: Dict[str, Any] = {
+        "tag": inbound_tag(inbound),
+        "listen": inbound.listen,
+        "port": inbound.port,
+        "protocol": inbound.protocol,
+        "settings": {"clients": clients, "decryption": "none"},
+        "streamSettings": {"network": inbound.network},
+        "sniffing": {"enabled": True, "destOverride": ["http", "tls"]},
+    }
+
+    sec = (inbound.security or "").lower()
+    if sec == "reality":
+        if not inbound.sni:
+            raise ValueError("Reality inbound requires sni")
+        if not inbound.reality_private_key:
+            raise ValueError("Reality inbound requires reality_private_key")
+        if not inbound.reality_short_id:
+            raise ValueError("Reality inbound requires reality_short_id")
+        dest = inbound.reality_dest or f"{inbound.sni}:443"
+
+        inbound_dict["streamSettings"]["security"] = "reality"
+        inbound_dict["streamSettings"]["realitySettings"] = {
+            "show": False,
+            "dest": dest,
+            "xver": 0,
+            "serverNames": [inbound.sni],
+            "privateKey": inbound.reality_private_key,
+            "shortIds": _short_ids(inbound),
+            "spiderX": "/",
         }
+    return inbound_dict
 
-        sec = (inbound.security or "").lower()
-        if sec == "reality":
-            if not inbound.sni:
-                raise ValueError("Reality inbound requires sni")
-            if not inbound.reality_private_key:
-                raise ValueError("Reality inbound requires reality_private_key")
-            if not inbound.reality_short_id:
-                raise ValueError("Reality inbound requires reality_short_id")
-            dest = inbound.reality_dest or f"{inbound.sni}:443"
-
-            inbound_dict["streamSettings"]["security"] = "reality"
-            inbound_dict["streamSettings"]["realitySettings"] = {
-                "show": False,
-                "dest": dest,
-                "xver": 0,
-                "serverNames": [inbound.sni],
-                "privateKey": inbound.reality_private_key,
-                "shortIds": [inbound.reality_short_id],
-                "spiderX": "/",
-            }
 
-        config["inbounds"].append(inbound_dict)
+def _policy() -> Dict[str, Any]:
+    # Поюзерные счётчики uplink/downlink включаются политикой уровня
+    return {
+        "levels": {
+            str(level): {"statsUserUplink": True, "statsUserDownlink": True}
+            for level in range(XRAY_MAX_LEVEL + 1)
+        },
+    }
+
 
+def build_node_config(node: Node, members: Optional[Dict[int, List[Any]]] = None) -> Dict[str, Any]:
+    """members — пользователи по inbound_id (см. users.members_by_inbound), идут после клиентов inbound'а."""
+    config = _base_config()
+    for inbound in node.inbounds:
+        enabled = [c for c in inbound.clients if c.enabled is not False]
+        users = (members or {}).get(inbound.id, [])
+        clients = [_client_config(c) for c in enabled] + [_user_config(u) for u in users]
+        config["inbounds"].append(_inbound_config(inbound, clients))
+    config["policy"] = _policy()
     return config
+
+
+# Место списка клиентов в заготовке конфига; при сериализации заменяется потоком клиентов
+_CLIENTS_MARKER = "\x00clients\x00"
+
+
+def _iter_clients_json(db: Session, node_id: int, inbound_id: int, batch_size: int) -> Iterator[bytes]:
+    clients = (
+        select(Client.id, Client.username, Client.uuid, Client.level)
+        .where(Client.inbound_id == inbound_id, Client.enabled.is_(True))
+        .order_by(Client.id.asc())
+    )
+    prefix = "["
+    for query, to_config in ((clients, _client_config), (member_rows(node_id, inbound_id), _user_config)):
+        rows = db.execute(query.execution_options(yield_per=batch_size))
+        for partition in rows.partitions():
+            yield (prefix + ",".join(json.dumps(to_config(r), separators=(",", ":")) for r in partition)).encode("utf-8")
+            prefix = ","
+    yield b"[]" if prefix == "[" else b"]"
+
+
+def iter_node_config_json(db: Session, node_id: int, batch_size: int = CONFIG_STREAM_BATCH_SIZE) -> Iterator[bytes]:
+    """Тот же конфиг, что build_node_config, но сразу в JSON и по частям.
+
+    Клиенты читаются серверным курсором пачками по batch_size и сериализуются на лету —
+    ни ORM-объектов, ни словаря конфига на всю ноду в памяти не держится.
+    """
+    inbounds = db.execute(select(Inbound).where(Inbound.node_id == node_id).order_by(Inbound.id.asc())).scalars().all()
+    config = _base_config()
+    config["inbounds"].extend(_inbound_config(inbound, _CLIENTS_MARKER) for inbound in inbounds)
+    config["policy"] = _policy()
+    parts = json.dumps(config, separators=(",", ":")).split(json.dumps(_CLIENTS_MARKER))
+    inbound_ids = [inbound.id for inbound in inbounds]
+
+    yield parts[0].encode("utf-8")
+    for inbound_id, tail in zip(inbound_ids, parts[1:]):
+        yield from _iter_clients_json(db, node_id, inbound_id, batch_size)
+        yield tail.encode("utf-8")
+
+
+def _inbound_without_clients(inbound: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(inbound)
+    settings = inbound.get("settings")
+    if isinstance(settings, dict):
+        out["settings"] = {k: v for k, v in settings.items() if k != "clients"}
+    return out
+
+
+def _clients_by_email(inbound: Dict[str, Any]) -> Optional[Dict[str, Dict[str, Any]]]:
+    result: Dict[str, Dict[str, Any]] = {}
+    for c in (inbound.get("settings") or {}).get("clients") or []:
+        email = c.get("email")
+        if not email or email in result:
+            return None
+        result[email] = c
+    return result
+
+
+def diff_node_config(old: Dict[str, Any], new: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Дельта между двумя конфигами ноды; None — если разницу нельзя выразить дельтой."""
+    old_inbounds = {i.get("tag"): i for i in old.get("inbounds") or []}
+    new_inbounds = {i.get("tag"): i for i in new.get("inbounds") or []}
+    if None in old_inbounds or None in new_inbounds:
+        return None
+    if len(old_inbounds) != len(old.get("inbounds") or []) or len(new_inbounds) != len(new.get("inbounds") or []):
+        return None
+
+    delta: Dict[str, Any] = {}
+
+    keys = (set(old) | set(new)) - {"inbounds"}
+    changed_sections = {k: new[k] for k in keys if k in new and old.get(k) != new[k]}
+    removed_sections = sorted(k for k in keys if k not in new)
+    if changed_sections:
+        delta["set"] = changed_sections
+    if removed_sections:
+        delta["unset"] = removed_sections
+
+    added: List[Dict[str, Any]] = []
+    changed: List[Dict[str, Any]] = []
+    clients: Dict[str, Dict[str, Any]] = {}
+    for tag, inbound in new_inbounds.items():
+        before = old_inbounds.get(tag)
+        if before is None:
+            added.append(inbound)
+            continue
+        if _inbound_without_clients(before) != _inbound_without_clients(inbound):
+            changed.append(inbound)
+            continue
+        old_clients = _clients_by_email(before)
+        new_clients = _clients_by_email(inbound)
+        if old_clients is None or new_clients is None:
+            changed.append(inbound)
+            continue
+        if old_clients == new_clients:
+            continue
+        clients[tag] = {
+            "added": [c for email, c in new_clients.items() if email not in old_clients],
+            "changed": [c for email, c in new_clients.items() if email in old_clients and old_clients[email] != c],
+            "removed": [email for email in old_clients if email not in new_clients],
+        }
+
+    removed = [tag for tag in old_inbounds if tag not in new_inbounds]
+    if added or changed or removed or list(old_inbounds) != list(new_inbounds):
+        delta["inbounds"] = {
+            "order": list(new_inbounds),
+            "added": added,
+            "changed": changed,
+            "removed": removed,
+        }
+    if clients:
+        delta["clients"] = clients
+    return delta
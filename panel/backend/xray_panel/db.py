@@ -1,15 +1,84 @@
 import os
+from typing import Any, Callable, Dict, TypeVar
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL is required")
 
-engine = create_engine(DATABASE_URL)
+# Параметры пула соединений (для SQLite не применяются)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") == "1"
+
+# Асинхронный движок (asyncpg / aiosqlite) для горячих путей и фоновых задач
+DB_ASYNC = os.environ.get("DB_ASYNC", "0") == "1"
+# Пул асинхронного движка — часть DB_POOL_SIZE / DB_MAX_OVERFLOW, а не второй такой же: по умолчанию
+# пополам с синхронным, так что общее число соединений с БД не растёт
+DB_ASYNC_POOL_SIZE = int(os.environ.get("DB_ASYNC_POOL_SIZE", str(max(1, DB_POOL_SIZE // 2))))
+DB_ASYNC_MAX_OVERFLOW = int(os.environ.get("DB_ASYNC_MAX_OVERFLOW", str(DB_MAX_OVERFLOW // 2)))
+_ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def _async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return f"{_ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL", "") or _async_url(DATABASE_URL)
+
+
+def _engine_kwargs(url: str, pool_size: int, max_overflow: int) -> Dict[str, Any]:
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        # pool_size=0 у QueuePool означает «без ограничения»
+        "pool_size": max(1, pool_size),
+        "max_overflow": max(0, max_overflow),
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def _sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite проверяет внешние ключи и выполняет ON DELETE CASCADE только с этим PRAGMA
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+if DB_ASYNC:
+    _sync_pool = (DB_POOL_SIZE - DB_ASYNC_POOL_SIZE, DB_MAX_OVERFLOW - DB_ASYNC_MAX_OVERFLOW)
+else:
+    _sync_pool = (DB_POOL_SIZE, DB_MAX_OVERFLOW)
+engine = create_engine(DATABASE_URL, **_engine_kwargs(DATABASE_URL, *_sync_pool))
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", _sqlite_foreign_keys)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    # sqlalchemy.ext.asyncio требует greenlet, поэтому импортируется только при включённом режиме
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL, **_engine_kwargs(ASYNC_DATABASE_URL, DB_ASYNC_POOL_SIZE, DB_ASYNC_MAX_OVERFLOW)
+    )
+    if async_engine.dialect.name == "sqlite":
+        event.listen(async_engine.sync_engine, "connect", _sqlite_foreign_keys)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 
 def get_db():
     db = SessionLocal()
@@ -17,3 +86,32 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+T = TypeVar("T")
+
+
+def _call_with_session(fn: Callable[..., T], *args: Any) -> T:
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+async def run_db(fn: Callable[..., T], *args: Any) -> T:
+    """Выполняет fn(session, *args) в короткой сессии, не блокируя event loop.
+
+    С DB_ASYNC=1 — через AsyncSession.run_sync на асинхронном движке, иначе — в threadpool.
+    Сессия закрывается до возврата, поэтому соединение не удерживается во время сетевых вызовов.
+    """
+    if AsyncSessionLocal is None:
+        return await run_in_threadpool(_call_with_session, fn, *args)
+    async with AsyncSessionLocal() as session:
+        return await session.run_sync(lambda db: fn(db, *args))
+
+
+async def dispose_engines():
+    if async_engine is not None:
+        await async_engine.dispose()
+    engine.dispose()
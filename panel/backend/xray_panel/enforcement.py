@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from .cache import bump_revision, mark_dirty
+from .db import run_db
+from .models import Client, Inbound
+
+
+# Как часто проверять истёкшие сроки и сколько клиентов отключать за один запрос
+ENFORCE_INTERVAL_SECONDS = float(os.environ.get("ENFORCE_INTERVAL_SECONDS", "30"))
+ENFORCE_BATCH_SIZE = int(os.environ.get("ENFORCE_BATCH_SIZE", "1000"))
+
+REASON_QUOTA = "quota"
+REASON_EXPIRED = "expired"
+REASON_MANUAL = "manual"
+
+log = logging.getLogger("xray_panel.enforcement")
+
+
+def as_utc(ts: Optional[datetime]) -> Optional[datetime]:
+    # SQLite возвращает DateTime(timezone=True) без зоны — считаем такие значения UTC
+    if ts is None or ts.tzinfo is not None:
+        return ts
+    return ts.replace(tzinfo=timezone.utc)
+
+
+def limit_reason(
+    data_limit: Optional[int],
+    traffic_up: int,
+    traffic_down: int,
+    expires_at: Optional[datetime],
+    now: datetime,
+) -> Optional[str]:
+    expires_at = as_utc(expires_at)
+    if expires_at is not None and expires_at <= now:
+        return REASON_EXPIRED
+    if data_limit is not None and (traffic_up or 0) + (traffic_down or 0) >= data_limit:
+        return REASON_QUOTA
+    return None
+
+
+def resolve_enabled(
+    requested: Optional[bool],
+    enabled: bool,
+    disabled_reason: Optional[str],
+    reason: Optional[str],
+) -> Tuple[bool, Optional[str]]:
+    """Итоговое (enabled, disabled_reason) после изменения клиента.
+
+    Ручное отключение сохраняется, пока клиента явно не включат; отключение по лимиту
+    снимается само, как только лимит или срок расширены.
+    """
+    if requested is False:
+        return False, REASON_MANUAL
+    if requested is None and not enabled and disabled_reason == REASON_MANUAL:
+        return False, REASON_MANUAL
+    return reason is None, reason
+
+
+def _disable(db: Session, rows: List[Tuple[int, int, str]], reason: str) -> Set[int]:
+    ids = [r[0] for r in rows]
+    db.execute(
+        update(Client)
+        .where(Client.id.in_(ids), Client.enabled.is_(True))
+        .values(enabled=False, disabled_reason=reason)
+        .execution_options(synchronize_session=False)
+    )
+    node_ids = {r[1] for r in rows}
+    mark_dirty(db, clients=ids, usernames={r[2] for r in rows})
+    bump_revision(db, node_ids)
+    db.commit()
+    return node_ids
+
+
+def _enabled_rows():
+    return (
+        select(Client.id, Inbound.node_id, Client.username)
+        .join(Inbound, Inbound.id == Client.inbound_id)
+        .where(Client.enabled.is_(True))
+    )
+
+
+def disable_over_quota(db: Session, client_ids: Iterable[int]) -> Set[int]:
+    """Проверяет только клиентов, чей трафик только что вырос; возвращает ноды для push."""
+    ids = sorted(set(client_ids))
+    node_ids: Set[int] = set()
+    for i in range(0, len(ids), ENFORCE_BATCH_SIZE):
+        chunk = ids[i : i + ENFORCE_BATCH_SIZE]
+        rows = db.execute(
+            _enabled_rows().where(
+                Client.id.in_(chunk),
+                Client.data_limit.is_not(None),
+                Client.traffic_up + Client.traffic_down >= Client.data_limit,
+            )
+        ).all()
+        if rows:
+            node_ids |= _disable(db, rows, REASON_QUOTA)
+    return node_ids
+
+
+def disable_expired(db: Session, now: datetime) -> Set[int]:
+    """Отключает истёкших клиентов пачками по индексу (enabled, expires_at)."""
+    node_ids: Set[int] = set()
+    while True:
+        rows = db.execute(
+            _enabled_rows()
+            .where(Client.expires_at.is_not(None), Client.expires_at <= now)
+            .order_by(Client.expires_at.asc())
+            .limit(ENFORCE_BATCH_SIZE)
+        ).all()
+        if not rows:
+            return node_ids
+        node_ids |= _disable(db, rows, REASON_EXPIRED)
+
+
+def expire_short_ids(db: Session, now: datetime) -> Set[int]:
+    """Убирает из конфигов прежние Reality short ID, чей срок после ротации истёк; возвращает ноды для push."""
+    rows = db.execute(
+        select(Inbound.id, Inbound.node_id).where(
+            Inbound.reality_previous_short_id_until.is_not(None), Inbound.reality_previous_short_id_until <= now
+        )
+    ).all()
+    if not rows:
+        return set()
+    db.execute(
+        update(Inbound)
+        .where(Inbound.id.in_([r[0] for r in rows]))
+        .values(reality_previous_short_id=None, reality_previous_short_id_until=None)
+        .execution_options(synchronize_session=False)
+    )
+    node_ids = {r[1] for r in rows}
+    bump_revision(db, node_ids)
+    db.commit()
+    return node_ids
+
+
+class Enforcer:
+    def __init__(self, interval: float = ENFORCE_INTERVAL_SECONDS):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._schedule = None
+
+    async def start(self, schedule):
+        # schedule(node_id) — постановка ноды в очередь push; дельта удалит клиентов через API Xray без рестарта
+        self._schedule = schedule
+        if self.interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.check_expired()
+            except Exception as e:
+                log.warning("Expiry enforcement failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def _push(self, node_ids: Set[int]):
+        if self._schedule is not None:
+            for node_id in sorted(node_ids):
+                self._schedule(node_id)
+
+    async def check_expired(self) -> Set[int]:
+        now = datetime.now(timezone.utc)
+        node_ids = await run_db(disable_expired, now)
+        node_ids |= await run_db(expire_short_ids, now)
+        self._push(node_ids)
+        return node_ids
+
+    async def check_quotas(self, client_ids: Iterable[int]) -> Set[int]:
+        node_ids = await run_db(disable_over_quota, list(client_ids))
+        self._push(node_ids)
+        return node_ids
+
+
+enforcer = Enforcer()
@@ -0,0 +1,264 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from .db import run_db
+from .models import Node, NodeHealth
+from .push_queue import normalize_node_url
+
+
+# Период и таймаут проб /health, глубина истории в памяти, период сохранения в БД
+HEALTH_PROBE_INTERVAL = float(os.environ.get("HEALTH_PROBE_INTERVAL", "15"))
+HEALTH_TIMEOUT_SECONDS = float(os.environ.get("HEALTH_TIMEOUT_SECONDS", "5"))
+HEALTH_CONCURRENCY = int(os.environ.get("HEALTH_CONCURRENCY", "20"))
+HEALTH_HISTORY_SIZE = int(os.environ.get("HEALTH_HISTORY_SIZE", "240"))
+HEALTH_PERSIST_INTERVAL = float(os.environ.get("HEALTH_PERSIST_INTERVAL", "60"))
+# Сколько проб подряд должно провалиться, чтобы нода считалась offline
+HEALTH_FAILURE_THRESHOLD = int(os.environ.get("HEALTH_FAILURE_THRESHOLD", "3"))
+
+log = logging.getLogger("xray_panel.health")
+
+
+@dataclass
+class NodeHealthState:
+    node_id: int
+    status: str = "unknown"
+    latency_ms: Optional[float] = None
+    checked_at: Optional[datetime] = None
+    last_ok_at: Optional[datetime] = None
+    consecutive_failures: int = 0
+    last_error: Optional[str] = None
+    revision: Optional[int] = None
+    xray_state: Optional[str] = None
+    connections: Optional[int] = None
+    cpu_percent: Optional[float] = None
+    load_average: Optional[List[float]] = None
+    memory_available_bytes: Optional[int] = None
+    # (unix time, latency_ms или None при неудаче)
+    history: Deque[Tuple[float, Optional[float]]] = field(
+        default_factory=lambda: deque(maxlen=HEALTH_HISTORY_SIZE), repr=False
+    )
+
+    def availability(self) -> Optional[float]:
+        if not self.history:
+            return None
+        return round(sum(1 for _, latency in self.history if latency is not None) / len(self.history), 4)
+
+    def latency_stats(self) -> Dict[str, Optional[float]]:
+        values = sorted(latency for _, latency in self.history if latency is not None)
+        if not values:
+            return {"avg": None, "p95": None}
+        return {
+            "avg": round(sum(values) / len(values), 1),
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "status": self.status,
+            "latency_ms": self.latency_ms,
+            "latency": self.latency_stats(),
+            "availability": self.availability(),
+            "checked_at": self.checked_at.isoformat() if self.checked_at else None,
+            "last_ok_at": self.last_ok_at.isoformat() if self.last_ok_at else None,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "revision": self.revision,
+            "xray_state": self.xray_state,
+            "connections": self.connections,
+            "cpu_percent": self.cpu_percent,
+            "load_average": self.load_average,
+            "memory_available_bytes": self.memory_available_bytes,
+        }
+
+
+def _list_nodes(db: Session) -> List[Tuple[int, str, str]]:
+    # Pull-ноды могут быть недоступны с панели (NAT) — опрашиваются только push-ноды
+    return [
+        tuple(r)
+        for r in db.query(Node.id, Node.url, Node.node_key).filter(Node.mode == "push").order_by(Node.id.asc()).all()
+    ]
+
+
+def _load_snapshots(db: Session) -> List[NodeHealth]:
+    rows = db.query(NodeHealth).all()
+    db.expunge_all()
+    return rows
+
+
+def _save_snapshots(db: Session, rows: List[Dict[str, Any]]):
+    existing = set(db.execute(select(Node.id).where(Node.id.in_([r["node_id"] for r in rows]))).scalars())
+    db.execute(delete(NodeHealth).where(NodeHealth.node_id.not_in(existing)))
+    for row in rows:
+        if row["node_id"] in existing:
+            db.merge(NodeHealth(**row))
+    db.commit()
+
+
+class HealthMonitor:
+    def __init__(self, interval: float = HEALTH_PROBE_INTERVAL):
+        self.interval = interval
+        self._states: Dict[int, NodeHealthState] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._last_persist = 0.0
+        # Вызывается, когда нода снова отвечает после offline (например, чтобы догнать отложенный push)
+        self.on_recover: Optional[Callable[[int], None]] = None
+        # Вызывается, когда ревизия в /health ноды изменилась: (node_id, revision, время начала пробы)
+        self.on_revision: Optional[Callable[[int, int, datetime], Awaitable[None]]] = None
+
+    async def start(self):
+        self._client = httpx.AsyncClient(timeout=HEALTH_TIMEOUT_SECONDS)
+        try:
+            self._restore(await run_db(_load_snapshots))
+        except Exception as e:
+            log.warning("Failed to restore node health history: %s", e)
+        self._last_persist = time.monotonic()
+        if self.interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.persist()
+        except Exception as e:
+            log.warning("Failed to persist node health: %s", e)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def get(self, node_id: int) -> Optional[NodeHealthState]:
+        return self._states.get(node_id)
+
+    def snapshot(self, node_id: int) -> Optional[Dict[str, Any]]:
+        state = self._states.get(node_id)
+        return state.to_dict() if state is not None else None
+
+    def is_offline(self, node_id: int) -> bool:
+        state = self._states.get(node_id)
+        return state is not None and state.status == "offline"
+
+    def forget(self, node_id: int):
+        self._states.pop(node_id, None)
+
+    def _restore(self, rows: List[NodeHealth]):
+        for row in rows:
+            state = NodeHealthState(node_id=row.node_id, status=row.status, latency_ms=row.latency_ms)
+            checked_at = row.checked_at
+            if checked_at is not None and checked_at.tzinfo is None:
+                checked_at = checked_at.replace(tzinfo=timezone.utc)
+            state.checked_at = checked_at
+            if row.status == "offline":
+                state.consecutive_failures = HEALTH_FAILURE_THRESHOLD
+            try:
+                state.history.extend((float(ts), latency) for ts, latency in json.loads(row.history or "[]"))
+            except (TypeError, ValueError):
+                pass
+            self._states[row.node_id] = state
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.probe_all()
+                if time.monotonic() - self._last_persist >= HEALTH_PERSIST_INTERVAL:
+                    await self.persist()
+            except Exception as e:
+                log.warning("Node health probe failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def probe_all(self) -> Dict[int, NodeHealthState]:
+        nodes = await run_db(_list_nodes)
+        known = {node[0] for node in nodes}
+        for node_id in list(self._states):
+            if node_id not in known:
+                self._states.pop(node_id, None)
+        semaphore = asyncio.Semaphore(max(1, HEALTH_CONCURRENCY))
+
+        async def probe(node: Tuple[int, str, str]):
+            async with semaphore:
+                await self.probe(*node)
+
+        await asyncio.gather(*(probe(node) for node in nodes))
+        return dict(self._states)
+
+    async def probe(self, node_id: int, url: str, node_key: str) -> NodeHealthState:
+        state = self._states.get(node_id)
+        if state is None:
+            state = self._states[node_id] = NodeHealthState(node_id=node_id)
+        was_offline = state.status == "offline"
+        previous_revision = state.revision
+        now = datetime.now(timezone.utc)
+        started = time.monotonic()
+        try:
+            r = await self._client.get(f"{normalize_node_url(url)}/health", headers={"X-Node-Key": node_key})
+            latency = round((time.monotonic() - started) * 1000, 1)
+            if r.status_code >= 400:
+                raise RuntimeError(f"Node error: {r.status_code} {r.text}")
+            payload = r.json()
+        except Exception as e:
+            state.consecutive_failures += 1
+            state.last_error = str(e) or e.__class__.__name__
+            state.latency_ms = None
+            state.history.append((now.timestamp(), None))
+            if state.consecutive_failures >= HEALTH_FAILURE_THRESHOLD:
+                state.status = "offline"
+            elif state.status == "unknown":
+                state.status = "degraded"
+        else:
+            xray = payload.get("xray") or {}
+            system = payload.get("system") or {}
+            state.consecutive_failures = 0
+            state.last_error = None
+            state.latency_ms = latency
+            state.last_ok_at = now
+            state.status = "online" if payload.get("status") == "ok" else "degraded"
+            state.revision = payload.get("revision")
+            state.xray_state = xray.get("state")
+            state.cpu_percent = xray.get("cpu_percent")
+            state.connections = payload.get("connections")
+            state.load_average = system.get("load_average")
+            state.memory_available_bytes = system.get("memory_available_bytes")
+            state.history.append((now.timestamp(), latency))
+        state.checked_at = now
+
+        if was_offline and state.status != "offline" and self.on_recover is not None:
+            self.on_recover(node_id)
+        if isinstance(state.revision, int) and state.revision != previous_revision and self.on_revision is not None:
+            try:
+                await self.on_revision(node_id, state.revision, now)
+            except Exception as e:
+                log.warning("Failed to check revision of node %s: %s", node_id, e)
+        return state
+
+    async def persist(self):
+        rows = [
+            {
+                "node_id": s.node_id,
+                "status": s.status,
+                "latency_ms": s.latency_ms,
+                "availability": s.availability(),
+                "connections": s.connections,
+                "checked_at": s.checked_at,
+                "history": json.dumps([[round(ts, 1), latency] for ts, latency in s.history], separators=(",", ":")),
+            }
+            for s in self._states.values()
+        ]
+        self._last_persist = time.monotonic()
+        if rows:
+            await run_db(_save_snapshots, rows)
+
+
+monitor = HealthMonitor()
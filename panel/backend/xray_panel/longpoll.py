@@ -0,0 +1,71 @@
+import asyncio
+import os
+from typing import Dict, Iterable, Optional, Set
+
+
+# Сколько держать long-poll запрос pull-агента без изменений; агент может попросить меньше
+PULL_MAX_WAIT_SECONDS = float(os.environ.get("PULL_MAX_WAIT_SECONDS", "55"))
+
+
+class ConfigWatcher:
+    """Ожидание изменений конфига pull-нод: одно asyncio.Event на ноду, без потоков и опроса БД.
+
+    notify() вызывается после коммита изменения (из любого потока); ждущие запросы просыпаются
+    и перечитывают конфиг. Событие заменяется новым при каждом срабатывании, поэтому достаточно
+    взять его до чтения конфига, чтобы не пропустить изменение между чтением и ожиданием.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._events: Dict[int, asyncio.Event] = {}
+        self._pull: Set[int] = set()
+        self._closed = asyncio.Event()
+
+    async def start(self, pull_node_ids: Iterable[int]):
+        self._loop = asyncio.get_running_loop()
+        self._pull = set(pull_node_ids)
+        self._closed = asyncio.Event()
+
+    async def stop(self):
+        # Держащие соединение агенты получают ответ сразу и не задерживают остановку панели
+        self._closed.set()
+        for event in self._events.values():
+            event.set()
+        self._events.clear()
+
+    def is_pull(self, node_id: int) -> bool:
+        return node_id in self._pull
+
+    def set_mode(self, node_id: int, mode: Optional[str]):
+        if mode == "pull":
+            self._pull.add(node_id)
+        else:
+            self._pull.discard(node_id)
+
+    def event(self, node_id: int) -> asyncio.Event:
+        event = self._events.get(node_id)
+        if event is None:
+            event = self._events[node_id] = asyncio.Event()
+        return event
+
+    def notify(self, node_id: int):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake, node_id)
+
+    def _wake(self, node_id: int):
+        event = self._events.pop(node_id, None)
+        if event is not None:
+            event.set()
+
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        """True — было изменение, False — истёк таймаут или панель останавливается."""
+        if self._closed.is_set():
+            return False
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return not self._closed.is_set()
+
+
+watcher = ConfigWatcher()
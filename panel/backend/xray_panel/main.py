@@ -1,32 +1,78 @@
+import base64
+import hashlib
+import os
 import secrets
+import tempfile
+import time
 import uuid as py_uuid
-from typing import List
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
 from urllib.parse import urlparse
 
-import httpx
 from cryptography.hazmat.primitives.asymmetric import x25519
 from cryptography.hazmat.primitives import serialization
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session, joinedload
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 
-from .db import engine, get_db
-from .models import Base, Node, Inbound, Client
+from .db import SessionLocal, async_engine, dispose_engines, engine, get_db, run_db
+from .models import Node, Inbound, Client, ClientTraffic, Subscription, User
 from .schemas import (
     NodeCreate,
+    NodeHealthOut,
     NodeOut,
     NodeUpdate,
     InboundCreate,
     InboundOut,
     InboundUpdate,
+    RealityRotate,
     ClientCreate,
     ClientOut,
     ClientUpdate,
+    SubscriptionCreate,
+    SubscriptionOut,
+    ClientBulkUpdateItem,
+    ClientBulkItemResult,
+    ClientBulkResult,
+    NodeSyncOut,
+    NodePushResult,
+    ClientPlaceCreate,
+    PlacementCandidateOut,
+    ClientTrafficOut,
+    TrafficBucketOut,
+    UserAccess,
+    UserCreate,
+    UserDetailOut,
+    UserOut,
+    UserUpdate,
 )
-from .config_gen import build_node_config
+from .cache import bump_revision, cache, load_compiled_config, mark_dirty
+from .push_queue import (
+    PUSH_CONCURRENCY,
+    PUSH_RETRIES,
+    PUSH_TIMEOUT_SECONDS,
+    normalize_node_url,
+    save_applied_revision,
+    scheduler,
+)
+from .longpoll import PULL_MAX_WAIT_SECONDS, watcher
+from .stats import collector
+from .health import monitor
+from .placement import adjust_client_counts, count_by_inbound, rank_candidates, recount_clients
+from .enforcement import REASON_QUOTA, as_utc, enforcer, limit_reason, resolve_enabled
+from . import metrics
+from .migrate import run_migrations
+from .backup import ImportResult, SnapshotError, gzip_chunks, import_snapshot, iter_export
+from .users import get_access, group_usernames, set_access, user_inbound_ids, user_node_ids
 
 app = FastAPI(title="Xray Panel API")
 
+# Сколько клиентские приложения могут держать подписку в своём кэше
+SUBSCRIPTION_MAX_AGE = int(os.environ.get("SUBSCRIPTION_MAX_AGE", "300"))
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,12 +80,51 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Node-Sync"],
 )
+metrics.install(app, [engine, async_engine])
+
+# Keyset-пагинация списков: по умолчанию и максимум строк на страницу
+LIST_DEFAULT_LIMIT = int(os.environ.get("LIST_DEFAULT_LIMIT", "1000"))
+LIST_MAX_LIMIT = int(os.environ.get("LIST_MAX_LIMIT", "10000"))
 
 
 @app.on_event("startup")
 def _startup():
-    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    db = SessionLocal()
+    try:
+        recount_clients(db)
+    finally:
+        db.close()
+
+
+def _pull_node_ids(db: Session) -> List[int]:
+    return list(db.execute(select(Node.id).where(Node.mode == "pull")).scalars())
+
+
+@app.on_event("startup")
+async def _start_push_scheduler():
+    await watcher.start(await run_db(_pull_node_ids))
+    await scheduler.start()
+    # Pull-ноды забирают конфиг сами — фоновый push их не трогает
+    scheduler.skip_node = lambda node_id: watcher.is_pull(node_id) or monitor.is_offline(node_id)
+    monitor.on_recover = scheduler.resume
+    # Откат конфига на самой ноде виден по ревизии в /health — push ноды встаёт на паузу до resume
+    monitor.on_revision = scheduler.check_revision
+    await monitor.start()
+    await enforcer.start(_node_changed)
+    await collector.start()
+
+
+@app.on_event("shutdown")
+async def _stop_push_scheduler():
+    await watcher.stop()
+    await collector.stop()
+    await enforcer.stop()
+    await monitor.stop()
+    await scheduler.stop()
+    await dispose_engines()
 
 
 def _x25519_keypair():
@@ -58,22 +143,11 @@ def _x25519_keypair():
 
 
 def _b64url_nopad(raw: bytes) -> str:
-    import base64
-
     return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
 
 
-def _normalize_node_url(url: str) -> str:
-    u = (url or "").strip().rstrip("/")
-    if not u:
-        return u
-    if u.startswith("http://") or u.startswith("https://"):
-        return u
-    return f"http://{u}"
-
-
 def _node_host_from_url(node_url: str) -> str:
-    normalized = _normalize_node_url(node_url)
+    normalized = normalize_node_url(node_url)
     try:
         p = urlparse(normalized)
         if p.hostname:
@@ -105,41 +179,94 @@ def _build_vless_uri(*, node_host: str, inbound: Inbound, client: Client) -> str
     return f"{base}?{'&'.join(params)}#{tag}"
 
 
-def _push_node(node_id: int, db: Session):
-    node = (
-        db.query(Node)
-        .options(joinedload(Node.inbounds).joinedload(Inbound.clients))
-        .filter(Node.id == node_id)
-        .first()
-    )
-    if not node:
-        raise HTTPException(status_code=404, detail="Node not found")
-
-    config = build_node_config(node)
-    base = _normalize_node_url(node.url)
-    url = f"{base}/apply-config"
-    headers = {"X-Node-Key": node.node_key}
-
-    try:
-        with httpx.Client(timeout=15.0) as client:
-            r = client.post(url, json={"config": config}, headers=headers)
-        if r.status_code >= 400:
-            raise HTTPException(status_code=400, detail=f"Node error: {r.status_code} {r.text}")
-        return {
-            "status": "pushed",
-            "node_response": r.json()
-            if r.headers.get("content-type", "").startswith("application/json")
-            else r.text,
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+def _node_changed(node_id: int):
+    """После коммита изменения: push-ноде — в очередь push, pull-ноде — ответ на её long-poll."""
+    if watcher.is_pull(node_id):
+        watcher.notify(node_id)
+    else:
+        scheduler.schedule(node_id)
+
+
+def _schedule_push(node_id: int, response: Response):
+    _node_changed(node_id)
+    response.headers["X-Node-Sync"] = "pending"
+
+
+# Ограничение на размер IN (...) в одном запросе
+BULK_CHUNK_SIZE = 1000
+
+
+def _chunks(items: List, size: int = BULK_CHUNK_SIZE) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def _bulk_result(items: List[ClientBulkItemResult]) -> ClientBulkResult:
+    items.sort(key=lambda it: it.index)
+    failed = sum(1 for it in items if it.status not in ("created", "updated", "deleted"))
+    return ClientBulkResult(succeeded=len(items) - failed, failed=failed, items=items)
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _list_page(
+    db: Session,
+    model,
+    out_schema,
+    filters: List,
+    after_id: int | None,
+    limit: int,
+    fields: str | None,
+    with_total: bool,
+    computed: Dict[str, Callable[[int], Any]] | None = None,
+) -> Response:
+    """Страница списка по курсору id: выбираются только нужные колонки, без ORM-объектов и Pydantic.
+
+    computed — поля не из БД, значение считается по id строки.
+    """
+    computed = computed or {}
+    allowed = list(out_schema.model_fields)
+    names = [f.strip() for f in fields.split(",") if f.strip()] if fields else allowed
+    unknown = [n for n in names if n not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    if "id" not in names:
+        names.insert(0, "id")
+    extra = [n for n in names if n in computed]
+    names = [n for n in names if n not in computed]
+
+    q = select(*(getattr(model, n) for n in names)).where(*filters)
+    if after_id is not None:
+        q = q.where(model.id > after_id)
+    rows = db.execute(q.order_by(model.id.asc()).limit(limit)).mappings().all()
+
+    headers = {}
+    if len(rows) == limit:
+        headers["X-Next-Cursor"] = str(rows[-1]["id"])
+    if with_total:
+        total = db.execute(select(func.count()).select_from(model).where(*filters)).scalar_one()
+        headers["X-Total-Count"] = str(total)
+    items = []
+    for r in rows:
+        item = {k: _json_value(v) for k, v in r.items()}
+        for name in extra:
+            item[name] = computed[name](r["id"])
+        items.append(item)
+    return JSONResponse(items, headers=headers)
 
 
 @app.post("/nodes", response_model=NodeOut)
 def create_node(data: NodeCreate, db: Session = Depends(get_db)):
-    node = Node(name=data.name, url=_normalize_node_url(data.url), node_key=data.node_key)
+    node = Node(
+        name=data.name,
+        url=normalize_node_url(data.url),
+        node_key=data.node_key,
+        group=data.group,
+        weight=data.weight,
+        mode=data.mode,
+    )
     db.add(node)
     try:
         db.commit()
@@ -147,12 +274,37 @@ def create_node(data: NodeCreate, db: Session = Depends(get_db)):
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
     db.refresh(node)
-    return node
+    watcher.set_mode(node.id, node.mode)
+    return _node_out(node)
 
 
 @app.get("/nodes", response_model=List[NodeOut])
-def list_nodes(db: Session = Depends(get_db)):
-    return db.query(Node).order_by(Node.id.asc()).all()
+def list_nodes(
+    name_prefix: str | None = None,
+    after_id: int | None = None,
+    limit: int = Query(default=LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    fields: str | None = None,
+    with_total: bool = False,
+    db: Session = Depends(get_db),
+):
+    filters = []
+    if name_prefix:
+        filters.append(Node.name.startswith(name_prefix, autoescape=True))
+    return _list_page(
+        db, Node, NodeOut, filters, after_id, limit, fields, with_total, computed={"health": monitor.snapshot}
+    )
+
+
+def _node_out(node: Node) -> NodeOut:
+    return NodeOut(
+        id=node.id,
+        name=node.name,
+        url=node.url,
+        group=node.group,
+        weight=node.weight,
+        mode=node.mode,
+        health=monitor.snapshot(node.id),
+    )
 
 
 @app.get("/nodes/{node_id}", response_model=NodeOut)
@@ -160,11 +312,32 @@ def get_node(node_id: int, db: Session = Depends(get_db)):
     node = db.query(Node).filter(Node.id == node_id).first()
     if not node:
         raise HTTPException(status_code=404, detail="Node not found")
-    return node
+    return _node_out(node)
+
+
+@app.get("/nodes/{node_id}/health", response_model=NodeHealthOut)
+async def get_node_health(node_id: int, history: bool = False):
+    """Последняя проба ноды; history=true добавляет историю [unix time, latency_ms | null]."""
+    state = monitor.get(node_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Node health is unknown")
+    out = state.to_dict()
+    if history:
+        out["history"] = [[ts, latency] for ts, latency in state.history]
+    return out
+
+
+@app.post("/nodes/{node_id}/health/probe", response_model=NodeHealthOut)
+async def probe_node_health(node_id: int):
+    node = await run_db(lambda db: db.query(Node.id, Node.url, Node.node_key).filter(Node.id == node_id).first())
+    if not node:
+        raise HTTPException(status_code=404, detail="Node not found")
+    state = await monitor.probe(*node)
+    return state.to_dict()
 
 
 @app.put("/nodes/{node_id}", response_model=NodeOut)
-def update_node(node_id: int, data: NodeUpdate, db: Session = Depends(get_db)):
+def update_node(node_id: int, data: NodeUpdate, response: Response, db: Session = Depends(get_db)):
     node = db.query(Node).filter(Node.id == node_id).first()
     if not node:
         raise HTTPException(status_code=404, detail="Node not found")
@@ -172,9 +345,20 @@ def update_node(node_id: int, data: NodeUpdate, db: Session = Depends(get_db)):
     if data.name is not None:
         node.name = data.name
     if data.url is not None:
-        node.url = _normalize_node_url(data.url)
+        node.url = normalize_node_url(data.url)
     if data.node_key is not None:
         node.node_key = data.node_key
+    regrouped = data.group is not None and data.group != node.group
+    if regrouped:
+        # Доступ через группу меняется вместе с группой ноды: новый конфиг и подписки старой и новой групп
+        mark_dirty(db, usernames=group_usernames(db, [node.group, data.group]))
+        node.group = data.group
+        bump_revision(db, [node.id])
+    if data.weight is not None:
+        node.weight = data.weight
+    remoded = data.mode is not None and data.mode != node.mode
+    if remoded:
+        node.mode = data.mode
 
     try:
         db.commit()
@@ -182,7 +366,14 @@ def update_node(node_id: int, data: NodeUpdate, db: Session = Depends(get_db)):
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
     db.refresh(node)
-    return node
+    if remoded:
+        watcher.set_mode(node.id, node.mode)
+        if node.mode == "pull":
+            # Pull-нода может быть недоступна с панели — её прежнее состояние здоровья больше не показательно
+            monitor.forget(node.id)
+    if regrouped or (remoded and node.mode == "push"):
+        _schedule_push(node.id, response)
+    return _node_out(node)
 
 
 @app.delete("/nodes/{node_id}")
@@ -192,11 +383,14 @@ def delete_node(node_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Node not found")
     db.delete(node)
     db.commit()
+    watcher.set_mode(node_id, None)
+    scheduler.forget(node_id)
+    monitor.forget(node_id)
     return {"status": "deleted"}
 
 
 @app.post("/inbounds", response_model=InboundOut)
-def create_inbound(data: InboundCreate, db: Session = Depends(get_db)):
+def create_inbound(data: InboundCreate, response: Response, db: Session = Depends(get_db)):
     node = db.query(Node).filter(Node.id == data.node_id).first()
     if not node:
         raise HTTPException(status_code=404, detail="Node not found")
@@ -220,6 +414,9 @@ def create_inbound(data: InboundCreate, db: Session = Depends(get_db)):
         inbound.reality_short_id = secrets.token_hex(8)
 
     db.add(inbound)
+    bump_revision(db, [data.node_id])
+    # Пользователи группы ноды получают доступ к новому inbound'у — их подписки устаревают
+    mark_dirty(db, usernames=group_usernames(db, [node.group]))
     try:
         db.commit()
     except Exception as e:
@@ -227,16 +424,26 @@ def create_inbound(data: InboundCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=str(e))
     db.refresh(inbound)
 
-    _push_node(node_id=data.node_id, db=db)
+    _schedule_push(data.node_id, response)
     return inbound
 
 
 @app.get("/inbounds", response_model=List[InboundOut])
-def list_inbounds(node_id: int | None = None, db: Session = Depends(get_db)):
-    q = db.query(Inbound)
+def list_inbounds(
+    node_id: int | None = None,
+    name_prefix: str | None = None,
+    after_id: int | None = None,
+    limit: int = Query(default=LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    fields: str | None = None,
+    with_total: bool = False,
+    db: Session = Depends(get_db),
+):
+    filters = []
     if node_id is not None:
-        q = q.filter(Inbound.node_id == node_id)
-    return q.order_by(Inbound.id.asc()).all()
+        filters.append(Inbound.node_id == node_id)
+    if name_prefix:
+        filters.append(Inbound.name.startswith(name_prefix, autoescape=True))
+    return _list_page(db, Inbound, InboundOut, filters, after_id, limit, fields, with_total)
 
 
 @app.get("/inbounds/{inbound_id}", response_model=InboundOut)
@@ -248,7 +455,7 @@ def get_inbound(inbound_id: int, db: Session = Depends(get_db)):
 
 
 @app.put("/inbounds/{inbound_id}", response_model=InboundOut)
-def update_inbound(inbound_id: int, data: InboundUpdate, db: Session = Depends(get_db)):
+def update_inbound(inbound_id: int, data: InboundUpdate, response: Response, db: Session = Depends(get_db)):
     inbound = db.query(Inbound).filter(Inbound.id == inbound_id).first()
     if not inbound:
         raise HTTPException(status_code=404, detail="Inbound not found")
@@ -270,6 +477,7 @@ def update_inbound(inbound_id: int, data: InboundUpdate, db: Session = Depends(g
     if data.reality_fingerprint is not None:
         inbound.reality_fingerprint = data.reality_fingerprint
 
+    bump_revision(db, [inbound.node_id])
     try:
         db.commit()
     except Exception as e:
@@ -277,30 +485,136 @@ def update_inbound(inbound_id: int, data: InboundUpdate, db: Session = Depends(g
         raise HTTPException(status_code=400, detail=str(e))
     db.refresh(inbound)
 
-    _push_node(node_id=inbound.node_id, db=db)
+    _schedule_push(inbound.node_id, response)
     return inbound
 
 
 @app.delete("/inbounds/{inbound_id}")
-def delete_inbound(inbound_id: int, db: Session = Depends(get_db)):
+def delete_inbound(inbound_id: int, response: Response, db: Session = Depends(get_db)):
     inbound = db.query(Inbound).filter(Inbound.id == inbound_id).first()
     if not inbound:
         raise HTTPException(status_code=404, detail="Inbound not found")
     node_id = inbound.node_id
     db.delete(inbound)
+    bump_revision(db, [node_id])
     db.commit()
-    _push_node(node_id=node_id, db=db)
-    return {"status": "deleted"}
+    _schedule_push(node_id, response)
+    return {"status": "deleted", "sync": "pending"}
+
+
+def _rotate_reality(inbound: Inbound, data: RealityRotate, now: datetime):
+    if data.keys:
+        priv_raw, pub_raw = _x25519_keypair()
+        inbound.reality_private_key = _b64url_nopad(priv_raw)
+        inbound.reality_public_key = _b64url_nopad(pub_raw)
+    if data.short_id:
+        if data.grace_seconds > 0 and inbound.reality_short_id:
+            inbound.reality_previous_short_id = inbound.reality_short_id
+            inbound.reality_previous_short_id_until = now + timedelta(seconds=data.grace_seconds)
+        else:
+            inbound.reality_previous_short_id = None
+            inbound.reality_previous_short_id_until = None
+        inbound.reality_short_id = secrets.token_hex(8)
+
+
+def _check_rotate(data: RealityRotate):
+    if not (data.keys or data.short_id):
+        raise HTTPException(status_code=400, detail="Nothing to rotate")
+    if data.grace_seconds and (data.keys or not data.short_id):
+        # С новым ключом старые клиенты не подключатся независимо от short ID — окно ничего не даёт
+        raise HTTPException(status_code=400, detail="grace_seconds applies only to short ID rotation without new keys")
+
+
+def _is_reality(inbound: Inbound) -> bool:
+    return (inbound.security or "").lower() == "reality"
+
+
+@app.post("/inbounds/{inbound_id}/rotate-reality", response_model=InboundOut)
+def rotate_inbound_reality(
+    inbound_id: int, response: Response, data: RealityRotate = RealityRotate(), db: Session = Depends(get_db)
+):
+    _check_rotate(data)
+    inbound = db.query(Inbound).filter(Inbound.id == inbound_id).first()
+    if not inbound:
+        raise HTTPException(status_code=404, detail="Inbound not found")
+    if not _is_reality(inbound):
+        raise HTTPException(status_code=400, detail="Inbound is not a Reality inbound")
+    _rotate_reality(inbound, data, datetime.now(timezone.utc))
+    bump_revision(db, [inbound.node_id])
+    db.commit()
+    db.refresh(inbound)
+
+    _schedule_push(inbound.node_id, response)
+    return inbound
+
+
+@app.post("/nodes/{node_id}/rotate-reality", response_model=List[InboundOut])
+def rotate_node_reality(
+    node_id: int, response: Response, data: RealityRotate = RealityRotate(), db: Session = Depends(get_db)
+):
+    """Все Reality-inbound'ы ноды в одной транзакции и одним push."""
+    _check_rotate(data)
+    if not db.query(Node.id).filter(Node.id == node_id).first():
+        raise HTTPException(status_code=404, detail="Node not found")
+    inbounds = db.query(Inbound).filter(Inbound.node_id == node_id).order_by(Inbound.id.asc()).all()
+    inbounds = [inbound for inbound in inbounds if _is_reality(inbound)]
+    if not inbounds:
+        return []
+    now = datetime.now(timezone.utc)
+    for inbound in inbounds:
+        _rotate_reality(inbound, data, now)
+    bump_revision(db, [node_id])
+    db.commit()
+    for inbound in inbounds:
+        db.refresh(inbound)
+
+    _schedule_push(node_id, response)
+    return inbounds
+
+
+@app.post("/inbounds/{inbound_id}/rotate-uuids")
+def rotate_inbound_uuids(inbound_id: int, response: Response, db: Session = Depends(get_db)):
+    """Новые UUID всем клиентам inbound'а: bulk UPDATE пачками, одна транзакция, один push."""
+    inbound = db.query(Inbound).filter(Inbound.id == inbound_id).first()
+    if not inbound:
+        raise HTTPException(status_code=404, detail="Inbound not found")
+    rows = db.execute(select(Client.id, Client.username).where(Client.inbound_id == inbound_id)).all()
+    updates = [{"id": client_id, "uuid": str(py_uuid.uuid4())} for client_id, _ in rows]
+    try:
+        for chunk in _chunks(updates):
+            db.execute(update(Client), chunk)
+        mark_dirty(db, clients=[r[0] for r in rows], usernames={r[1] for r in rows})
+        bump_revision(db, [inbound.node_id])
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e.orig))
+
+    _schedule_push(inbound.node_id, response)
+    return {"status": "rotated", "rotated": len(updates), "sync": "pending"}
+
+
+def _initial_state(data: ClientCreate) -> Tuple[bool, str | None]:
+    reason = limit_reason(data.data_limit, 0, 0, data.expires_at, datetime.now(timezone.utc))
+    return resolve_enabled(None, True, None, reason)
 
 
 @app.post("/clients", response_model=ClientOut)
-def create_client(data: ClientCreate, db: Session = Depends(get_db)):
+def create_client(data: ClientCreate, response: Response, db: Session = Depends(get_db)):
     inbound = db.query(Inbound).filter(Inbound.id == data.inbound_id).first()
     if not inbound:
         raise HTTPException(status_code=404, detail="Inbound not found")
+    return _create_client(db, inbound, data, response)
+
 
+def _create_client(db: Session, inbound: Inbound, data: ClientCreate, response: Response) -> Client:
     client = Client(inbound_id=data.inbound_id, username=data.username, uuid=str(py_uuid.uuid4()))
+    client.data_limit = data.data_limit
+    client.expires_at = as_utc(data.expires_at)
+    client.enabled, client.disabled_reason = _initial_state(data)
     db.add(client)
+    adjust_client_counts(db, {inbound.id: 1})
+    bump_revision(db, [inbound.node_id])
     try:
         db.commit()
     except Exception as e:
@@ -308,16 +622,285 @@ def create_client(data: ClientCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail=str(e))
     db.refresh(client)
 
-    _push_node(node_id=inbound.node_id, db=db)
+    _schedule_push(inbound.node_id, response)
     return client
 
 
+@app.post("/clients/bulk", response_model=ClientBulkResult)
+def create_clients_bulk(data: List[ClientCreate], response: Response, db: Session = Depends(get_db)):
+    inbound_ids = sorted({item.inbound_id for item in data})
+    inbound_nodes: Dict[int, int] = {}
+    taken: Set[Tuple[int, str]] = set()
+    for chunk in _chunks(inbound_ids):
+        inbound_nodes.update(db.query(Inbound.id, Inbound.node_id).filter(Inbound.id.in_(chunk)).all())
+    usernames = sorted({item.username for item in data})
+    for chunk in _chunks(usernames):
+        taken.update(
+            db.query(Client.inbound_id, Client.username)
+            .filter(Client.inbound_id.in_(inbound_ids), Client.username.in_(chunk))
+            .all()
+        )
+
+    results: List[ClientBulkItemResult] = []
+    pending: List[Tuple[int, Dict]] = []
+    for index, item in enumerate(data):
+        if item.inbound_id not in inbound_nodes:
+            results.append(ClientBulkItemResult(index=index, status="not_found", detail="Inbound not found"))
+            continue
+        key = (item.inbound_id, item.username)
+        if key in taken:
+            results.append(
+                ClientBulkItemResult(index=index, status="conflict", detail="uq_clients_inbound_username")
+            )
+            continue
+        taken.add(key)
+        enabled, disabled_reason = _initial_state(item)
+        pending.append(
+            (
+                index,
+                {
+                    "inbound_id": item.inbound_id,
+                    "username": item.username,
+                    "uuid": str(py_uuid.uuid4()),
+                    "level": 0,
+                    "data_limit": item.data_limit,
+                    "expires_at": as_utc(item.expires_at),
+                    "enabled": enabled,
+                    "disabled_reason": disabled_reason,
+                },
+            )
+        )
+
+    created: List[Tuple[int, Dict, int]] = []
+    stmt = insert(Client).returning(Client.id, sort_by_parameter_order=True)
+    try:
+        for chunk in _chunks(pending):
+            ids = db.execute(stmt, [row for _, row in chunk]).scalars().all()
+            created.extend((index, row, client_id) for (index, row), client_id in zip(chunk, ids))
+        mark_dirty(db, usernames=(row["username"] for _, row in pending))
+        adjust_client_counts(db, count_by_inbound(row["inbound_id"] for _, row in pending))
+        bump_revision(db, (inbound_nodes[row["inbound_id"]] for _, row in pending))
+        db.commit()
+    except IntegrityError:
+        # Гонка с параллельной вставкой: повторяем построчно, чтобы пометить только конфликтующие
+        db.rollback()
+        created = []
+        for index, row in pending:
+            try:
+                with db.begin_nested():
+                    client_id = db.execute(stmt, [row]).scalar_one()
+                created.append((index, row, client_id))
+            except IntegrityError as e:
+                constraint = "uuid" if "uuid" in str(e.orig).lower() else "uq_clients_inbound_username"
+                results.append(ClientBulkItemResult(index=index, status="conflict", detail=constraint))
+        mark_dirty(db, usernames=(row["username"] for _, row, _ in created))
+        adjust_client_counts(db, count_by_inbound(row["inbound_id"] for _, row, _ in created))
+        bump_revision(db, (inbound_nodes[row["inbound_id"]] for _, row, _ in created))
+        db.commit()
+
+    for index, row, client_id in created:
+        results.append(ClientBulkItemResult(index=index, status="created", client=ClientOut(id=client_id, **row)))
+
+    for node_id in sorted({inbound_nodes[row["inbound_id"]] for _, row, _ in created}):
+        _schedule_push(node_id, response)
+    return _bulk_result(results)
+
+
+@app.get("/placement", response_model=List[PlacementCandidateOut])
+def list_placement_candidates(group: str = "default", strategy: str = "least-clients", db: Session = Depends(get_db)):
+    """Inbounds группы в порядке выбора для нового клиента."""
+    try:
+        return rank_candidates(db, group, strategy)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/clients/place", response_model=ClientOut)
+def place_client(data: ClientPlaceCreate, response: Response, db: Session = Depends(get_db)):
+    """Создаёт клиента на inbound, выбранном стратегией размещения в группе нод."""
+    try:
+        candidates = rank_candidates(db, data.group, data.strategy)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not candidates:
+        raise HTTPException(status_code=503, detail=f"No available inbounds in group {data.group!r}")
+    inbound = db.query(Inbound).filter(Inbound.id == candidates[0].inbound_id).first()
+    if not inbound:
+        raise HTTPException(status_code=409, detail="Selected inbound was removed, retry")
+    create = ClientCreate(
+        inbound_id=inbound.id, username=data.username, data_limit=data.data_limit, expires_at=data.expires_at
+    )
+    return _create_client(db, inbound, create, response)
+
+
+_CLIENT_STATE_COLUMNS = (
+    Client.id,
+    Client.inbound_id,
+    Client.username,
+    Client.level,
+    Client.data_limit,
+    Client.expires_at,
+    Client.enabled,
+    Client.disabled_reason,
+    Client.traffic_up,
+    Client.traffic_down,
+    Inbound.node_id,
+)
+
+
+def _apply_client_update(row: Dict, data: ClientUpdate, now: datetime):
+    """Применяет ClientUpdate к словарю состояния клиента и пересчитывает enabled."""
+    if data.username is not None:
+        row["username"] = data.username
+    if data.level is not None:
+        row["level"] = data.level
+    if "data_limit" in data.model_fields_set:
+        row["data_limit"] = data.data_limit
+    if "expires_at" in data.model_fields_set:
+        row["expires_at"] = as_utc(data.expires_at)
+    reason = limit_reason(row["data_limit"], row["traffic_up"], row["traffic_down"], row["expires_at"], now)
+    row["enabled"], row["disabled_reason"] = resolve_enabled(data.enabled, row["enabled"], row["disabled_reason"], reason)
+
+
+@app.put("/clients/bulk", response_model=ClientBulkResult)
+def update_clients_bulk(data: List[ClientBulkUpdateItem], response: Response, db: Session = Depends(get_db)):
+    ids = sorted({item.id for item in data})
+    current: Dict[int, Dict] = {}
+    for chunk in _chunks(ids):
+        rows = (
+            db.execute(
+                select(*_CLIENT_STATE_COLUMNS)
+                .join(Inbound, Inbound.id == Client.inbound_id)
+                .where(Client.id.in_(chunk))
+            )
+            .mappings()
+            .all()
+        )
+        current.update((r["id"], dict(r)) for r in rows)
+
+    renamed = sorted({item.username for item in data if item.username is not None})
+    taken: Dict[Tuple[int, str], int] = {}
+    inbound_ids = sorted({v["inbound_id"] for v in current.values()})
+    for chunk in _chunks(renamed):
+        rows = (
+            db.query(Client.inbound_id, Client.username, Client.id)
+            .filter(Client.inbound_id.in_(inbound_ids), Client.username.in_(chunk))
+            .all()
+        )
+        taken.update(((r[0], r[1]), r[2]) for r in rows)
+
+    now = datetime.now(timezone.utc)
+    results: List[ClientBulkItemResult] = []
+    updates: Dict[int, Dict] = {}
+    touched_usernames: Set[str] = set()
+    for index, item in enumerate(data):
+        if item.id not in current:
+            results.append(ClientBulkItemResult(index=index, status="not_found", detail="Client not found"))
+            continue
+        row = current[item.id]
+        inbound_id, username = row["inbound_id"], row["username"]
+        new_username = item.username if item.username is not None else username
+        if new_username != username:
+            owner = taken.get((inbound_id, new_username))
+            if owner is not None and owner != item.id:
+                results.append(
+                    ClientBulkItemResult(index=index, status="conflict", detail="uq_clients_inbound_username")
+                )
+                continue
+            taken.pop((inbound_id, username), None)
+            taken[(inbound_id, new_username)] = item.id
+        touched_usernames.update((username, new_username))
+        _apply_client_update(row, item, now)
+        updates[item.id] = {
+            "id": item.id,
+            "username": row["username"],
+            "level": row["level"],
+            "data_limit": row["data_limit"],
+            "expires_at": row["expires_at"],
+            "enabled": row["enabled"],
+            "disabled_reason": row["disabled_reason"],
+        }
+        results.append(ClientBulkItemResult(index=index, status="updated"))
+
+    try:
+        for chunk in _chunks(list(updates.values())):
+            db.execute(update(Client), chunk)
+        mark_dirty(db, clients=updates, usernames=touched_usernames)
+        bump_revision(db, (current[client_id]["node_id"] for client_id in updates))
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise HTTPException(status_code=409, detail=str(e.orig))
+
+    uuids = {}
+    for chunk in _chunks(list(updates)):
+        uuids.update(db.query(Client.id, Client.uuid).filter(Client.id.in_(chunk)).all())
+    for it in results:
+        if it.status == "updated":
+            client_id = data[it.index].id
+            row = current[client_id]
+            it.client = ClientOut(uuid=uuids[client_id], **{k: row[k] for k in ClientOut.model_fields if k in row})
+
+    for node_id in sorted({current[client_id]["node_id"] for client_id in updates}):
+        _schedule_push(node_id, response)
+    return _bulk_result(results)
+
+
+@app.post("/clients/bulk-delete", response_model=ClientBulkResult)
+def delete_clients_bulk(data: List[int], response: Response, db: Session = Depends(get_db)):
+    ids = sorted(set(data))
+    found: Dict[int, int] = {}
+    usernames: Set[str] = set()
+    inbound_ids: List[int] = []
+    for chunk in _chunks(ids):
+        rows = (
+            db.query(Client.id, Inbound.node_id, Client.username, Client.inbound_id)
+            .join(Inbound, Inbound.id == Client.inbound_id)
+            .filter(Client.id.in_(chunk))
+            .all()
+        )
+        found.update((r[0], r[1]) for r in rows)
+        usernames.update(r[2] for r in rows)
+        inbound_ids.extend(r[3] for r in rows)
+        db.execute(delete(Client).where(Client.id.in_(chunk)))
+    mark_dirty(db, clients=found, usernames=usernames)
+    adjust_client_counts(db, {k: -v for k, v in count_by_inbound(inbound_ids).items()})
+    bump_revision(db, found.values())
+    db.commit()
+
+    results = [
+        ClientBulkItemResult(index=index, status="deleted")
+        if client_id in found
+        else ClientBulkItemResult(index=index, status="not_found", detail="Client not found")
+        for index, client_id in enumerate(data)
+    ]
+    for node_id in sorted(set(found.values())):
+        _schedule_push(node_id, response)
+    return _bulk_result(results)
+
+
 @app.get("/clients", response_model=List[ClientOut])
-def list_clients(inbound_id: int | None = None, db: Session = Depends(get_db)):
-    q = db.query(Client)
+def list_clients(
+    inbound_id: int | None = None,
+    node_id: int | None = None,
+    username_prefix: str | None = None,
+    level: int | None = None,
+    after_id: int | None = None,
+    limit: int = Query(default=LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    fields: str | None = None,
+    with_total: bool = False,
+    db: Session = Depends(get_db),
+):
+    filters = []
     if inbound_id is not None:
-        q = q.filter(Client.inbound_id == inbound_id)
-    return q.order_by(Client.id.asc()).all()
+        filters.append(Client.inbound_id == inbound_id)
+    if node_id is not None:
+        filters.append(Client.inbound_id.in_(select(Inbound.id).where(Inbound.node_id == node_id)))
+    if username_prefix:
+        filters.append(Client.username.startswith(username_prefix, autoescape=True))
+    if level is not None:
+        filters.append(Client.level == level)
+    return _list_page(db, Client, ClientOut, filters, after_id, limit, fields, with_total)
 
 
 @app.get("/clients/{client_id}", response_model=ClientOut)
@@ -329,7 +912,7 @@ def get_client(client_id: int, db: Session = Depends(get_db)):
 
 
 @app.put("/clients/{client_id}", response_model=ClientOut)
-def update_client(client_id: int, data: ClientUpdate, db: Session = Depends(get_db)):
+def update_client(client_id: int, data: ClientUpdate, response: Response, db: Session = Depends(get_db)):
     client = db.query(Client).filter(Client.id == client_id).first()
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
@@ -338,11 +921,13 @@ def update_client(client_id: int, data: ClientUpdate, db: Session = Depends(get_
     if not inbound:
         raise HTTPException(status_code=404, detail="Inbound not found")
 
-    if data.username is not None:
-        client.username = data.username
-    if data.level is not None:
-        client.level = data.level
+    row = {c.key: getattr(client, c.key) for c in _CLIENT_STATE_COLUMNS if c.class_ is Client}
+    _apply_client_update(row, data, datetime.now(timezone.utc))
+    for key, value in row.items():
+        if key not in ("id", "traffic_up", "traffic_down"):
+            setattr(client, key, value)
 
+    bump_revision(db, [inbound.node_id])
     try:
         db.commit()
     except Exception as e:
@@ -350,12 +935,12 @@ def update_client(client_id: int, data: ClientUpdate, db: Session = Depends(get_
         raise HTTPException(status_code=400, detail=str(e))
     db.refresh(client)
 
-    _push_node(node_id=inbound.node_id, db=db)
+    _schedule_push(inbound.node_id, response)
     return client
 
 
 @app.delete("/clients/{client_id}")
-def delete_client(client_id: int, db: Session = Depends(get_db)):
+def delete_client(client_id: int, response: Response, db: Session = Depends(get_db)):
     client = db.query(Client).filter(Client.id == client_id).first()
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
@@ -363,48 +948,535 @@ def delete_client(client_id: int, db: Session = Depends(get_db)):
     if not inbound:
         raise HTTPException(status_code=404, detail="Inbound not found")
     db.delete(client)
+    adjust_client_counts(db, {inbound.id: -1})
+    bump_revision(db, [inbound.node_id])
     db.commit()
 
-    _push_node(node_id=inbound.node_id, db=db)
-    return {"status": "deleted"}
+    _schedule_push(inbound.node_id, response)
+    return {"status": "deleted", "sync": "pending"}
+
+
+def _load_client_uri(db: Session, client_id: int) -> str | None:
+    epoch = cache.epoch()
+    row = (
+        db.query(Client, Inbound, Node)
+        .join(Inbound, Inbound.id == Client.inbound_id)
+        .join(Node, Node.id == Inbound.node_id)
+        .filter(Client.id == client_id)
+        .first()
+    )
+    if not row:
+        return None
+    client, inbound, node = row
+
+    node_host = _node_host_from_url(node.url)
+    uri = _build_vless_uri(node_host=node_host, inbound=inbound, client=client)
+    cache.put_uri(client.id, inbound.id, node.id, uri, epoch)
+    return uri
 
 
 @app.get("/clients/{client_id}/vless-uri")
-def get_client_vless_uri(client_id: int, db: Session = Depends(get_db)):
+async def get_client_vless_uri(client_id: int):
+    uri = cache.get_uri(client_id) or await run_db(_load_client_uri, client_id)
+    if uri is None:
+        raise HTTPException(status_code=404, detail="Client not found")
+    return {"uri": uri}
+
+
+@app.post("/clients/{client_id}/reset-traffic", response_model=ClientOut)
+def reset_client_traffic(client_id: int, response: Response, db: Session = Depends(get_db)):
+    """Обнуляет итоговый трафик (история бакетов сохраняется) и снимает отключение по квоте."""
     client = db.query(Client).filter(Client.id == client_id).first()
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
+    node_id = db.query(Inbound.node_id).filter(Inbound.id == client.inbound_id).scalar()
+    client.traffic_up = 0
+    client.traffic_down = 0
+    was_enabled = client.enabled
+    if client.disabled_reason == REASON_QUOTA:
+        reason = limit_reason(client.data_limit, 0, 0, client.expires_at, datetime.now(timezone.utc))
+        client.enabled, client.disabled_reason = resolve_enabled(None, client.enabled, client.disabled_reason, reason)
+    if client.enabled != was_enabled:
+        bump_revision(db, [node_id])
+    db.commit()
+    db.refresh(client)
 
-    inbound = db.query(Inbound).filter(Inbound.id == client.inbound_id).first()
-    if not inbound:
-        raise HTTPException(status_code=404, detail="Inbound not found")
+    if client.enabled != was_enabled:
+        _schedule_push(node_id, response)
+    return client
 
-    node = db.query(Node).filter(Node.id == inbound.node_id).first()
-    if not node:
-        raise HTTPException(status_code=404, detail="Node not found")
 
-    node_host = _node_host_from_url(node.url)
-    uri = _build_vless_uri(node_host=node_host, inbound=inbound, client=client)
-    return {"uri": uri}
+@app.get("/clients/{client_id}/traffic", response_model=ClientTrafficOut)
+def get_client_traffic(
+    client_id: int,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    db: Session = Depends(get_db),
+):
+    client = db.query(Client).filter(Client.id == client_id).first()
+    if not client:
+        raise HTTPException(status_code=404, detail="Client not found")
+    query = db.query(ClientTraffic).filter(ClientTraffic.client_id == client_id)
+    if since is not None:
+        query = query.filter(ClientTraffic.bucket_start >= since)
+    if until is not None:
+        query = query.filter(ClientTraffic.bucket_start < until)
+    buckets = [
+        TrafficBucketOut(bucket_start=b.bucket_start, uplink=b.uplink, downlink=b.downlink)
+        for b in query.order_by(ClientTraffic.bucket_start.asc()).all()
+    ]
+    if since is None and until is None:
+        uplink, downlink = client.traffic_up or 0, client.traffic_down or 0
+    else:
+        uplink, downlink = sum(b.uplink for b in buckets), sum(b.downlink for b in buckets)
+    return ClientTrafficOut(
+        client_id=client.id,
+        username=client.username,
+        inbound_id=client.inbound_id,
+        uplink=uplink,
+        downlink=downlink,
+        buckets=buckets,
+    )
+
+
+@app.get("/traffic", response_model=List[ClientTrafficOut])
+def list_traffic(
+    node_id: int | None = None,
+    inbound_id: int | None = None,
+    since: datetime | None = None,
+    limit: int = Query(default=100, ge=1, le=LIST_MAX_LIMIT),
+    db: Session = Depends(get_db),
+):
+    """Топ клиентов по трафику: за всё время из итогов клиента, с since — по бакетам."""
+    if since is None:
+        uplink, downlink = Client.traffic_up, Client.traffic_down
+        stmt = select(Client.id, Client.username, Client.inbound_id, uplink, downlink)
+    else:
+        uplink, downlink = func.sum(ClientTraffic.uplink), func.sum(ClientTraffic.downlink)
+        stmt = (
+            select(Client.id, Client.username, Client.inbound_id, uplink, downlink)
+            .join(ClientTraffic, ClientTraffic.client_id == Client.id)
+            .where(ClientTraffic.bucket_start >= since)
+            .group_by(Client.id, Client.username, Client.inbound_id)
+        )
+    if inbound_id is not None:
+        stmt = stmt.where(Client.inbound_id == inbound_id)
+    if node_id is not None:
+        stmt = stmt.where(Client.inbound_id.in_(select(Inbound.id).where(Inbound.node_id == node_id)))
+    rows = db.execute(stmt.order_by((uplink + downlink).desc(), Client.id.asc()).limit(limit)).all()
+    return [
+        ClientTrafficOut(client_id=r[0], username=r[1], inbound_id=r[2], uplink=r[3] or 0, downlink=r[4] or 0)
+        for r in rows
+    ]
+
+
+@app.post("/traffic/poll")
+async def poll_traffic():
+    """Внеочередной сбор статистики со всех нод."""
+    polled = await collector.poll_once()
+    return {
+        "nodes": len(polled),
+        "clients": sum(len(counters) for counters in polled.values()),
+        "errors": {str(k): v for k, v in collector.last_errors.items()},
+    }
 
 
 @app.get("/nodes/{node_id}/config")
-def get_node_config(node_id: int, db: Session = Depends(get_db)):
-    node = (
-        db.query(Node)
-        .options(joinedload(Node.inbounds).joinedload(Inbound.clients))
-        .filter(Node.id == node_id)
-        .first()
-    )
-    if not node:
+async def get_node_config(
+    node_id: int,
+    if_none_match: str | None = Header(default=None, alias="If-None-Match"),
+):
+    try:
+        compiled = cache.get_config(node_id) or await run_db(load_compiled_config, node_id)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not compiled:
         raise HTTPException(status_code=404, detail="Node not found")
 
+    headers = {"ETag": compiled.etag}
+    if if_none_match and compiled.etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=compiled.body, media_type="application/json", headers=headers)
+
+
+def _user_detail(db: Session, user: User) -> UserDetailOut:
+    inbound_ids, groups = get_access(db, user.id)
+    out = UserOut.model_validate(user).model_dump()
+    return UserDetailOut(**out, inbound_ids=inbound_ids, groups=groups)
+
+
+def _check_access(db: Session, data: UserAccess):
+    inbound_ids = sorted(set(data.inbound_ids))
+    if inbound_ids:
+        found = set(db.execute(select(Inbound.id).where(Inbound.id.in_(inbound_ids))).scalars())
+        missing = [i for i in inbound_ids if i not in found]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Inbounds not found: {', '.join(map(str, missing))}")
+
+
+def _commit_user_change(db: Session, node_ids: Set[int], response: Response):
+    """Одна запись о пользователе — новый конфиг на всех затронутых нодах."""
+    bump_revision(db, node_ids)
     try:
-        return build_node_config(node)
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e.orig))
+    for node_id in sorted(node_ids):
+        _schedule_push(node_id, response)
+
+
+@app.post("/users", response_model=UserDetailOut)
+def create_user(data: UserCreate, response: Response, db: Session = Depends(get_db)):
+    _check_access(db, data)
+    user = User(username=data.username, uuid=str(py_uuid.uuid4()), level=data.level)
+    db.add(user)
+    try:
+        db.flush()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="User already exists")
+    set_access(db, user.id, data.inbound_ids, data.groups)
+    _commit_user_change(db, user_node_ids(db, [user.id]), response)
+    db.refresh(user)
+    return _user_detail(db, user)
+
+
+@app.get("/users", response_model=List[UserOut])
+def list_users(
+    username_prefix: str | None = None,
+    enabled: bool | None = None,
+    after_id: int | None = None,
+    limit: int = Query(default=LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    fields: str | None = None,
+    with_total: bool = False,
+    db: Session = Depends(get_db),
+):
+    filters = []
+    if username_prefix:
+        filters.append(User.username.startswith(username_prefix, autoescape=True))
+    if enabled is not None:
+        filters.append(User.enabled.is_(enabled))
+    return _list_page(db, User, UserOut, filters, after_id, limit, fields, with_total)
+
+
+def _get_user(db: Session, user_id: int) -> User:
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+
+@app.get("/users/{user_id}", response_model=UserDetailOut)
+def get_user(user_id: int, db: Session = Depends(get_db)):
+    return _user_detail(db, _get_user(db, user_id))
+
+
+@app.put("/users/{user_id}", response_model=UserDetailOut)
+def update_user(user_id: int, data: UserUpdate, response: Response, db: Session = Depends(get_db)):
+    user = _get_user(db, user_id)
+    if data.username is not None:
+        user.username = data.username
+    if data.level is not None:
+        user.level = data.level
+    user.enabled, user.disabled_reason = resolve_enabled(data.enabled, user.enabled, user.disabled_reason, None)
+
+    _commit_user_change(db, user_node_ids(db, [user.id]), response)
+    db.refresh(user)
+    return _user_detail(db, user)
+
+
+@app.put("/users/{user_id}/access", response_model=UserDetailOut)
+def set_user_access(user_id: int, data: UserAccess, response: Response, db: Session = Depends(get_db)):
+    user = _get_user(db, user_id)
+    _check_access(db, data)
+    # Конфиг меняется и там, откуда пользователь ушёл, и там, куда добавлен
+    node_ids = user_node_ids(db, [user.id])
+    set_access(db, user.id, data.inbound_ids, data.groups)
+    node_ids |= user_node_ids(db, [user.id])
+    mark_dirty(db, usernames=[user.username])
+    _commit_user_change(db, node_ids, response)
+    return _user_detail(db, user)
+
+
+@app.post("/users/{user_id}/rotate-uuid", response_model=UserDetailOut)
+def rotate_user_uuid(user_id: int, response: Response, db: Session = Depends(get_db)):
+    user = _get_user(db, user_id)
+    user.uuid = str(py_uuid.uuid4())
+    _commit_user_change(db, user_node_ids(db, [user.id]), response)
+    db.refresh(user)
+    return _user_detail(db, user)
+
+
+@app.delete("/users/{user_id}")
+def delete_user(user_id: int, response: Response, db: Session = Depends(get_db)):
+    user = _get_user(db, user_id)
+    node_ids = user_node_ids(db, [user.id])
+    db.delete(user)
+    _commit_user_change(db, node_ids, response)
+    return {"status": "deleted", "sync": "pending" if node_ids else "none"}
+
+
+@app.post("/subscriptions", response_model=SubscriptionOut)
+def create_subscription(data: SubscriptionCreate, db: Session = Depends(get_db)):
+    sub = Subscription(username=data.username, token=secrets.token_urlsafe(24))
+    db.add(sub)
+    try:
+        db.commit()
     except Exception as e:
+        db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
+    db.refresh(sub)
+    return sub
+
+
+@app.get("/subscriptions", response_model=List[SubscriptionOut])
+def list_subscriptions(username: str | None = None, db: Session = Depends(get_db)):
+    q = db.query(Subscription)
+    if username is not None:
+        q = q.filter(Subscription.username == username)
+    return q.order_by(Subscription.id.asc()).all()
+
+
+@app.post("/subscriptions/{subscription_id}/rotate-token", response_model=SubscriptionOut)
+def rotate_subscription_token(subscription_id: int, db: Session = Depends(get_db)):
+    sub = db.query(Subscription).filter(Subscription.id == subscription_id).first()
+    if not sub:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    sub.token = secrets.token_urlsafe(24)
+    db.commit()
+    db.refresh(sub)
+    return sub
+
+
+@app.delete("/subscriptions/{subscription_id}")
+def delete_subscription(subscription_id: int, db: Session = Depends(get_db)):
+    sub = db.query(Subscription).filter(Subscription.id == subscription_id).first()
+    if not sub:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    db.delete(sub)
+    db.commit()
+    return {"status": "deleted"}
+
+
+def _render_subscription(db: Session, token: str):
+    epoch = cache.epoch()
+    rows = (
+        db.query(Subscription.username, Client, Inbound, Node)
+        .outerjoin(Client, Client.username == Subscription.username)
+        .outerjoin(Inbound, Inbound.id == Client.inbound_id)
+        .outerjoin(Node, Node.id == Inbound.node_id)
+        .filter(Subscription.token == token)
+        .order_by(Client.id.asc())
+        .all()
+    )
+    if not rows:
+        return None
+
+    uris: List[str] = []
+    node_ids: Set[int] = set()
+    inbound_ids: Set[int] = set()
+    for _, client, inbound, node in rows:
+        if client is None or inbound is None or node is None or client.enabled is False:
+            continue
+        uris.append(_build_vless_uri(node_host=_node_host_from_url(node.url), inbound=inbound, client=client))
+        node_ids.add(node.id)
+        inbound_ids.add(inbound.id)
+
+    # Пользователь с тем же именем: один UUID на все inbound'ы, к которым у него есть доступ
+    user = db.query(User).filter(User.username == rows[0][0], User.enabled.is_(True)).first()
+    if user is not None:
+        access = user_inbound_ids([user.id]).subquery()
+        user_rows = (
+            db.query(Inbound, Node)
+            .join(Node, Node.id == Inbound.node_id)
+            .filter(Inbound.id.in_(select(access.c.inbound_id)))
+            .order_by(Inbound.id.asc())
+            .all()
+        )
+        for inbound, node in user_rows:
+            uris.append(_build_vless_uri(node_host=_node_host_from_url(node.url), inbound=inbound, client=user))
+            node_ids.add(node.id)
+            inbound_ids.add(inbound.id)
+
+    body = "\n".join(uris).encode("utf-8")
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    cache.put_subscription(token, rows[0][0], node_ids, inbound_ids, body, etag, epoch)
+    return body, etag
+
+
+@app.get("/sub/{token}")
+async def get_subscription_content(
+    token: str,
+    format: str = Query(default="base64", pattern="^(base64|plain)$"),
+    if_none_match: str | None = Header(default=None, alias="If-None-Match"),
+):
+    rendered = cache.get_subscription(token) or await run_db(_render_subscription, token)
+    if rendered is None:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    body, etag = rendered
+
+    etag = f'"{etag}-{format}"'
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={SUBSCRIPTION_MAX_AGE}"}
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    if format == "base64":
+        body = base64.b64encode(body)
+    return Response(content=body, media_type="text/plain; charset=utf-8", headers=headers)
+
+
+def _select_node_ids(db: Session, node_ids: List[int] | None, only_out_of_sync: bool) -> List[int]:
+    q = db.query(Node.id)
+    if node_ids:
+        q = q.filter(Node.id.in_(node_ids))
+    if only_out_of_sync:
+        q = q.filter(Node.applied_revision < Node.config_revision)
+    return [row[0] for row in q.filter(Node.mode == "push").order_by(Node.id.asc()).all()]
+
+
+@app.post("/nodes/push-all", response_model=List[NodePushResult])
+async def push_all_nodes(
+    node_ids: List[int] | None = Query(default=None, alias="node_id"),
+    only_out_of_sync: bool = False,
+    concurrency: int = Query(default=PUSH_CONCURRENCY, ge=1, le=200),
+    retries: int = Query(default=PUSH_RETRIES, ge=0, le=10),
+    timeout: float = Query(default=2 * PUSH_TIMEOUT_SECONDS, gt=0),
+    skip_offline: bool = True,
+):
+    ids = await run_db(_select_node_ids, node_ids, only_out_of_sync)
+    skipped = [
+        NodePushResult(node_id=node_id, status="skipped", attempts=0, duration_ms=0, detail="Node is offline")
+        for node_id in ids
+        if skip_offline and monitor.is_offline(node_id)
+    ]
+    ids = [node_id for node_id in ids if not (skip_offline and monitor.is_offline(node_id))]
+    pushed = await scheduler.push_many(ids, concurrency=concurrency, retries=retries, timeout=timeout)
+    return sorted([*pushed, *(s.model_dump() for s in skipped)], key=lambda r: r["node_id"])
 
 
 @app.post("/nodes/{node_id}/push")
-def push_node_config(node_id: int, db: Session = Depends(get_db)):
-    return _push_node(node_id=node_id, db=db)
+async def push_node_config(node_id: int):
+    if watcher.is_pull(node_id):
+        raise HTTPException(status_code=409, detail="Node is in pull mode")
+    return await scheduler.push_now(node_id)
+
+
+@app.post("/nodes/{node_id}/push/resume")
+async def resume_node_push(node_id: int):
+    """Снимает паузу push после отката конфига на ноде и снова отправляет ей конфиг панели."""
+    return {"resumed": await scheduler.resume_rollback(node_id)}
+
+
+def _load_poll_node(db: Session, node_id: int):
+    return db.query(Node.node_key, Node.mode, Node.applied_revision).filter(Node.id == node_id).first()
+
+
+@app.get("/nodes/{node_id}/config/poll")
+async def poll_node_config(
+    node_id: int,
+    wait: float = Query(default=PULL_MAX_WAIT_SECONDS, ge=0),
+    x_node_key: str | None = Header(default=None, alias="X-Node-Key"),
+    if_none_match: str | None = Header(default=None, alias="If-None-Match"),
+):
+    """Long-poll для pull-агента.
+
+    Конфиг отдаётся сразу, если его ETag не совпадает с If-None-Match; иначе запрос ждёт изменения
+    ноды до wait секунд и заканчивается 304. Совпавший ETag — подтверждение, что агент применил
+    текущую ревизию.
+    """
+    node = await run_db(_load_poll_node, node_id)
+    if not node:
+        raise HTTPException(status_code=404, detail="Node not found")
+    if not x_node_key or not secrets.compare_digest(x_node_key.encode(), node.node_key.encode()):
+        raise HTTPException(status_code=401, detail="Invalid node key")
+    if node.mode != "pull":
+        raise HTTPException(status_code=409, detail="Node is not in pull mode")
+
+    known = [t.strip() for t in if_none_match.split(",")] if if_none_match else []
+    deadline = time.monotonic() + min(wait, PULL_MAX_WAIT_SECONDS)
+    applied = node.applied_revision
+    while True:
+        # Событие берётся до чтения конфига: изменение после чтения разбудит ожидание ниже
+        event = watcher.event(node_id)
+        compiled = cache.get_config(node_id) or await run_db(load_compiled_config, node_id)
+        if compiled is None:
+            raise HTTPException(status_code=404, detail="Node not found")
+        headers = {"ETag": compiled.etag, "X-Config-Revision": str(compiled.revision)}
+        if compiled.etag not in known:
+            scheduler.note_pull(node_id, compiled.revision, applied=False)
+            return Response(content=compiled.body, media_type="application/json", headers=headers)
+        if applied < compiled.revision:
+            await run_db(save_applied_revision, node_id, compiled.revision)
+            applied = compiled.revision
+        scheduler.note_pull(node_id, compiled.revision, applied=True)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not await watcher.wait(event, remaining):
+            return Response(status_code=304, headers=headers)
+
+
+@app.get("/sync", response_model=List[NodeSyncOut])
+async def list_sync_states():
+    return scheduler.states()
+
+
+@app.get("/nodes/{node_id}/sync", response_model=NodeSyncOut)
+async def get_sync_state(node_id: int):
+    return scheduler.state(node_id)
+
+
+def _export_chunks(compress: str | None):
+    # Свой сеанс: генератор читается Starlette в пуле потоков уже после выхода из обработчика
+    db = SessionLocal()
+    try:
+        chunks = iter_export(db)
+        yield from gzip_chunks(chunks) if compress == "gzip" else chunks
+    finally:
+        db.close()
+
+
+@app.get("/export")
+def export_snapshot(compress: str | None = Query(default=None, pattern="^gzip$")):
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    name = f"xray-panel-{stamp}.ndjson" + (".gz" if compress == "gzip" else "")
+    media_type = "application/gzip" if compress == "gzip" else "application/x-ndjson"
+    return StreamingResponse(
+        _export_chunks(compress),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{name}"'},
+    )
+
+
+def _import_snapshot(db: Session, f, replace: bool) -> Tuple[ImportResult, Dict[int, str]]:
+    result = import_snapshot(db, f, replace=replace)
+    modes = dict(db.execute(select(Node.id, Node.mode).where(Node.id.in_(sorted(result.node_ids)))).all())
+    return result, modes
+
+
+@app.post("/import")
+async def import_snapshot_endpoint(request: Request, mode: str = Query(default="merge", pattern="^(merge|replace)$")):
+    # Тело сначала целиком на диск: импорт идёт в одной транзакции и не должен ждать медленного клиента
+    with tempfile.TemporaryFile() as f:
+        async for chunk in request.stream():
+            f.write(chunk)
+        f.seek(0)
+        try:
+            result, modes = await run_db(_import_snapshot, f, mode == "replace")
+        except SnapshotError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except IntegrityError as e:
+            raise HTTPException(status_code=409, detail=str(e.orig))
+
+    for node_id in sorted(result.removed_node_ids):
+        watcher.set_mode(node_id, None)
+        scheduler.forget(node_id)
+        monitor.forget(node_id)
+    for node_id, node_mode in modes.items():
+        watcher.set_mode(node_id, node_mode)
+    # Один push на затронутую ноду — после того как весь снапшот закоммичен
+    for node_id in sorted(modes):
+        _node_changed(node_id)
+    return {
+        "rows": result.rows,
+        "nodes": sorted(modes),
+        "removed_nodes": sorted(result.removed_node_ids),
+    }
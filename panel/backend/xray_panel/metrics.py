@@ -0,0 +1,139 @@
+import contextvars
+import os
+import time
+from typing import Any, Dict, Optional
+
+from fastapi import Response
+from sqlalchemy import event
+
+
+# Метрики Prometheus на /metrics; METRICS_ENABLED=0 — ни middleware, ни хуков БД, prometheus_client не импортируется
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_SIZE_BUCKETS = (1e3, 1e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+_QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+# Счётчик запросов к БД текущего HTTP-запроса: [число, секунды]; threadpool наследует контекст
+_db_usage: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("xray_panel_db_usage", default=None)
+
+if METRICS_ENABLED:
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+    REQUEST_DURATION = Histogram(
+        "xray_panel_request_duration_seconds",
+        "HTTP request latency by route",
+        ["method", "route", "status"],
+        buckets=_LATENCY_BUCKETS,
+    )
+    REQUEST_DB_QUERIES = Histogram(
+        "xray_panel_request_db_queries", "DB queries per HTTP request", ["route"], buckets=_QUERY_BUCKETS
+    )
+    REQUEST_DB_SECONDS = Histogram(
+        "xray_panel_request_db_seconds", "DB time per HTTP request", ["route"], buckets=_LATENCY_BUCKETS
+    )
+    DB_QUERIES = Counter("xray_panel_db_queries_total", "DB queries, including background tasks")
+    CONFIG_BUILD_SECONDS = Histogram(
+        "xray_panel_config_build_seconds",
+        "Node config build and serialization time",
+        ["mode"],
+        buckets=_LATENCY_BUCKETS,
+    )
+    CONFIG_BYTES = Histogram("xray_panel_config_bytes", "Serialized node config size", ["mode"], buckets=_SIZE_BUCKETS)
+    PUSH_PHASE_SECONDS = Histogram(
+        "xray_panel_push_phase_seconds",
+        "Push duration by phase: prepare (DB + build), network, and the agent-reported test/restart/hot/graceful",
+        ["phase"],
+        buckets=_LATENCY_BUCKETS,
+    )
+    PUSH_FAILURES = Counter("xray_panel_push_failures_total", "Failed pushes per node", ["node_id"])
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("xray_panel_query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["xray_panel_query_started"].pop()
+    DB_QUERIES.inc()
+    usage = _db_usage.get()
+    if usage is not None:
+        usage[0] += 1
+        usage[1] += time.perf_counter() - started
+
+
+def instrument_engine(engine):
+    if METRICS_ENABLED:
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: латентность по шаблону маршрута и число/время запросов к БД на HTTP-запрос."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        usage = [0, 0.0]
+        token = _db_usage.set(usage)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _db_usage.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            REQUEST_DURATION.labels(scope["method"], route, str(status["code"])).observe(elapsed)
+            REQUEST_DB_QUERIES.labels(route).observe(usage[0])
+            REQUEST_DB_SECONDS.labels(route).observe(usage[1])
+
+
+def install(app, engines):
+    """Подключает middleware, хуки движков БД и GET /metrics."""
+    if not METRICS_ENABLED:
+        return
+    for engine in engines:
+        if engine is not None:
+            instrument_engine(getattr(engine, "sync_engine", engine))
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def observe_config(mode: str, seconds: float, size: int):
+    if METRICS_ENABLED:
+        CONFIG_BUILD_SECONDS.labels(mode).observe(seconds)
+        CONFIG_BYTES.labels(mode).observe(size)
+
+
+def observe_push(phase: str, seconds: float):
+    if METRICS_ENABLED:
+        PUSH_PHASE_SECONDS.labels(phase).observe(seconds)
+
+
+def observe_agent_timings(response: Any):
+    """Фазы применения, которые агент возвращает в поле timings ответа на push."""
+    if not METRICS_ENABLED or not isinstance(response, dict):
+        return
+    timings: Dict[str, Any] = response.get("timings") or {}
+    for phase, seconds in timings.items():
+        if isinstance(seconds, (int, float)):
+            PUSH_PHASE_SECONDS.labels(phase).observe(seconds)
+
+
+def push_failed(node_id: int):
+    if METRICS_ENABLED:
+        PUSH_FAILURES.labels(str(node_id)).inc()
@@ -0,0 +1,36 @@
+import os
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+
+
+# Ревизия, которой соответствует схема, созданная create_all до перехода на миграции
+BASELINE_REVISION = "0001"
+
+
+def alembic_config() -> Config:
+    config = Config()
+    config.set_main_option("script_location", os.path.join(os.path.dirname(__file__), "migrations"))
+    return config
+
+
+def run_migrations(engine: Engine):
+    """Доводит схему до head. База без alembic_version, но с таблицами панели, помечается baseline-ревизией."""
+    config = alembic_config()
+    with engine.connect() as conn:
+        sqlite = conn.dialect.name == "sqlite"
+        if sqlite:
+            # Пересоздание таблиц в batch-режиме при включённых FK каскадно удалило бы дочерние строки
+            conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+        try:
+            config.attributes["connection"] = conn
+            tables = set(inspect(conn).get_table_names())
+            if "nodes" in tables and "alembic_version" not in tables:
+                command.stamp(config, BASELINE_REVISION)
+            command.upgrade(config, "head")
+            conn.commit()
+        finally:
+            if sqlite:
+                conn.exec_driver_sql("PRAGMA foreign_keys=ON")
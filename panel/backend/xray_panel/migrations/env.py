@@ -0,0 +1,47 @@
+import os
+
+from alembic import context
+from sqlalchemy import create_engine, pool
+
+from xray_panel.models import Base
+
+
+target_metadata = Base.metadata
+
+
+def _url() -> str:
+    return context.config.get_main_option("sqlalchemy.url") or os.environ.get("DATABASE_URL", "")
+
+
+def run_migrations_offline():
+    context.configure(
+        url=_url(),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def _run(connection):
+    # render_as_batch — SQLite меняет ограничения только пересозданием таблицы
+    context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # Из приложения соединение передаётся через config.attributes (см. xray_panel.migrate)
+    connection = context.config.attributes.get("connection")
+    if connection is not None:
+        _run(connection)
+        return
+    with create_engine(_url(), poolclass=pool.NullPool).connect() as connection:
+        _run(connection)
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
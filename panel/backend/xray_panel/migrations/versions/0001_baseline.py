@@ -0,0 +1,67 @@
+"""Baseline: schema as created by Base.metadata.create_all before migrations
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "nodes",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False, unique=True),
+        sa.Column("url", sa.String(), nullable=False),
+        sa.Column("node_key", sa.String(), nullable=False),
+    )
+
+    op.create_table(
+        "inbounds",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("node_id", sa.Integer(), sa.ForeignKey("nodes.id"), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("listen", sa.String()),
+        sa.Column("port", sa.Integer()),
+        sa.Column("protocol", sa.String()),
+        sa.Column("network", sa.String()),
+        sa.Column("security", sa.String()),
+        sa.Column("sni", sa.String()),
+        sa.Column("reality_private_key", sa.String()),
+        sa.Column("reality_public_key", sa.String()),
+        sa.Column("reality_short_id", sa.String()),
+        sa.Column("reality_dest", sa.String()),
+        sa.Column("reality_fingerprint", sa.String()),
+        sa.UniqueConstraint("node_id", "name", name="uq_inbounds_node_name"),
+    )
+
+    op.create_table(
+        "clients",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("inbound_id", sa.Integer(), sa.ForeignKey("inbounds.id"), nullable=False),
+        sa.Column("username", sa.String(), nullable=False),
+        sa.Column("uuid", sa.String(), nullable=False, unique=True),
+        sa.Column("level", sa.Integer()),
+        sa.UniqueConstraint("inbound_id", "username", name="uq_clients_inbound_username"),
+    )
+
+    op.create_table(
+        "subscriptions",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("username", sa.String(), nullable=False, unique=True),
+        sa.Column("token", sa.String(), nullable=False, unique=True),
+    )
+
+
+def downgrade():
+    op.drop_table("subscriptions")
+    op.drop_table("clients")
+    op.drop_table("inbounds")
+    op.drop_table("nodes")
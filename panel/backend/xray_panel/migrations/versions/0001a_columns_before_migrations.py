@@ -0,0 +1,91 @@
+"""Columns and tables added by create_all after the baseline, before migrations existed
+
+Revision ID: 0001a
+Revises: 0001
+Create Date: 2026-10-18
+
+База без alembic_version помечается ревизией 0001, но create_all мог успеть создать часть этих колонок
+и таблиц (в зависимости от версии панели) — поэтому здесь добавляется только то, чего ещё нет.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001a"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+_COLUMNS = {
+    "nodes": [
+        sa.Column("group", sa.String(), nullable=False, server_default="default"),
+        sa.Column("weight", sa.Integer(), nullable=False, server_default="1"),
+        sa.Column("config_revision", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("applied_revision", sa.Integer(), nullable=False, server_default="0"),
+    ],
+    "inbounds": [
+        sa.Column("client_count", sa.Integer(), nullable=False, server_default="0"),
+    ],
+    "clients": [
+        sa.Column("traffic_up", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("traffic_down", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("data_limit", sa.BigInteger(), nullable=True),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("enabled", sa.Boolean(), nullable=False, server_default=sa.true()),
+        sa.Column("disabled_reason", sa.String(), nullable=True),
+    ],
+}
+
+# (имя, таблица, колонки)
+_INDEXES = [
+    ("ix_nodes_group", "nodes", ["group"]),
+    ("ix_clients_enabled_expires_at", "clients", ["enabled", "expires_at"]),
+    ("ix_client_traffic_bucket_start", "client_traffic", ["bucket_start"]),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    for table, columns in _COLUMNS.items():
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        for column in columns:
+            if column.name not in existing:
+                op.add_column(table, column)
+
+    if "client_traffic" not in tables:
+        op.create_table(
+            "client_traffic",
+            sa.Column("client_id", sa.Integer(), sa.ForeignKey("clients.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("bucket_start", sa.DateTime(timezone=True), primary_key=True),
+            sa.Column("uplink", sa.BigInteger(), nullable=False, server_default="0"),
+            sa.Column("downlink", sa.BigInteger(), nullable=False, server_default="0"),
+        )
+    if "node_health" not in tables:
+        op.create_table(
+            "node_health",
+            sa.Column("node_id", sa.Integer(), sa.ForeignKey("nodes.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("status", sa.String(), nullable=False, server_default="unknown"),
+            sa.Column("latency_ms", sa.Float(), nullable=True),
+            sa.Column("availability", sa.Float(), nullable=True),
+            sa.Column("connections", sa.Integer(), nullable=True),
+            sa.Column("checked_at", sa.DateTime(timezone=True), nullable=True),
+            sa.Column("history", sa.Text(), nullable=False, server_default="[]"),
+        )
+
+    for name, table, columns in _INDEXES:
+        if name not in {i["name"] for i in sa.inspect(op.get_bind()).get_indexes(table)}:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    op.drop_table("node_health")
+    op.drop_table("client_traffic")
+    for name, table, _ in _INDEXES:
+        if table != "client_traffic":
+            op.drop_index(name, table_name=table)
+    for table, columns in _COLUMNS.items():
+        with op.batch_alter_table(table) as batch:
+            for column in reversed(columns):
+                batch.drop_column(column.name)
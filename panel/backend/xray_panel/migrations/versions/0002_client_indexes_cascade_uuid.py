@@ -0,0 +1,62 @@
+"""Client index for keyset scans, ON DELETE CASCADE for inbounds/clients, native uuid on PostgreSQL
+
+Revision ID: 0002
+Revises: 0001a
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0002"
+down_revision = "0001a"
+branch_labels = None
+depends_on = None
+
+# (таблица, колонка, ссылка) — внешние ключи, которые получают ON DELETE CASCADE
+_FOREIGN_KEYS = (("inbounds", "node_id", "nodes"), ("clients", "inbound_id", "inbounds"))
+
+
+def _replace_foreign_key(table: str, column: str, referent: str, ondelete):
+    if op.get_bind().dialect.name == "sqlite":
+        # В SQLite ограничения меняются только пересозданием таблицы; безымянный FK получает имя по конвенции
+        name = f"fk_{table}_{column}_{referent}"
+        naming = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+        with op.batch_alter_table(table, naming_convention=naming, recreate="always") as batch:
+            batch.drop_constraint(name, type_="foreignkey")
+            batch.create_foreign_key(name, referent, [column], ["id"], ondelete=ondelete)
+        return
+    # Имя, которое PostgreSQL выдал безымянному FK из create_all / 0001
+    name = f"{table}_{column}_fkey"
+    op.drop_constraint(name, table, type_="foreignkey")
+    op.create_foreign_key(name, table, referent, [column], ["id"], ondelete=ondelete)
+
+
+def upgrade():
+    for table, column, referent in _FOREIGN_KEYS:
+        _replace_foreign_key(table, column, referent, "CASCADE")
+    op.create_index("ix_clients_inbound_id_id", "clients", ["inbound_id", "id"])
+    if op.get_bind().dialect.name == "postgresql":
+        op.alter_column(
+            "clients",
+            "uuid",
+            type_=postgresql.UUID(as_uuid=False),
+            existing_nullable=False,
+            postgresql_using="uuid::uuid",
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "postgresql":
+        op.alter_column(
+            "clients",
+            "uuid",
+            type_=sa.String(),
+            existing_type=postgresql.UUID(as_uuid=False),
+            existing_nullable=False,
+            postgresql_using="uuid::text",
+        )
+    op.drop_index("ix_clients_inbound_id_id", table_name="clients")
+    for table, column, referent in reversed(_FOREIGN_KEYS):
+        _replace_foreign_key(table, column, referent, None)
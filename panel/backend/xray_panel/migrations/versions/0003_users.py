@@ -0,0 +1,54 @@
+"""Users with one UUID and membership in inbounds or node groups
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("username", sa.String(), nullable=False, unique=True),
+        sa.Column(
+            "uuid",
+            sa.String().with_variant(postgresql.UUID(as_uuid=False), "postgresql"),
+            nullable=False,
+            unique=True,
+        ),
+        sa.Column("level", sa.Integer(), nullable=False),
+        sa.Column("enabled", sa.Boolean(), nullable=False),
+        sa.Column("disabled_reason", sa.String(), nullable=True),
+    )
+
+    op.create_table(
+        "user_inbounds",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("inbound_id", sa.Integer(), sa.ForeignKey("inbounds.id", ondelete="CASCADE"), primary_key=True),
+    )
+    op.create_index("ix_user_inbounds_inbound_id_user_id", "user_inbounds", ["inbound_id", "user_id"])
+
+    op.create_table(
+        "user_groups",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("group", sa.String(), primary_key=True),
+    )
+    op.create_index("ix_user_groups_group", "user_groups", ["group"])
+
+
+def downgrade():
+    op.drop_index("ix_user_groups_group", table_name="user_groups")
+    op.drop_table("user_groups")
+    op.drop_index("ix_user_inbounds_inbound_id_user_id", table_name="user_inbounds")
+    op.drop_table("user_inbounds")
+    op.drop_table("users")
@@ -0,0 +1,32 @@
+"""Durable push outbox with retry backoff per node
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "push_outbox",
+        sa.Column("node_id", sa.Integer(), sa.ForeignKey("nodes.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("revision", sa.Integer(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("next_attempt_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+    )
+    op.create_index("ix_push_outbox_next_attempt_at", "push_outbox", ["next_attempt_at"])
+    # Ноды, рассинхронизированные на момент миграции, попадают в outbox при первом старте (reconcile)
+
+
+def downgrade():
+    op.drop_index("ix_push_outbox_next_attempt_at", table_name="push_outbox")
+    op.drop_table("push_outbox")
@@ -0,0 +1,24 @@
+"""Node delivery mode: push from the panel or long-poll pull by the agent
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("nodes") as batch:
+        batch.add_column(sa.Column("mode", sa.String(), nullable=False, server_default="push"))
+
+
+def downgrade():
+    with op.batch_alter_table("nodes") as batch:
+        batch.drop_column("mode")
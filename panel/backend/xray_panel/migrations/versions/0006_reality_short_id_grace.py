@@ -0,0 +1,26 @@
+"""Previous Reality short ID kept valid for a grace window after rotation
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("inbounds") as batch:
+        batch.add_column(sa.Column("reality_previous_short_id", sa.String(), nullable=True))
+        batch.add_column(sa.Column("reality_previous_short_id_until", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("inbounds") as batch:
+        batch.drop_column("reality_previous_short_id_until")
+        batch.drop_column("reality_previous_short_id")
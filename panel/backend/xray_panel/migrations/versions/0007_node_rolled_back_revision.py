@@ -0,0 +1,24 @@
+"""Node rolled back on the agent: background push paused until resumed
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("nodes") as batch:
+        batch.add_column(sa.Column("rolled_back_revision", sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("nodes") as batch:
+        batch.drop_column("rolled_back_revision")
@@ -0,0 +1,25 @@
+"""Push outbox rows parked after the agent rejected the config
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("push_outbox") as batch:
+        batch.alter_column("next_attempt_at", existing_type=sa.DateTime(timezone=True), nullable=True)
+
+
+def downgrade():
+    op.execute("UPDATE push_outbox SET next_attempt_at = CURRENT_TIMESTAMP WHERE next_attempt_at IS NULL")
+    with op.batch_alter_table("push_outbox") as batch:
+        batch.alter_column("next_attempt_at", existing_type=sa.DateTime(timezone=True), nullable=False)
@@ -0,0 +1,26 @@
+"""Traffic totals of shared-identity users
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("users") as batch:
+        batch.add_column(sa.Column("traffic_up", sa.BigInteger(), nullable=False, server_default="0"))
+        batch.add_column(sa.Column("traffic_down", sa.BigInteger(), nullable=False, server_default="0"))
+
+
+def downgrade():
+    with op.batch_alter_table("users") as batch:
+        batch.drop_column("traffic_down")
+        batch.drop_column("traffic_up")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, UniqueConstraint
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Float, Index, Integer, String, Text, ForeignKey, UniqueConstraint, Uuid, true
 from sqlalchemy.orm import relationship, declarative_base
 
 Base = declarative_base()
@@ -12,7 +12,25 @@ class Node(Base):
     url = Column(String, nullable=False)
     node_key = Column(String, nullable=False)
 
-    inbounds = relationship("Inbound", back_populates="node", cascade="all, delete")
+    # Группа нод для автоматического размещения клиентов и вес ноды в стратегии weighted
+    group = Column(String, nullable=False, default="default", server_default="default", index=True)
+    weight = Column(Integer, nullable=False, default=1, server_default="1")
+    # push — панель отправляет конфиг агенту; pull — агент сам забирает его long-poll запросом
+    mode = Column(String, nullable=False, default="push", server_default="push")
+
+    # Ревизия конфига растёт при каждом изменении, влияющем на ноду; applied — подтверждённая агентом
+    # server_default у NOT NULL колонок, добавленных после baseline, — миграция добавляет их в непустые таблицы
+    config_revision = Column(Integer, nullable=False, default=0, server_default="0")
+    applied_revision = Column(Integer, nullable=False, default=0, server_default="0")
+    # Ревизия, на которую конфиг откатили на самой ноде (/history/{hash}/rollback); пока не NULL,
+    # фоновый push и outbox ноду не трогают — до POST /nodes/{id}/push/resume
+    rolled_back_revision = Column(Integer, nullable=True)
+
+    # Порядок по id — чтобы build_node_config и потоковая сериализация давали один и тот же JSON
+    # Удаление каскадом на стороне БД (ON DELETE CASCADE): inbounds и клиенты не загружаются в сессию
+    inbounds = relationship(
+        "Inbound", back_populates="node", cascade="all, delete", passive_deletes=True, order_by="Inbound.id"
+    )
 
 
 class Inbound(Base):
@@ -22,7 +40,7 @@ class Inbound(Base):
     )
 
     id = Column(Integer, primary_key=True)
-    node_id = Column(Integer, ForeignKey("nodes.id"), nullable=False)
+    node_id = Column(Integer, ForeignKey("nodes.id", ondelete="CASCADE"), nullable=False)
 
     name = Column(String, nullable=False)
     listen = Column(String, default="0.0.0.0")
@@ -37,22 +55,124 @@ class Inbound(Base):
     reality_short_id = Column(String, default="")
     reality_dest = Column(String, default="")
     reality_fingerprint = Column(String, default="chrome")
+    # Прежний short ID после ротации остаётся в shortIds до ..._until, чтобы клиенты перешли на новый без обрыва
+    reality_previous_short_id = Column(String, nullable=True)
+    reality_previous_short_id_until = Column(DateTime(timezone=True), nullable=True)
+
+    # Число клиентов; поддерживается инкрементально при создании/удалении клиентов
+    client_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     node = relationship("Node", back_populates="inbounds")
-    clients = relationship("Client", back_populates="inbound", cascade="all, delete")
+    clients = relationship(
+        "Client", back_populates="inbound", cascade="all, delete", passive_deletes=True, order_by="Client.id"
+    )
 
 
 class Client(Base):
     __tablename__ = "clients"
     __table_args__ = (
         UniqueConstraint("inbound_id", "username", name="uq_clients_inbound_username"),
+        # Проход по истёкшим: WHERE enabled AND expires_at <= now
+        Index("ix_clients_enabled_expires_at", "enabled", "expires_at"),
+        # Клиенты inbound'а по порядку id: keyset-страницы /clients?inbound_id= и потоковая сборка конфига
+        Index("ix_clients_inbound_id_id", "inbound_id", "id"),
     )
 
     id = Column(Integer, primary_key=True)
-    inbound_id = Column(Integer, ForeignKey("inbounds.id"), nullable=False)
+    inbound_id = Column(Integer, ForeignKey("inbounds.id", ondelete="CASCADE"), nullable=False)
 
     username = Column(String, nullable=False)
-    uuid = Column(String, nullable=False, unique=True)
+    # Нативный uuid в PostgreSQL (16 байт вместо строки), в остальных СУБД — строка как раньше
+    uuid = Column(String().with_variant(Uuid(as_uuid=False), "postgresql"), nullable=False, unique=True)
     level = Column(Integer, default=0)
 
+    # Суммарный трафик, накапливается сборщиком статистики с нод
+    traffic_up = Column(BigInteger, nullable=False, default=0, server_default="0")
+    traffic_down = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+    # Лимит трафика в байтах (uplink + downlink) и срок действия; NULL — без ограничения
+    data_limit = Column(BigInteger, nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=True)
+    # Отключённый клиент не попадает в конфиг ноды и подписки; reason: quota / expired / manual
+    enabled = Column(Boolean, nullable=False, default=True, server_default=true())
+    disabled_reason = Column(String, nullable=True)
+
     inbound = relationship("Inbound", back_populates="clients")
+
+
+class User(Base):
+    __tablename__ = "users"
+
+    # Один UUID на пользователя для всех inbound'ов, куда у него есть доступ (в отличие от Client — строка на inbound)
+    id = Column(Integer, primary_key=True)
+    username = Column(String, nullable=False, unique=True)
+    uuid = Column(String().with_variant(Uuid(as_uuid=False), "postgresql"), nullable=False, unique=True)
+    level = Column(Integer, nullable=False, default=0)
+    enabled = Column(Boolean, nullable=False, default=True)
+    disabled_reason = Column(String, nullable=True)
+    # Суммарный трафик по всем нодам (email "u{id}.{username}" в счётчиках Xray)
+    traffic_up = Column(BigInteger, nullable=False, default=0, server_default="0")
+    traffic_down = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+
+class UserInbound(Base):
+    __tablename__ = "user_inbounds"
+    __table_args__ = (
+        # Участники inbound'а при сборке конфига ноды
+        Index("ix_user_inbounds_inbound_id_user_id", "inbound_id", "user_id"),
+    )
+
+    # Доступ к конкретному inbound'у
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    inbound_id = Column(Integer, ForeignKey("inbounds.id", ondelete="CASCADE"), primary_key=True)
+
+
+class UserGroup(Base):
+    __tablename__ = "user_groups"
+
+    # Доступ ко всем inbound'ам всех нод группы (Node.group), включая добавленные позже
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    group = Column(String, primary_key=True, index=True)
+
+
+class Subscription(Base):
+    __tablename__ = "subscriptions"
+
+    id = Column(Integer, primary_key=True)
+    username = Column(String, nullable=False, unique=True)
+    token = Column(String, nullable=False, unique=True)
+
+
+class ClientTraffic(Base):
+    __tablename__ = "client_traffic"
+
+    client_id = Column(Integer, ForeignKey("clients.id", ondelete="CASCADE"), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True, index=True)
+    uplink = Column(BigInteger, nullable=False, default=0, server_default="0")
+    downlink = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+
+class NodeHealth(Base):
+    __tablename__ = "node_health"
+
+    # Последний снимок мониторинга и сжатая история проб — чтобы пережить рестарт панели
+    node_id = Column(Integer, ForeignKey("nodes.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(String, nullable=False, default="unknown", server_default="unknown")
+    latency_ms = Column(Float, nullable=True)
+    availability = Column(Float, nullable=True)
+    connections = Column(Integer, nullable=True)
+    checked_at = Column(DateTime(timezone=True), nullable=True)
+    history = Column(Text, nullable=False, default="[]", server_default="[]")
+
+
+class PushOutbox(Base):
+    __tablename__ = "push_outbox"
+
+    # Ноды, чей конфиг ещё не подтверждён агентом: запись появляется в одной транзакции с изменением
+    # и удаляется, когда applied_revision догоняет revision; attempts / next_attempt_at — backoff повторов.
+    # next_attempt_at = NULL — агент отверг конфиг (4xx), повтора нет до следующего изменения ревизии
+    node_id = Column(Integer, ForeignKey("nodes.id", ondelete="CASCADE"), primary_key=True)
+    revision = Column(Integer, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    last_error = Column(Text, nullable=True)
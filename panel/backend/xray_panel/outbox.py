@@ -0,0 +1,119 @@
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import DateTime, and_, case, delete, literal, select, update
+from sqlalchemy.orm import Session
+
+from .models import Node, PushOutbox
+
+
+# Повторы неудачного push: экспоненциальный backoff от базы до потолка, со случайным разбросом
+PUSH_OUTBOX_BACKOFF_SECONDS = float(os.environ.get("PUSH_OUTBOX_BACKOFF_SECONDS", "2"))
+PUSH_OUTBOX_MAX_BACKOFF_SECONDS = float(os.environ.get("PUSH_OUTBOX_MAX_BACKOFF_SECONDS", "300"))
+
+
+def _insert(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError(f"Push outbox upsert is not supported for {dialect}")
+    return insert(PushOutbox)
+
+
+def _upsert_from_nodes(db: Session, where, now: datetime):
+    stmt = _insert(db).from_select(
+        ["node_id", "revision", "attempts", "next_attempt_at"],
+        select(Node.id, Node.config_revision, literal(0), literal(now, DateTime(timezone=True))).where(where),
+    )
+    # Уже ожидающая нода сохраняет свой backoff — новое изменение только поднимает ревизию;
+    # отложенная после отказа агента запись возвращается в очередь, только если ревизия сменилась
+    parked = and_(PushOutbox.next_attempt_at.is_(None), PushOutbox.revision != stmt.excluded.revision)
+    db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[PushOutbox.node_id],
+            set_={
+                "revision": stmt.excluded.revision,
+                "next_attempt_at": case((parked, stmt.excluded.next_attempt_at), else_=PushOutbox.next_attempt_at),
+            },
+        )
+    )
+
+
+def enqueue(db: Session, node_ids: Iterable[int]):
+    """Записывает ноды в outbox с их текущей config_revision — в транзакции самого изменения."""
+    ids = sorted(set(node_ids))
+    if ids:
+        _upsert_from_nodes(db, Node.id.in_(ids), datetime.now(timezone.utc))
+
+
+def _drop_applied(db: Session):
+    applied = select(Node.applied_revision).where(Node.id == PushOutbox.node_id).scalar_subquery()
+    db.execute(delete(PushOutbox).where(PushOutbox.revision <= applied).execution_options(synchronize_session=False))
+
+
+def reconcile(db: Session):
+    """Старт панели: все ноды, чья applied_revision отстаёт от config_revision, — в outbox и на повтор сразу."""
+    now = datetime.now(timezone.utc)
+    _upsert_from_nodes(db, Node.applied_revision < Node.config_revision, now)
+    _drop_applied(db)
+    db.execute(
+        update(PushOutbox)
+        .where(PushOutbox.next_attempt_at.is_not(None))
+        .values(next_attempt_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def due(db: Session, limit: int) -> List[int]:
+    """Ноды, которым пора повторить push; уже догнавшие свою ревизию удаляются из outbox."""
+    _drop_applied(db)
+    db.commit()
+    return list(
+        db.execute(
+            select(PushOutbox.node_id)
+            .join(Node, Node.id == PushOutbox.node_id)
+            # Откатенная на самой ноде — ждёт оператора, а не повтора
+            .where(PushOutbox.next_attempt_at <= datetime.now(timezone.utc), Node.rolled_back_revision.is_(None))
+            .order_by(PushOutbox.next_attempt_at.asc())
+            .limit(limit)
+        ).scalars()
+    )
+
+
+def acknowledge(db: Session, node_id: int, revision: int):
+    # Изменение во время push подняло revision выше подтверждённой — запись остаётся до следующего push
+    db.execute(
+        delete(PushOutbox)
+        .where(PushOutbox.node_id == node_id, PushOutbox.revision <= revision)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def backoff(attempts: int) -> float:
+    delay = min(PUSH_OUTBOX_MAX_BACKOFF_SECONDS, PUSH_OUTBOX_BACKOFF_SECONDS * 2 ** max(0, attempts - 1))
+    # Разброс в [delay/2, delay] — ноды, упавшие разом, не повторяются синхронно
+    return random.uniform(delay / 2, delay)
+
+
+def record_failure(
+    db: Session, node_id: int, error: str, rejected: bool = False
+) -> Optional[Tuple[int, Optional[datetime]]]:
+    """Откладывает следующий повтор; (attempts, next_attempt_at) или None, если ноды нет в outbox.
+
+    rejected — агент отверг конфиг (4xx: xray -test, рестарт с откатом): повтор того же конфига не поможет,
+    поэтому запись ждёт следующего изменения ревизии (next_attempt_at = NULL).
+    """
+    row = db.get(PushOutbox, node_id)
+    if row is None:
+        return None
+    attempts = row.attempts + 1
+    next_attempt_at = None if rejected else datetime.now(timezone.utc) + timedelta(seconds=backoff(attempts))
+    row.attempts, row.next_attempt_at, row.last_error = attempts, next_attempt_at, error
+    db.commit()
+    return attempts, next_attempt_at
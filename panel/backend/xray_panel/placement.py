@@ -0,0 +1,95 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from .health import monitor
+from .models import Node, Inbound, Client
+from .stats import collector
+
+
+STRATEGIES = ("least-clients", "least-traffic", "weighted")
+
+# Порядок предпочтения по здоровью: offline-ноды не выбираются вовсе
+_HEALTH_RANK = {"online": 0, "unknown": 1, "degraded": 2}
+
+
+@dataclass
+class PlacementCandidate:
+    inbound_id: int
+    node_id: int
+    client_count: int
+    weight: int
+    health: str
+    connections: Optional[int] = None
+    recent_traffic: Optional[int] = None
+    score: float = 0.0
+
+
+def adjust_client_counts(db: Session, deltas: Dict[int, int]):
+    """Сдвигает inbounds.client_count на delta в текущей транзакции (без пересчёта COUNT(*))."""
+    for inbound_id, delta in sorted(deltas.items()):
+        if delta:
+            db.execute(
+                update(Inbound)
+                .where(Inbound.id == inbound_id)
+                .values(client_count=Inbound.client_count + delta)
+                .execution_options(synchronize_session=False)
+            )
+
+
+def count_by_inbound(inbound_ids: Iterable[int]) -> Dict[int, int]:
+    counts: Dict[int, int] = {}
+    for inbound_id in inbound_ids:
+        counts[inbound_id] = counts.get(inbound_id, 0) + 1
+    return counts
+
+
+def recount_clients(db: Session):
+    """Полный пересчёт счётчиков одним запросом — при старте, на случай правок БД в обход API."""
+    counted = (
+        select(func.count(Client.id)).where(Client.inbound_id == Inbound.id).correlate(Inbound).scalar_subquery()
+    )
+    db.execute(update(Inbound).values(client_count=counted).execution_options(synchronize_session=False))
+    db.commit()
+
+
+def _score(c: PlacementCandidate, strategy: str) -> float:
+    if strategy == "least-traffic":
+        # Сначала по трафику ноды за последний опрос, при равенстве — по числу клиентов
+        return float(c.recent_traffic or 0) + c.client_count / 1e6
+    if strategy == "weighted":
+        # Заполнение пропорционально весу; живые соединения ноды немного штрафуют выбор
+        return (c.client_count + 1) / c.weight + (c.connections or 0) / (1000.0 * c.weight)
+    return float(c.client_count)
+
+
+def rank_candidates(db: Session, group: str, strategy: str) -> List[PlacementCandidate]:
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown placement strategy: {strategy}")
+    rows = db.execute(
+        select(Inbound.id, Inbound.node_id, Inbound.client_count, Node.weight)
+        .join(Node, Node.id == Inbound.node_id)
+        .where(Node.group == group, Node.weight > 0)
+    ).all()
+
+    candidates: List[PlacementCandidate] = []
+    for inbound_id, node_id, client_count, weight in rows:
+        state = monitor.get(node_id)
+        health = state.status if state is not None else "unknown"
+        if health not in _HEALTH_RANK:
+            continue
+        c = PlacementCandidate(
+            inbound_id=inbound_id,
+            node_id=node_id,
+            client_count=client_count or 0,
+            weight=weight,
+            health=health,
+            connections=state.connections if state is not None else None,
+            recent_traffic=collector.node_traffic.get(node_id),
+        )
+        c.score = _score(c, strategy)
+        candidates.append(c)
+    candidates.sort(key=lambda c: (_HEALTH_RANK[c.health], c.score, c.inbound_id))
+    return candidates
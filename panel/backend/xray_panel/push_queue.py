@@ -0,0 +1,586 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, BinaryIO, Callable, Dict, Iterable, List, Optional
+
+import httpx
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from . import metrics
+from .cache import cache, load_compiled_config
+from .config_gen import diff_node_config, iter_node_config_json
+from .db import run_db
+from .models import Node, Inbound
+from .outbox import acknowledge, due, enqueue, reconcile, record_failure
+from .users import member_rows
+
+
+# Изменения, пришедшие в пределах окна, сливаются в один push на ноду
+PUSH_DEBOUNCE_SECONDS = float(os.environ.get("PUSH_DEBOUNCE_SECONDS", "1.0"))
+# Верхняя граница задержки, чтобы непрерывный поток изменений не откладывал push бесконечно
+PUSH_MAX_DELAY_SECONDS = float(os.environ.get("PUSH_MAX_DELAY_SECONDS", "10.0"))
+PUSH_TIMEOUT_SECONDS = float(os.environ.get("PUSH_TIMEOUT_SECONDS", "15.0"))
+# Параметры массового push на все ноды
+PUSH_CONCURRENCY = int(os.environ.get("PUSH_CONCURRENCY", "10"))
+PUSH_RETRIES = int(os.environ.get("PUSH_RETRIES", "2"))
+PUSH_RETRY_BACKOFF_SECONDS = float(os.environ.get("PUSH_RETRY_BACKOFF_SECONDS", "0.5"))
+# Ноды с таким числом клиентов и больше получают конфиг потоком (/apply-config-stream), без сборки в памяти; 0 — выключено
+PUSH_STREAM_MIN_CLIENTS = int(os.environ.get("PUSH_STREAM_MIN_CLIENTS", "50000"))
+# Сжатие потокового тела: gzip, zstd (нужен пакет zstandard) или identity
+PUSH_STREAM_ENCODING = os.environ.get("PUSH_STREAM_ENCODING", "gzip")
+PUSH_STREAM_CHUNK_SIZE = 64 * 1024
+# Как часто забирать из push_outbox ноды, которым пора повторить push; 0 — без повторов и сверки при старте
+PUSH_OUTBOX_POLL_SECONDS = float(os.environ.get("PUSH_OUTBOX_POLL_SECONDS", "5"))
+PUSH_OUTBOX_BATCH_SIZE = int(os.environ.get("PUSH_OUTBOX_BATCH_SIZE", "500"))
+
+log = logging.getLogger("xray_panel.push")
+
+
+def normalize_node_url(url: str) -> str:
+    u = (url or "").strip().rstrip("/")
+    if not u:
+        return u
+    if u.startswith("http://") or u.startswith("https://"):
+        return u
+    return f"http://{u}"
+
+
+@dataclass
+class NodeSyncState:
+    node_id: int
+    pending: bool = False
+    in_flight: bool = False
+    requested_revision: int = 0
+    applied_revision: int = 0
+    last_error: Optional[str] = None
+    last_push_at: Optional[datetime] = None
+    # Неудачные попытки подряд и время следующего повтора из outbox
+    attempts: int = 0
+    next_attempt_at: Optional[datetime] = None
+    # Конфиг откатили на самой ноде: push приостановлен до resume_rollback()
+    rolled_back_revision: Optional[int] = None
+    # Время последнего успешного push — ревизии из более ранних проб /health не учитываются
+    applied_at: Optional[datetime] = field(default=None, repr=False)
+    first_pending_at: Optional[float] = field(default=None, repr=False)
+
+
+@dataclass
+class PushRequest:
+    node_id: int
+    base_url: str
+    headers: Dict[str, str]
+    config: Optional[Dict[str, Any]]
+    revision: int
+    # Для больших нод вместо config — сжатый JSON во временном файле и sha256 несжатого тела
+    body: Optional[BinaryIO] = None
+    body_sha256: str = ""
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._obj = zlib.compressobj(6, zlib.DEFLATED, 31)
+        elif encoding == "zstd":
+            # zstandard — необязательная зависимость, импортируется только при PUSH_STREAM_ENCODING=zstd
+            import zstandard
+
+            self._obj = zstandard.ZstdCompressor(level=3).compressobj()
+        elif encoding == "identity":
+            self._obj = None
+        else:
+            raise ValueError(f"Unsupported PUSH_STREAM_ENCODING: {encoding}")
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data) if self._obj is not None else data
+
+    def flush(self) -> bytes:
+        return self._obj.flush() if self._obj is not None else b""
+
+
+def _stream_client_count(db: Session, node_id: int) -> int:
+    clients = db.execute(
+        select(func.coalesce(func.sum(Inbound.client_count), 0)).where(Inbound.node_id == node_id)
+    ).scalar_one()
+    users = db.execute(select(func.count()).select_from(member_rows(node_id).order_by(None).subquery())).scalar_one()
+    return clients + users
+
+
+def _write_config_stream(db: Session, node_id: int, out: BinaryIO) -> str:
+    started = time.perf_counter()
+    digest = hashlib.sha256()
+    size = 0
+    compressor = _Compressor(PUSH_STREAM_ENCODING)
+    for chunk in iter_node_config_json(db, node_id):
+        digest.update(chunk)
+        size += len(chunk)
+        out.write(compressor.compress(chunk))
+    out.write(compressor.flush())
+    out.seek(0)
+    metrics.observe_config("stream", time.perf_counter() - started, size)
+    return digest.hexdigest()
+
+
+def _load_push_request(db: Session, node_id: int) -> PushRequest:
+    node = db.query(Node.url, Node.node_key, Node.config_revision).filter(Node.id == node_id).first()
+    if not node:
+        raise HTTPException(status_code=404, detail="Node not found")
+    req = PushRequest(
+        node_id=node_id,
+        base_url=normalize_node_url(node.url),
+        headers={"X-Node-Key": node.node_key},
+        config=None,
+        revision=node.config_revision or 0,
+    )
+    if (
+        PUSH_STREAM_MIN_CLIENTS > 0
+        and cache.get_config(node_id) is None
+        and _stream_client_count(db, node_id) >= PUSH_STREAM_MIN_CLIENTS
+    ):
+        # Тело пишется во временный файл до сетевого запроса: сессия БД не держится во время отправки,
+        # а повтор после 404 от старого агента не требует повторного чтения клиентов
+        body = tempfile.TemporaryFile()
+        try:
+            req.body_sha256 = _write_config_stream(db, node_id, body)
+        except Exception:
+            body.close()
+            raise
+        req.body = body
+        return req
+
+    compiled = load_compiled_config(db, node_id)
+    if not compiled:
+        raise HTTPException(status_code=404, detail="Node not found")
+    req.config = compiled.config
+    req.revision = compiled.revision
+    return req
+
+
+def _load_compiled_push_config(db: Session, node_id: int) -> Dict[str, Any]:
+    compiled = load_compiled_config(db, node_id)
+    if not compiled:
+        raise HTTPException(status_code=404, detail="Node not found")
+    return compiled.config
+
+
+async def _iter_file(f: BinaryIO) -> AsyncIterator[bytes]:
+    while True:
+        chunk = f.read(PUSH_STREAM_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def save_applied_revision(db: Session, node_id: int, revision: int):
+    db.query(Node).filter(Node.id == node_id, Node.applied_revision < revision).update(
+        {Node.applied_revision: revision}, synchronize_session=False
+    )
+    acknowledge(db, node_id, revision)
+    db.commit()
+
+
+def mark_rolled_back(db: Session, node_id: int, revision: int) -> bool:
+    """Агент работает на ревизии ниже подтверждённой (откат из истории, ручной конфиг) — push ноды на паузу."""
+    rows = (
+        db.query(Node)
+        .filter(
+            Node.id == node_id,
+            Node.mode == "push",
+            Node.applied_revision > revision,
+            Node.rolled_back_revision.is_(None),
+        )
+        .update({Node.rolled_back_revision: revision}, synchronize_session=False)
+    )
+    db.commit()
+    return bool(rows)
+
+
+def clear_rolled_back(db: Session, node_id: int) -> bool:
+    node = db.query(Node).filter(Node.id == node_id).first()
+    if not node:
+        raise HTTPException(status_code=404, detail="Node not found")
+    if node.rolled_back_revision is None:
+        return False
+    node.rolled_back_revision = None
+    # Агент не на подтверждённой ревизии — конфиг панели уйдёт на ноду снова
+    enqueue(db, [node_id])
+    db.commit()
+    return True
+
+
+def _rolled_back_nodes(db: Session) -> Dict[int, int]:
+    return dict(db.execute(select(Node.id, Node.rolled_back_revision).where(Node.rolled_back_revision.is_not(None))).all())
+
+
+class PushScheduler:
+    def __init__(
+        self,
+        debounce: float = PUSH_DEBOUNCE_SECONDS,
+        max_delay: float = PUSH_MAX_DELAY_SECONDS,
+        outbox_interval: float = PUSH_OUTBOX_POLL_SECONDS,
+    ):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.outbox_interval = outbox_interval
+        self._outbox_task: Optional[asyncio.Task] = None
+        self._states: Dict[int, NodeSyncState] = {}
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._running: Dict[int, asyncio.Task] = {}
+        # Последний конфиг, подтверждённый агентом: (revision, config) — база для дельт
+        self._acked: Dict[int, tuple] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        # Фоновый push не трогает ноды, для которых skip_node(node_id) истинно (например, offline);
+        # они остаются pending до resume()
+        self.skip_node: Optional[Callable[[int], bool]] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        for node_id, revision in (await run_db(_rolled_back_nodes)).items():
+            self._get_state(node_id).rolled_back_revision = revision
+        self._client = httpx.AsyncClient(
+            timeout=PUSH_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=max(PUSH_CONCURRENCY, 10), max_keepalive_connections=PUSH_CONCURRENCY),
+        )
+        if self.outbox_interval > 0:
+            self._outbox_task = self._loop.create_task(self._drain_outbox())
+
+    async def stop(self):
+        if self._outbox_task is not None:
+            self._outbox_task.cancel()
+            await asyncio.gather(self._outbox_task, return_exceptions=True)
+            self._outbox_task = None
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        if self._running:
+            await asyncio.gather(*self._running.values(), return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def schedule(self, node_id: int):
+        """Помечает ноду как требующую push. Можно вызывать из потоков threadpool."""
+        if self._loop is None:
+            raise RuntimeError("Push scheduler is not started")
+        self._loop.call_soon_threadsafe(self._mark_pending, node_id)
+
+    def resume(self, node_id: int):
+        """Перезапускает отложенный push ноды, если у неё есть несинхронизированные изменения."""
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._resume, node_id)
+
+    async def check_revision(self, node_id: int, revision: int, observed_at: datetime):
+        """Ревизия из /health агента: ниже подтверждённой — конфиг откатили на ноде, push встаёт на паузу.
+
+        Откат на ноде — решение оператора (например, во время инцидента), поэтому панель не возвращает
+        свой конфиг сама. Пробы, начатые до последнего успешного push или во время него, не учитываются.
+        """
+        state = self._get_state(node_id)
+        if state.rolled_back_revision is not None or node_id in self._running:
+            return
+        if state.applied_at is not None and observed_at < state.applied_at:
+            return
+        if not await run_db(mark_rolled_back, node_id, revision):
+            return
+        state.rolled_back_revision = revision
+        state.last_error = f"Config rolled back on the node to revision {revision}; push paused until resumed"
+        timer = self._timers.pop(node_id, None)
+        if timer is not None:
+            timer.cancel()
+        # Подтверждённый конфиг больше не база для дельты
+        self._acked.pop(node_id, None)
+        log.warning("Node %s was rolled back to revision %s, push paused until resumed", node_id, revision)
+
+    async def resume_rollback(self, node_id: int) -> bool:
+        """Снимает паузу после отката на ноде; конфиг панели отправляется снова."""
+        resumed = await run_db(clear_rolled_back, node_id)
+        state = self._get_state(node_id)
+        state.rolled_back_revision = None
+        if resumed:
+            state.last_error = None
+            self._mark_pending(node_id)
+        return resumed
+
+    def forget(self, node_id: int):
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._forget, node_id)
+
+    def note_pull(self, node_id: int, revision: int, applied: bool):
+        """Состояние pull-ноды для /sync: конфиг отдан агенту или (applied) подтверждён им."""
+        state = self._get_state(node_id)
+        state.pending = False
+        state.requested_revision = max(state.requested_revision, revision)
+        if applied:
+            state.applied_revision = max(state.applied_revision, revision)
+            state.last_error = None
+        else:
+            state.last_push_at = datetime.now(timezone.utc)
+
+    def state(self, node_id: int) -> NodeSyncState:
+        return self._states.get(node_id) or NodeSyncState(node_id=node_id)
+
+    def states(self):
+        return [self._states[k] for k in sorted(self._states)]
+
+    async def push_now(self, node_id: int) -> Dict[str, Any]:
+        """Немедленный push в обход окна ожидания; ошибки пробрасываются как HTTPException."""
+        state = self._get_state(node_id)
+        if state.rolled_back_revision is not None:
+            raise HTTPException(status_code=409, detail="Node config was rolled back on the node; resume push first")
+        timer = self._timers.pop(node_id, None)
+        if timer is not None:
+            timer.cancel()
+        # Ждём и push, запущенный, пока ждали предыдущий: на ноду всегда идёт не больше одного push
+        while (running := self._running.get(node_id)) is not None:
+            await asyncio.gather(running, return_exceptions=True)
+        state.pending = True
+        return await self._track(state, self._push(state))
+
+    async def push_many(
+        self,
+        node_ids: Iterable[int],
+        concurrency: int = PUSH_CONCURRENCY,
+        retries: int = PUSH_RETRIES,
+        timeout: float = 2 * PUSH_TIMEOUT_SECONDS,
+    ) -> List[Dict[str, Any]]:
+        """Параллельный push на несколько нод с ограничением параллелизма и повторами."""
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def push_one(node_id: int) -> Dict[str, Any]:
+            started = time.monotonic()
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    async with semaphore:
+                        result = await asyncio.wait_for(self.push_now(node_id), timeout)
+                    return {
+                        "node_id": node_id,
+                        "status": "pushed",
+                        "attempts": attempt,
+                        "duration_ms": int((time.monotonic() - started) * 1000),
+                        "node_response": result.get("node_response"),
+                    }
+                except Exception as e:
+                    if isinstance(e, HTTPException):
+                        detail = str(e.detail)
+                    elif isinstance(e, asyncio.TimeoutError):
+                        detail = f"Push timed out after {timeout:g}s"
+                        self._get_state(node_id).last_error = detail
+                    else:
+                        detail = str(e) or e.__class__.__name__
+                    # Повторяются только таймауты, сетевые ошибки и 5xx; отвергнутый нодой конфиг повтор не исправит
+                    transient = isinstance(e, asyncio.TimeoutError) or (
+                        isinstance(e, HTTPException) and e.status_code >= 500
+                    )
+                    if attempt > retries or not transient:
+                        return {
+                            "node_id": node_id,
+                            "status": "failed",
+                            "attempts": attempt,
+                            "duration_ms": int((time.monotonic() - started) * 1000),
+                            "detail": detail,
+                        }
+                # Пауза — вне семафора: ноды на повторе не занимают слоты здоровых
+                await asyncio.sleep(PUSH_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+
+        return list(await asyncio.gather(*(push_one(node_id) for node_id in node_ids)))
+
+    async def _drain_outbox(self):
+        """Повторы из push_outbox; первым проходом — сверка ревизий после рестарта панели."""
+        try:
+            await run_db(reconcile)
+        except Exception as e:
+            log.warning("Push outbox reconciliation failed: %s", e)
+        while True:
+            try:
+                for node_id in await run_db(due, PUSH_OUTBOX_BATCH_SIZE):
+                    if node_id in self._running or node_id in self._timers:
+                        continue
+                    if self.skip_node is not None and self.skip_node(node_id):
+                        continue
+                    self._mark_pending(node_id)
+            except Exception as e:
+                log.warning("Push outbox drain failed: %s", e)
+            await asyncio.sleep(self.outbox_interval)
+
+    async def _record_failure(self, state: NodeSyncState, rejected: bool = False):
+        try:
+            retry = await run_db(record_failure, state.node_id, state.last_error or "", rejected)
+        except Exception as e:
+            log.warning("Failed to record push failure for node %s: %s", state.node_id, e)
+            return
+        if retry is not None:
+            state.attempts, state.next_attempt_at = retry
+
+    def _get_state(self, node_id: int) -> NodeSyncState:
+        state = self._states.get(node_id)
+        if state is None:
+            state = NodeSyncState(node_id=node_id)
+            self._states[node_id] = state
+        return state
+
+    def _forget(self, node_id: int):
+        timer = self._timers.pop(node_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._states.pop(node_id, None)
+        self._acked.pop(node_id, None)
+
+    def _resume(self, node_id: int):
+        state = self._states.get(node_id)
+        if state is not None and state.pending and node_id not in self._running and node_id not in self._timers:
+            self._arm(state, time.monotonic())
+
+    def _mark_pending(self, node_id: int):
+        state = self._get_state(node_id)
+        state.pending = True
+        now = time.monotonic()
+        if state.first_pending_at is None:
+            state.first_pending_at = now
+        if node_id in self._running:
+            # Текущий push завершится и перезапустит таймер сам
+            return
+        self._arm(state, now)
+
+    def _arm(self, state: NodeSyncState, now: float):
+        timer = self._timers.pop(state.node_id, None)
+        if timer is not None:
+            timer.cancel()
+        first = state.first_pending_at if state.first_pending_at is not None else now
+        delay = max(0.0, min(self.debounce, first + self.max_delay - now))
+        self._timers[state.node_id] = self._loop.call_later(delay, self._fire, state.node_id)
+
+    def _fire(self, node_id: int):
+        self._timers.pop(node_id, None)
+        state = self._states.get(node_id)
+        if state is None or not state.pending or node_id in self._running or state.rolled_back_revision is not None:
+            return
+        if self.skip_node is not None and self.skip_node(node_id):
+            return
+        self._track(state, self._run(state))
+
+    def _track(self, state: NodeSyncState, coro) -> asyncio.Task:
+        """Push ноды как задача в _running: таймер и outbox не запустят второй push параллельно."""
+        task = self._loop.create_task(coro)
+        self._running[state.node_id] = task
+        task.add_done_callback(lambda done: self._finished(state, done))
+        return task
+
+    def _finished(self, state: NodeSyncState, task: asyncio.Task):
+        if self._running.get(state.node_id) is task:
+            self._running.pop(state.node_id)
+        # Изменения, пришедшие во время push, — следующим push после окна ожидания
+        if state.pending and self._states.get(state.node_id) is state and state.node_id not in self._running:
+            self._arm(state, time.monotonic())
+
+    async def _run(self, state: NodeSyncState):
+        try:
+            await self._push(state)
+        except Exception as e:
+            log.warning("Push to node %s failed: %s", state.node_id, getattr(e, "detail", None) or e)
+
+    async def _deliver_stream(self, req: PushRequest) -> httpx.Response:
+        headers = dict(req.headers)
+        headers["X-Config-Revision"] = str(req.revision)
+        headers["X-Config-Sha256"] = req.body_sha256
+        headers["Content-Type"] = "application/json"
+        if PUSH_STREAM_ENCODING != "identity":
+            headers["Content-Encoding"] = PUSH_STREAM_ENCODING
+        r = await self._client.post(f"{req.base_url}/apply-config-stream", content=_iter_file(req.body), headers=headers)
+        if r.status_code != 404:
+            return r
+        # Старый агент без потокового приёма — обычный снапшот
+        req.config = await run_db(_load_compiled_push_config, req.node_id)
+        return await self._client.post(
+            f"{req.base_url}/apply-config",
+            json={"config": req.config, "revision": req.revision},
+            headers=req.headers,
+        )
+
+    async def _deliver(self, req: PushRequest) -> httpx.Response:
+        if req.body is not None:
+            return await self._deliver_stream(req)
+        acked = self._acked.get(req.node_id)
+        if acked is not None:
+            base_revision, base_config = acked
+            delta = diff_node_config(base_config, req.config)
+            if delta is not None:
+                r = await self._client.post(
+                    f"{req.base_url}/apply-delta",
+                    json={"base_revision": base_revision, "revision": req.revision, "delta": delta},
+                    headers=req.headers,
+                )
+                # 409 — агент на другой ревизии, 404 — старый агент без поддержки дельт
+                if r.status_code not in (404, 409):
+                    return r
+        return await self._client.post(
+            f"{req.base_url}/apply-config",
+            json={"config": req.config, "revision": req.revision},
+            headers=req.headers,
+        )
+
+    async def _push(self, state: NodeSyncState) -> Dict[str, Any]:
+        state.pending = False
+        state.first_pending_at = None
+        state.in_flight = True
+        req = None
+        try:
+            started = time.perf_counter()
+            req = await run_db(_load_push_request, state.node_id)
+            metrics.observe_push("prepare", time.perf_counter() - started)
+            state.requested_revision = req.revision
+            started = time.perf_counter()
+            r = await self._deliver(req)
+            metrics.observe_push("network", time.perf_counter() - started)
+            if r.status_code >= 400:
+                self._acked.pop(state.node_id, None)
+                # 4xx — агент отверг конфиг (например, xray -test), 5xx — сбой на стороне ноды
+                raise HTTPException(
+                    status_code=502 if r.status_code >= 500 else 400, detail=f"Node error: {r.status_code} {r.text}"
+                )
+            if req.config is not None:
+                self._acked[state.node_id] = (req.revision, req.config)
+            else:
+                # Потоковый конфиг в памяти не держим — следующий push тоже будет полным
+                self._acked.pop(state.node_id, None)
+            await run_db(save_applied_revision, state.node_id, req.revision)
+            state.applied_revision = req.revision
+            state.applied_at = datetime.now(timezone.utc)
+            state.last_error = None
+            state.attempts, state.next_attempt_at = 0, None
+            node_response = (
+                r.json() if r.headers.get("content-type", "").startswith("application/json") else r.text
+            )
+            metrics.observe_agent_timings(node_response)
+            return {"status": "pushed", "node_response": node_response}
+        except HTTPException as e:
+            state.last_error = str(e.detail)
+            metrics.push_failed(state.node_id)
+            await self._record_failure(state, rejected=e.status_code < 500)
+            raise
+        except Exception as e:
+            state.last_error = str(e) or e.__class__.__name__
+            metrics.push_failed(state.node_id)
+            await self._record_failure(state)
+            status_code = 502 if isinstance(e, httpx.TransportError) else 500
+            raise HTTPException(status_code=status_code, detail=state.last_error)
+        finally:
+            if req is not None and req.body is not None:
+                req.body.close()
+            state.in_flight = False
+            state.last_push_at = datetime.now(timezone.utc)
+
+
+scheduler = PushScheduler()
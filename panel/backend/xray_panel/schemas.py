@@ -1,23 +1,54 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .config_gen import XRAY_MAX_LEVEL
 
 
 class NodeCreate(BaseModel):
     name: str
     url: str
     node_key: str
+    group: str = "default"
+    weight: int = Field(default=1, ge=0)
+    mode: str = Field(default="push", pattern="^(push|pull)$")
 
 
 class NodeUpdate(BaseModel):
     name: Optional[str] = None
     url: Optional[str] = None
     node_key: Optional[str] = None
+    group: Optional[str] = None
+    weight: Optional[int] = Field(default=None, ge=0)
+    mode: Optional[str] = Field(default=None, pattern="^(push|pull)$")
+
+
+class NodeHealthOut(BaseModel):
+    status: str
+    latency_ms: Optional[float] = None
+    latency: Dict[str, Optional[float]] = {}
+    availability: Optional[float] = None
+    checked_at: Optional[datetime] = None
+    last_ok_at: Optional[datetime] = None
+    consecutive_failures: int = 0
+    last_error: Optional[str] = None
+    revision: Optional[int] = None
+    xray_state: Optional[str] = None
+    connections: Optional[int] = None
+    cpu_percent: Optional[float] = None
+    load_average: Optional[List[float]] = None
+    memory_available_bytes: Optional[int] = None
+    history: Optional[List[List[Optional[float]]]] = None
 
 
 class NodeOut(BaseModel):
     id: int
     name: str
     url: str
+    group: str = "default"
+    weight: int = 1
+    mode: str = "push"
+    health: Optional[NodeHealthOut] = None
 
     class Config:
         from_attributes = True
@@ -59,19 +90,35 @@ class InboundOut(BaseModel):
     reality_short_id: str
     reality_dest: str
     reality_fingerprint: str
+    reality_previous_short_id: Optional[str] = None
+    reality_previous_short_id_until: Optional[datetime] = None
+    client_count: int = 0
 
     class Config:
         from_attributes = True
 
 
+class RealityRotate(BaseModel):
+    keys: bool = True
+    short_id: bool = True
+    # Прежний short ID остаётся действительным столько секунд; только при ротации short ID без новых ключей
+    grace_seconds: int = Field(default=0, ge=0)
+
+
 class ClientCreate(BaseModel):
     inbound_id: int
     username: str
+    data_limit: Optional[int] = Field(default=None, ge=0)
+    expires_at: Optional[datetime] = None
 
 
 class ClientUpdate(BaseModel):
     username: Optional[str] = None
-    level: Optional[int] = None
+    level: Optional[int] = Field(default=None, ge=0, le=XRAY_MAX_LEVEL)
+    # Явный null в data_limit / expires_at снимает ограничение
+    data_limit: Optional[int] = Field(default=None, ge=0)
+    expires_at: Optional[datetime] = None
+    enabled: Optional[bool] = None
 
 
 class ClientOut(BaseModel):
@@ -80,6 +127,135 @@ class ClientOut(BaseModel):
     username: str
     uuid: str
     level: int
+    data_limit: Optional[int] = None
+    expires_at: Optional[datetime] = None
+    enabled: bool = True
+    disabled_reason: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+
+class UserAccess(BaseModel):
+    # Полный состав доступа: конкретные inbound'ы и группы нод (все inbound'ы нод группы)
+    inbound_ids: List[int] = []
+    groups: List[str] = []
+
+
+class UserCreate(UserAccess):
+    username: str
+    level: int = Field(default=0, ge=0, le=XRAY_MAX_LEVEL)
+
+
+class UserUpdate(BaseModel):
+    username: Optional[str] = None
+    level: Optional[int] = Field(default=None, ge=0, le=XRAY_MAX_LEVEL)
+    enabled: Optional[bool] = None
+
+
+class UserOut(BaseModel):
+    id: int
+    username: str
+    uuid: str
+    level: int
+    enabled: bool = True
+    disabled_reason: Optional[str] = None
+    traffic_up: int = 0
+    traffic_down: int = 0
 
     class Config:
         from_attributes = True
+
+
+class UserDetailOut(UserOut):
+    inbound_ids: List[int] = []
+    groups: List[str] = []
+
+
+class SubscriptionCreate(BaseModel):
+    username: str
+
+
+class SubscriptionOut(BaseModel):
+    id: int
+    username: str
+    token: str
+
+    class Config:
+        from_attributes = True
+
+
+class ClientBulkUpdateItem(ClientUpdate):
+    id: int
+
+
+class ClientBulkItemResult(BaseModel):
+    index: int
+    status: str
+    client: Optional[ClientOut] = None
+    detail: Optional[str] = None
+
+
+class ClientBulkResult(BaseModel):
+    succeeded: int
+    failed: int
+    items: List[ClientBulkItemResult]
+
+
+class NodeSyncOut(BaseModel):
+    node_id: int
+    pending: bool
+    in_flight: bool
+    requested_revision: int
+    applied_revision: int
+    last_error: Optional[str] = None
+    last_push_at: Optional[datetime] = None
+    attempts: int = 0
+    next_attempt_at: Optional[datetime] = None
+    rolled_back_revision: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+
+class NodePushResult(BaseModel):
+    node_id: int
+    status: str
+    attempts: int
+    duration_ms: int
+    node_response: Optional[Any] = None
+    detail: Optional[str] = None
+
+
+class TrafficBucketOut(BaseModel):
+    bucket_start: datetime
+    uplink: int
+    downlink: int
+
+
+class ClientTrafficOut(BaseModel):
+    client_id: int
+    username: str
+    inbound_id: int
+    uplink: int
+    downlink: int
+    buckets: Optional[List[TrafficBucketOut]] = None
+
+
+class ClientPlaceCreate(BaseModel):
+    username: str
+    group: str = "default"
+    strategy: str = "least-clients"
+    data_limit: Optional[int] = Field(default=None, ge=0)
+    expires_at: Optional[datetime] = None
+
+
+class PlacementCandidateOut(BaseModel):
+    inbound_id: int
+    node_id: int
+    client_count: int
+    weight: int
+    health: str
+    connections: Optional[int] = None
+    recent_traffic: Optional[int] = None
+    score: float
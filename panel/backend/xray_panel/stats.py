@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import bindparam, select
+from sqlalchemy.orm import Session
+
+from .config_gen import client_id_from_email, user_id_from_email
+from .db import run_db
+from .enforcement import enforcer
+from .models import Node, Client, ClientTraffic, User
+from .push_queue import normalize_node_url
+
+
+# Период опроса нод и размер бакета в таблице client_traffic
+STATS_POLL_INTERVAL = float(os.environ.get("STATS_POLL_INTERVAL", "60"))
+STATS_BUCKET_SECONDS = int(os.environ.get("STATS_BUCKET_SECONDS", "3600"))
+STATS_CONCURRENCY = int(os.environ.get("STATS_CONCURRENCY", "10"))
+STATS_TIMEOUT_SECONDS = float(os.environ.get("STATS_TIMEOUT_SECONDS", "15"))
+
+log = logging.getLogger("xray_panel.stats")
+
+
+def bucket_start(ts: datetime) -> datetime:
+    epoch = int(ts.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % STATS_BUCKET_SECONDS, tz=timezone.utc)
+
+
+def _list_nodes(db: Session) -> List[Tuple[int, str, str]]:
+    # Pull-ноды могут быть недоступны с панели (NAT) — опрашиваются только push-ноды
+    return [
+        tuple(r)
+        for r in db.query(Node.id, Node.url, Node.node_key).filter(Node.mode == "push").order_by(Node.id.asc()).all()
+    ]
+
+
+def _upsert_traffic(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise RuntimeError(f"Traffic upsert is not supported for {dialect}")
+    stmt = insert(ClientTraffic)
+    return stmt.on_conflict_do_update(
+        index_elements=[ClientTraffic.client_id, ClientTraffic.bucket_start],
+        set_={
+            "uplink": ClientTraffic.uplink + stmt.excluded.uplink,
+            "downlink": ClientTraffic.downlink + stmt.excluded.downlink,
+        },
+    )
+
+
+Counters = Dict[int, Tuple[int, int]]
+
+
+def _existing(db: Session, column, ids: List[int]) -> List[int]:
+    found: List[int] = []
+    for i in range(0, len(ids), 1000):
+        found.extend(db.execute(select(column).where(column.in_(ids[i : i + 1000]))).scalars())
+    return found
+
+
+def _add_totals(db: Session, table, counters: Counters, ids: List[int]):
+    db.execute(
+        table.update()
+        .where(table.c.id == bindparam("rid"))
+        .values(
+            traffic_up=table.c.traffic_up + bindparam("up"),
+            traffic_down=table.c.traffic_down + bindparam("down"),
+        ),
+        [{"rid": rid, "up": counters[rid][0], "down": counters[rid][1]} for rid in ids],
+    )
+
+
+def ingest_counters(db: Session, counters: Counters, ts: datetime, user_counters: Optional[Counters] = None) -> List[int]:
+    """Добавляет дельты трафика в бакет и к итогам клиентов и пользователей; возвращает id учтённых клиентов."""
+    users = _existing(db, User.id, sorted(user_counters or {}))
+    if users:
+        _add_totals(db, User.__table__, user_counters, users)
+    existing = _existing(db, Client.id, sorted(counters))
+    if not existing:
+        db.commit()
+        return []
+
+    bucket = bucket_start(ts)
+    db.execute(
+        _upsert_traffic(db),
+        [
+            {"client_id": cid, "bucket_start": bucket, "uplink": counters[cid][0], "downlink": counters[cid][1]}
+            for cid in existing
+        ],
+    )
+    _add_totals(db, Client.__table__, counters, existing)
+    db.commit()
+    return existing
+
+
+def _add(counters: Counters, key: int, up: int, down: int):
+    prev_up, prev_down = counters.get(key, (0, 0))
+    counters[key] = (prev_up + up, prev_down + down)
+
+
+def parse_user_stats(payload: Dict) -> Tuple[Counters, Counters]:
+    """Счётчики агента по email: клиенты ("{id}.{name}") и пользователи с общим UUID ("u{id}.{name}")."""
+    clients: Counters = {}
+    users: Counters = {}
+    for email, values in (payload.get("users") or {}).items():
+        if not isinstance(values, list) or len(values) != 2:
+            continue
+        client_id = client_id_from_email(email)
+        if client_id is not None:
+            _add(clients, client_id, int(values[0]), int(values[1]))
+            continue
+        user_id = user_id_from_email(email)
+        if user_id is not None:
+            _add(users, user_id, int(values[0]), int(values[1]))
+    return clients, users
+
+
+class StatsCollector:
+    def __init__(self, interval: float = STATS_POLL_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self.last_poll_at: Optional[datetime] = None
+        self.last_errors: Dict[int, str] = {}
+        # Байты (uplink + downlink) по ноде за последний опрос — для размещения least-traffic
+        self.node_traffic: Dict[int, int] = {}
+        # Агент сбрасывает счётчики при чтении: не сохранённые из-за ошибки БД дельты копятся
+        # здесь по нодам и уходят со следующим опросом
+        self._unsaved: Dict[int, Tuple[Counters, Counters]] = {}
+
+    async def start(self):
+        self._client = httpx.AsyncClient(timeout=STATS_TIMEOUT_SECONDS)
+        # STATS_POLL_INTERVAL=0 отключает фоновый опрос, остаётся только POST /traffic/poll
+        if self.interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll_once()
+            except Exception as e:
+                log.warning("Traffic stats poll failed: %s", e)
+
+    async def poll_once(self) -> Dict[int, Counters]:
+        """Опрашивает все ноды параллельно и сохраняет дельты; возвращает счётчики клиентов по нодам."""
+        nodes = await run_db(_list_nodes)
+        known = {node[0] for node in nodes}
+        for node_id in list(self._unsaved):
+            if node_id not in known:
+                self._unsaved.pop(node_id)
+        semaphore = asyncio.Semaphore(max(1, STATS_CONCURRENCY))
+        ts = datetime.now(timezone.utc)
+        errors: Dict[int, str] = {}
+        touched: List[int] = []
+
+        async def poll_node(node_id: int, url: str, node_key: str) -> Tuple[Counters, Counters]:
+            async with semaphore:
+                try:
+                    r = await self._client.post(
+                        f"{normalize_node_url(url)}/stats", json={"reset": True}, headers={"X-Node-Key": node_key}
+                    )
+                    if r.status_code >= 400:
+                        raise RuntimeError(f"Node error: {r.status_code} {r.text}")
+                    clients, users = parse_user_stats(r.json())
+                except Exception as e:
+                    errors[node_id] = str(e) or e.__class__.__name__
+                    return {}, {}
+                unsaved_clients, unsaved_users = self._unsaved.setdefault(node_id, ({}, {}))
+                for key, (up, down) in clients.items():
+                    _add(unsaved_clients, key, up, down)
+                for key, (up, down) in users.items():
+                    _add(unsaved_users, key, up, down)
+                if unsaved_clients or unsaved_users:
+                    try:
+                        touched.extend(await run_db(ingest_counters, unsaved_clients, ts, unsaved_users))
+                    except Exception as e:
+                        errors[node_id] = f"Failed to store traffic: {e}"
+                        return clients, users
+                self._unsaved.pop(node_id, None)
+                return clients, users
+
+        results = await asyncio.gather(*(poll_node(*node) for node in nodes))
+        self.last_poll_at = ts
+        self.last_errors = errors
+        self.node_traffic = {
+            node[0]: sum(up + down for counters in pair for up, down in counters.values())
+            for node, pair in zip(nodes, results)
+            if node[0] not in errors
+        }
+        if touched:
+            # Лимиты проверяются только у клиентов, чей счётчик вырос за этот опрос
+            await enforcer.check_quotas(touched)
+        return {node[0]: clients for node, (clients, _) in zip(nodes, results)}
+
+
+collector = StatsCollector()
@@ -0,0 +1,94 @@
+from typing import Dict, Iterable, List, Set
+
+from sqlalchemy import Select, delete, insert, select, union
+from sqlalchemy.orm import Session
+
+from .models import Node, Inbound, User, UserInbound, UserGroup
+
+
+# Доступ пользователя к inbound'у — прямой (user_inbounds) или через группу нод (user_groups);
+# всё разрешается запросами над множествами, без строк на каждую пару пользователь × inbound
+
+
+def member_rows(node_id: int, inbound_id: int | None = None) -> Select:
+    """Включённые пользователи inbound'ов ноды: (inbound_id, id, username, uuid, level) по порядку inbound_id, id."""
+    direct = (
+        select(UserInbound.user_id.label("user_id"), UserInbound.inbound_id.label("inbound_id"))
+        .join(Inbound, Inbound.id == UserInbound.inbound_id)
+        .where(Inbound.node_id == node_id)
+    )
+    grouped = (
+        select(UserGroup.user_id.label("user_id"), Inbound.id.label("inbound_id"))
+        .join(Node, Node.group == UserGroup.group)
+        .join(Inbound, Inbound.node_id == Node.id)
+        .where(Node.id == node_id)
+    )
+    if inbound_id is not None:
+        direct = direct.where(Inbound.id == inbound_id)
+        grouped = grouped.where(Inbound.id == inbound_id)
+    # UNION, а не UNION ALL: пользователь с прямым доступом и доступом через группу попадает в inbound один раз
+    members = union(direct, grouped).subquery()
+    return (
+        select(members.c.inbound_id, User.id, User.username, User.uuid, User.level)
+        .join(User, User.id == members.c.user_id)
+        .where(User.enabled.is_(True))
+        .order_by(members.c.inbound_id.asc(), User.id.asc())
+    )
+
+
+def members_by_inbound(db: Session, node_id: int) -> Dict[int, List]:
+    members: Dict[int, List] = {}
+    for row in db.execute(member_rows(node_id)):
+        members.setdefault(row.inbound_id, []).append(row)
+    return members
+
+
+def user_inbound_ids(user_ids: Iterable[int]) -> Select:
+    ids = list(user_ids)
+    direct = select(UserInbound.inbound_id.label("inbound_id")).where(UserInbound.user_id.in_(ids))
+    grouped = (
+        select(Inbound.id.label("inbound_id"))
+        .join(Node, Node.id == Inbound.node_id)
+        .join(UserGroup, UserGroup.group == Node.group)
+        .where(UserGroup.user_id.in_(ids))
+    )
+    return union(direct, grouped)
+
+
+def user_node_ids(db: Session, user_ids: Iterable[int]) -> Set[int]:
+    """Ноды, в конфиги которых попадают пользователи, — им нужен новый push после изменения."""
+    inbound_ids = user_inbound_ids(user_ids).subquery()
+    return set(db.execute(select(Inbound.node_id).where(Inbound.id.in_(select(inbound_ids.c.inbound_id)))).scalars())
+
+
+def group_usernames(db: Session, groups: Iterable[str]) -> Set[str]:
+    """Пользователи групп нод — их подписки меняются вместе с составом группы."""
+    names = sorted(set(groups))
+    if not names:
+        return set()
+    return set(
+        db.execute(select(User.username).join(UserGroup, UserGroup.user_id == User.id).where(UserGroup.group.in_(names)))
+        .scalars()
+    )
+
+
+def get_access(db: Session, user_id: int):
+    inbound_ids = db.execute(
+        select(UserInbound.inbound_id).where(UserInbound.user_id == user_id).order_by(UserInbound.inbound_id)
+    ).scalars().all()
+    groups = db.execute(
+        select(UserGroup.group).where(UserGroup.user_id == user_id).order_by(UserGroup.group)
+    ).scalars().all()
+    return list(inbound_ids), list(groups)
+
+
+def set_access(db: Session, user_id: int, inbound_ids: Iterable[int], groups: Iterable[str]):
+    """Заменяет членство пользователя целиком, в текущей транзакции."""
+    db.execute(delete(UserInbound).where(UserInbound.user_id == user_id))
+    db.execute(delete(UserGroup).where(UserGroup.user_id == user_id))
+    inbound_rows = [{"user_id": user_id, "inbound_id": i} for i in sorted(set(inbound_ids))]
+    group_rows = [{"user_id": user_id, "group": g} for g in sorted(set(groups))]
+    if inbound_rows:
+        db.execute(insert(UserInbound), inbound_rows)
+    if group_rows:
+        db.execute(insert(UserGroup), group_rows)
@@ -1,7 +1,7 @@
 "use client";
 
 import { useEffect, useMemo, useState } from "react";
-import { apiFetch } from "@/lib/api";
+import { apiFetch, apiFetchAll } from "@/lib/api";
 import type { Client, Inbound } from "@/lib/types";
 import { Button, Card, ErrorBox, Input, Select } from "@/components/ui";
 
@@ -39,7 +39,7 @@ export default function ClientsPage() {
         setLoading(true);
         setErr("");
         try {
-            const [ibs, cls] = await Promise.all([apiFetch<Inbound[]>("/inbounds"), apiFetch<Client[]>(filterInboundId ? `/clients?inbound_id=${encodeURIComponent(filterInboundId)}` : "/clients")]);
+            const [ibs, cls] = await Promise.all([apiFetchAll<Inbound>("/inbounds"), apiFetchAll<Client>(filterInboundId ? `/clients?inbound_id=${encodeURIComponent(filterInboundId)}` : "/clients")]);
             setInbounds(ibs);
             setClients(cls);
             if (selectedId && !cls.some((c) => c.id === selectedId)) setSelectedId(null);
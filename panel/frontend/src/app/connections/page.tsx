@@ -1,7 +1,7 @@
 "use client";
 
 import { useEffect, useMemo, useState } from "react";
-import { apiFetch } from "@/lib/api";
+import { apiFetch, apiFetchAll } from "@/lib/api";
 import type { Client, Inbound, Node } from "@/lib/types";
 import { Button, Card, ErrorBox, Input, Select } from "@/components/ui";
 
@@ -57,7 +57,7 @@ export default function ConnectionsPage() {
         setLoading(true);
         setErr("");
         try {
-            const [ns, ibs, cls] = await Promise.all([apiFetch<Node[]>("/nodes"), apiFetch<Inbound[]>("/inbounds"), apiFetch<Client[]>("/clients")]);
+            const [ns, ibs, cls] = await Promise.all([apiFetchAll<Node>("/nodes"), apiFetchAll<Inbound>("/inbounds"), apiFetchAll<Client>("/clients")]);
             setNodes(ns);
             setInbounds(ibs);
             setClients(cls);
@@ -1,7 +1,7 @@
 "use client";
 
 import { useEffect, useMemo, useState } from "react";
-import { apiFetch } from "@/lib/api";
+import { apiFetch, apiFetchAll } from "@/lib/api";
 import type { Inbound, Node } from "@/lib/types";
 import { Button, Card, ErrorBox, Input, Select } from "@/components/ui";
 
@@ -53,7 +53,7 @@ export default function InboundsPage() {
         setLoading(true);
         setErr("");
         try {
-            const [ns, ibs] = await Promise.all([apiFetch<Node[]>("/nodes"), apiFetch<Inbound[]>(filterNodeId ? `/inbounds?node_id=${encodeURIComponent(filterNodeId)}` : "/inbounds")]);
+            const [ns, ibs] = await Promise.all([apiFetchAll<Node>("/nodes"), apiFetchAll<Inbound>(filterNodeId ? `/inbounds?node_id=${encodeURIComponent(filterNodeId)}` : "/inbounds")]);
             setNodes(ns);
             setInbounds(ibs);
             if (selectedId && !ibs.some((x) => x.id === selectedId)) setSelectedId(null);
@@ -1,7 +1,7 @@
 "use client";
 
 import { useEffect, useState } from "react";
-import { apiFetch } from "@/lib/api";
+import { apiFetch, apiFetchAll } from "@/lib/api";
 import type { Node } from "@/lib/types";
 import { Button, Card, ErrorBox, Input } from "@/components/ui";
 
@@ -36,7 +36,7 @@ export default function NodesPage() {
         setLoading(true);
         setErr("");
         try {
-            const data = await apiFetch<Node[]>("/nodes");
+            const data = await apiFetchAll<Node>("/nodes");
             setNodes(data);
         } catch (e) {
             setErr(e instanceof Error ? e.message : String(e));
@@ -3,7 +3,7 @@ type FetchOpts = {
     body?: unknown;
 };
 
-export async function apiFetch<T>(path: string, opts: FetchOpts = {}): Promise<T> {
+async function apiResponse(path: string, opts: FetchOpts = {}): Promise<Response> {
     // Use Next.js rewrite: /api/* -> backend
     const res = await fetch(`/api${path}`, {
         method: opts.method ?? "GET",
@@ -18,6 +18,11 @@ export async function apiFetch<T>(path: string, opts: FetchOpts = {}): Promise<T
         const text = await res.text();
         throw new Error(`${res.status} ${res.statusText}: ${text}`);
     }
+    return res;
+}
+
+export async function apiFetch<T>(path: string, opts: FetchOpts = {}): Promise<T> {
+    const res = await apiResponse(path, opts);
 
     const ct = res.headers.get("content-type") || "";
     if (ct.includes("application/json")) {
@@ -27,3 +32,16 @@ export async function apiFetch<T>(path: string, opts: FetchOpts = {}): Promise<T
     // eslint-disable-next-line @typescript-eslint/no-explicit-any
     return (await res.text()) as any as T;
 }
+
+export async function apiFetchAll<T>(path: string): Promise<T[]> {
+    // List endpoints are paginated: follow X-Next-Cursor until the last page
+    const items: T[] = [];
+    const sep = path.includes("?") ? "&" : "?";
+    let cursor: string | null = null;
+    do {
+        const res = await apiResponse(cursor ? `${path}${sep}after_id=${encodeURIComponent(cursor)}` : path);
+        items.push(...((await res.json()) as T[]));
+        cursor = res.headers.get("X-Next-Cursor");
+    } while (cursor);
+    return items;
+}